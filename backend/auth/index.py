@@ -3,9 +3,111 @@ import os
 import hashlib
 import psycopg2
 from datetime import datetime, timedelta
+from instrument import instrumented, phase, annotate
+from db import connect, connect_for_read, read_your_writes
+from ratelimit import RateLimiter, store_from_env, client_ip, too_many_requests
+from request import Action, RequestError, parse_body, request_error, ident, keyset, number, text, BIGINT_MAX
 
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Стартовый баланс попадает в сводки экономики как начисление 'signup'
+INSERT_USER = f'''
+    WITH new_user AS (
+        INSERT INTO {SCHEMA}.users (username, email, password_hash, display_name, yn_balance)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING id, username, email, display_name, yn_balance, is_premium, is_verified
+    ), issued AS (
+        INSERT INTO {SCHEMA}.economy_events (kind, item, coins)
+        SELECT 'issue', 'signup', yn_balance FROM new_user
+    )
+    SELECT * FROM new_user
+'''
+
+SELECT_PROFILE = f'''
+    SELECT u.id, u.username, u.display_name, u.avatar_url, u.bio, u.is_premium, u.is_verified,
+           u.verification_color, u.created_at,
+           COALESCE(s.posts_count, 0), COALESCE(s.likes_received, 0), COALESCE(s.comments_received, 0),
+           COALESCE(s.subscribers_count, 0), COALESCE(s.channels_count, 0)
+    FROM {SCHEMA}.users u
+    LEFT JOIN {SCHEMA}.user_stats s ON s.user_id = u.id
+    WHERE u.id = %s
+'''
+
+SELECT_NOTIFICATIONS_PAGE_AFTER = f'''
+    SELECT id, kind, target_id, actors_count, recent_actor_ids, is_read, updated_at
+    FROM {SCHEMA}.notifications
+    WHERE user_id = %s AND (updated_at, id) < (%s, %s)
+    ORDER BY updated_at DESC, id DESC
+    LIMIT %s
+'''
+
+SELECT_NOTIFICATIONS_PAGE = f'''
+    SELECT id, kind, target_id, actors_count, recent_actor_ids, is_read, updated_at
+    FROM {SCHEMA}.notifications
+    WHERE user_id = %s
+    ORDER BY updated_at DESC, id DESC
+    LIMIT %s
+'''
+
+# Непрочитанных не больше одной строки на объект, счёт идёт по частичному индексу
+COUNT_UNREAD_NOTIFICATIONS = f'''
+    SELECT count(*) FROM {SCHEMA}.notifications WHERE user_id = %s AND NOT is_read
+'''
+
+SELECT_ACTORS = f'''
+    SELECT id, username, display_name, avatar_url, is_verified FROM {SCHEMA}.users WHERE id = ANY(%s)
+'''
+
+MARK_NOTIFICATIONS_READ = f'''
+    UPDATE {SCHEMA}.notifications SET is_read = TRUE
+    WHERE user_id = %s AND NOT is_read AND id <= %s
+'''
+
+SELECT_USER_BY_CREDENTIALS = f'SELECT id, username, email, display_name, avatar_url, bio, yn_balance, is_premium, is_verified FROM {SCHEMA}.users WHERE username = %s AND password_hash = %s'
+
+# (размер корзины, токенов в секунду); login ограничен и по IP, и по имени пользователя
+RATE_LIMITS = {
+    'register': (5, 5 / 3600),
+    'login': (20, 1 / 6),
+    'login_username': (10, 1 / 30),
+}
+
+limiter = RateLimiter(RATE_LIMITS, store_from_env())
+
+NOTIFICATIONS_PAGE_SIZE = 30
+NOTIFICATIONS_PAGE_MAX = 100
+# Верхняя граница id для read_notifications без up_to_id
+MAX_NOTIFICATION_ID = 2 ** 63 - 1
+
+READ_ACTIONS = {'notifications'}
+
+# Пределы строк — ширина колонок users
+ACTIONS = {
+    'register': Action({
+        'username': text(50, required=True),
+        'email': text(100, required=True),
+        'password': text(128, required=True, strip=False),
+        'display_name': text(100),
+    }, missing='Заполните все поля'),
+    'login': Action({
+        'username': text(50, required=True),
+        'password': text(128, required=True, strip=False),
+    }, missing='Введите логин и пароль'),
+    'notifications': Action({
+        'user_id': ident(required=True),
+        'cursor': keyset(),
+        'limit': number(),
+    }),
+    'read_notifications': Action({
+        'user_id': ident(required=True),
+        'up_to_id': ident(max_value=BIGINT_MAX),
+    }),
+}
+
+@instrumented('auth')
+@read_your_writes
 def handler(event: dict, context) -> dict:
-    '''API для регистрации и авторизации пользователей'''
+    '''API для регистрации и авторизации пользователей, профиль со статистикой и уведомления'''
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -13,13 +115,80 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    if method == 'GET':
+        annotate(action='profile')
+        user_id = (event.get('queryStringParameters') or {}).get('user_id')
+        
+        if not user_id or not str(user_id).isdigit():
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Требуется user_id'}),
+                'isBase64Encoded': False
+            }
+        
+        try:
+            conn = connect_for_read(event)
+            cur = conn.cursor()
+            cur.execute(SELECT_PROFILE, (int(user_id),))
+            profile = cur.fetchone()
+            
+            if not profile:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Пользователь не найден'}),
+                    'isBase64Encoded': False
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'user': {
+                        'id': profile[0],
+                        'username': profile[1],
+                        'display_name': profile[2],
+                        'avatar_url': profile[3],
+                        'bio': profile[4],
+                        'is_premium': profile[5],
+                        'is_verified': profile[6],
+                        'verification_color': profile[7],
+                        'created_at': profile[8].isoformat() if profile[8] else None
+                    },
+                    'stats': {
+                        'posts_count': profile[9],
+                        'likes_received': profile[10],
+                        'comments_received': profile[11],
+                        'subscribers_count': profile[12],
+                        'channels_count': profile[13]
+                    }
+                }),
+                'isBase64Encoded': False
+            }
+        
+        except Exception as e:
+            annotate(error=repr(e))
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        
+        finally:
+            if 'cur' in locals():
+                cur.close()
+            if 'conn' in locals():
+                conn.close()
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -29,26 +198,27 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        body = json.loads(event.get('body', '{}'))
-        action = body.get('action')
+        with phase('parse'):
+            action, body = parse_body(event, ACTIONS)
+        annotate(action=action)
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = connect_for_read(event) if action in READ_ACTIONS else connect()
         cur = conn.cursor()
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+        
+        # Без IP проверяется только имя пользователя
+        ip = client_ip(event)
+        retry_after = limiter.check(conn, action, ip) if ip else 0.0
+        if not retry_after and action == 'login':
+            retry_after = limiter.check(conn, 'login_username', body.get('username').lower())
+        if retry_after:
+            annotate(rate_limited=True)
+            return too_many_requests(retry_after)
         
         if action == 'register':
-            username = body.get('username', '').strip()
-            email = body.get('email', '').strip().lower()
-            password = body.get('password', '')
-            display_name = body.get('display_name', username).strip()
-            
-            if not username or not email or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Заполните все поля'}),
-                    'isBase64Encoded': False
-                }
+            username = body.get('username')
+            email = body.get('email').lower()
+            password = body.get('password')
+            display_name = body.get('display_name') or username
             
             if len(username) < 3:
                 return {
@@ -61,10 +231,7 @@ def handler(event: dict, context) -> dict:
             password_hash = hashlib.sha256(password.encode()).hexdigest()
             
             try:
-                cur.execute(
-                    f'INSERT INTO {schema}.users (username, email, password_hash, display_name, yn_balance) VALUES (%s, %s, %s, %s, %s) RETURNING id, username, email, display_name, yn_balance, is_premium, is_verified',
-                    (username, email, password_hash, display_name, 100)
-                )
+                cur.execute(INSERT_USER, (username, email, password_hash, display_name, 100))
                 user = cur.fetchone()
                 conn.commit()
                 
@@ -95,23 +262,12 @@ def handler(event: dict, context) -> dict:
                 }
         
         elif action == 'login':
-            username = body.get('username', '').strip()
-            password = body.get('password', '')
-            
-            if not username or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Введите логин и пароль'}),
-                    'isBase64Encoded': False
-                }
+            username = body.get('username')
+            password = body.get('password')
             
             password_hash = hashlib.sha256(password.encode()).hexdigest()
             
-            cur.execute(
-                f'SELECT id, username, email, display_name, avatar_url, bio, yn_balance, is_premium, is_verified FROM {schema}.users WHERE username = %s AND password_hash = %s',
-                (username, password_hash)
-            )
+            cur.execute(SELECT_USER_BY_CREDENTIALS, (username, password_hash))
             user = cur.fetchone()
             
             if not user:
@@ -142,6 +298,81 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
         
+        elif action == 'notifications':
+            user_id = body.get('user_id')
+            cursor = body.get('cursor')
+            limit = body.get('limit') or NOTIFICATIONS_PAGE_SIZE
+            limit = max(1, min(limit, NOTIFICATIONS_PAGE_MAX))
+            
+            if cursor:
+                cursor_ts, cursor_id = cursor
+                cur.execute(SELECT_NOTIFICATIONS_PAGE_AFTER, (user_id, cursor_ts, cursor_id, limit + 1))
+            else:
+                cur.execute(SELECT_NOTIFICATIONS_PAGE, (user_id, limit + 1))
+            rows = cur.fetchall()
+            
+            cur.execute(COUNT_UNREAD_NOTIFICATIONS, (user_id,))
+            unread_count = cur.fetchone()[0]
+            
+            actor_ids = sorted({a for n in rows[:limit] for a in n[4]})
+            actors = {}
+            if actor_ids:
+                cur.execute(SELECT_ACTORS, (actor_ids,))
+                for a in cur.fetchall():
+                    actors[a[0]] = {
+                        'id': a[0],
+                        'username': a[1],
+                        'display_name': a[2],
+                        'avatar_url': a[3],
+                        'is_verified': a[4]
+                    }
+            
+            result = []
+            for n in rows[:limit]:
+                result.append({
+                    'id': n[0],
+                    'kind': n[1],
+                    'target_id': n[2],
+                    'actors_count': n[3],
+                    'actors': [actors[a] for a in n[4] if a in actors],
+                    'is_read': n[5],
+                    'updated_at': n[6].isoformat() if n[6] else None
+                })
+            
+            next_cursor = None
+            if len(rows) > limit:
+                last = rows[limit - 1]
+                next_cursor = f'{last[6].isoformat()}|{last[0]}'
+            
+            with phase('serialize'):
+                response_body = json.dumps({
+                    'notifications': result,
+                    'unread_count': unread_count,
+                    'next_cursor': next_cursor
+                })
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': response_body,
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'read_notifications':
+            user_id = body.get('user_id')
+            up_to_id = body.get('up_to_id') or MAX_NOTIFICATION_ID
+            
+            cur.execute(MARK_NOTIFICATIONS_READ, (user_id, up_to_id))
+            marked = cur.rowcount
+            conn.commit()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'marked': marked}),
+                'isBase64Encoded': False
+            }
+        
         else:
             return {
                 'statusCode': 400,
@@ -150,7 +381,12 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
     
+    except RequestError as e:
+        annotate(rejected=e.status)
+        return request_error(e)
+    
     except Exception as e:
+        annotate(error=repr(e))
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
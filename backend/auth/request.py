@@ -0,0 +1,189 @@
+'''Разбор тела POST-запроса: размер и действие проверяются до json.loads,
+поля — по компактной схеме действия.
+
+Схема функции — словарь {action: Action(...)}; у функции без действий
+(shop) ключ None. parse_body возвращает (action, body), где body содержит
+только поля схемы, уже приведённые к нужным типам, или поднимает
+RequestError — её превращает в ответ request_error.
+'''
+import json
+import re
+from datetime import datetime
+
+KB = 1024
+MB = 1024 * KB
+
+DEFAULT_MAX_BYTES = 16 * KB
+
+INT_MAX = 2 ** 31 - 1
+BIGINT_MAX = 2 ** 63 - 1
+
+# Клиент кладёт action первым полем; ищем его в начале тела, не разбирая JSON
+PEEK_CHARS = 256
+_ACTION_PEEK = re.compile(r'"action"\s*:\s*"([A-Za-z_]{1,32})"')
+
+
+class RequestError(Exception):
+    '''Запрос отклонён до обращения к БД: status — HTTP-код ответа.'''
+
+    def __init__(self, status: int, error: str):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+
+
+def request_error(e: RequestError) -> dict:
+    return {
+        'statusCode': e.status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': e.error}),
+        'isBase64Encoded': False
+    }
+
+
+class Field:
+    '''Поле схемы: coerce приводит значение или поднимает ValueError.'''
+    __slots__ = ('coerce', 'required', 'default')
+
+    def __init__(self, coerce, required: bool = False, default=None):
+        self.coerce = coerce
+        self.required = required
+        self.default = default
+
+
+class Action:
+    '''Схема действия: поля, предел размера тела и текст ошибки для незаполненных полей.'''
+    __slots__ = ('fields', 'max_bytes', 'missing')
+
+    def __init__(self, fields: dict, max_bytes: int = DEFAULT_MAX_BYTES, missing: str = None):
+        self.fields = fields
+        self.max_bytes = max_bytes
+        self.missing = missing
+
+
+def _to_int(value, min_value: int, max_value: int) -> int:
+    # bool — подкласс int, но true вместо id почти наверняка ошибка клиента
+    if type(value) is int:
+        number = value
+    elif type(value) is str and 0 < len(value) <= 20 and value.lstrip('-').isdigit():
+        number = int(value)
+    else:
+        raise ValueError
+    if not min_value <= number <= max_value:
+        raise ValueError
+    return number
+
+
+def ident(required: bool = False, max_value: int = INT_MAX) -> Field:
+    '''Положительный id; строка из цифр тоже принимается.'''
+    return Field(lambda v: _to_int(v, 1, max_value), required)
+
+
+def idents(max_items: int, required: bool = False) -> Field:
+    '''Список id длиной до max_items.'''
+    def coerce(value):
+        if type(value) is not list or len(value) > max_items:
+            raise ValueError
+        # Обычный случай — список целых: проверяем диапазон без поэлементных вызовов
+        if value and all(type(v) is int for v in value) and 1 <= min(value) and max(value) <= INT_MAX:
+            return value
+        return [_to_int(v, 1, INT_MAX) for v in value]
+    return Field(coerce, required, [])
+
+
+def names(max_items: int, max_len: int, required: bool = False) -> Field:
+    '''Список непустых строк длиной до max_items, каждая до max_len символов.'''
+    def coerce(value):
+        if type(value) is not list or len(value) > max_items:
+            raise ValueError
+        if not all(type(v) is str and 0 < len(v) <= max_len for v in value):
+            raise ValueError
+        return value
+    return Field(coerce, required, [])
+
+
+def number(required: bool = False, default=None, min_value: int = -INT_MAX, max_value: int = INT_MAX) -> Field:
+    return Field(lambda v: _to_int(v, min_value, max_value), required, default)
+
+
+def text(max_len: int, required: bool = False, default='', strip: bool = True) -> Field:
+    '''Строка до max_len символов; с strip пустая после обрезки считается незаполненной.'''
+    def coerce(value):
+        if type(value) is not str or len(value) > max_len:
+            raise ValueError
+        return value.strip() if strip else value
+    return Field(coerce, required, default)
+
+
+def flag(default: bool = False) -> Field:
+    def coerce(value):
+        if value is True or value is False:
+            return value
+        if value == 0 or value == 1:
+            return bool(value)
+        raise ValueError
+    return Field(coerce, False, default)
+
+
+def keyset() -> Field:
+    '''Курсор страницы вида created_at|id, приводится к (datetime, id).'''
+    def coerce(value):
+        if type(value) is not str or len(value) > 64:
+            raise ValueError
+        ts, _, row_id = value.rpartition('|')
+        return datetime.fromisoformat(ts), _to_int(row_id, 1, BIGINT_MAX)
+    return Field(coerce)
+
+
+def declared_length(event: dict) -> int:
+    '''Content-Length из заголовков события или 0, если его нет.'''
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'content-length':
+            return int(value) if str(value).isdigit() else 0
+    return 0
+
+
+def parse_body(event: dict, actions: dict) -> tuple:
+    '''Проверяет размер и действие, разбирает JSON и приводит поля по схеме действия.'''
+    raw = event.get('body') or '{}'
+    size = max(declared_length(event), len(raw))
+    limit = max(a.max_bytes for a in actions.values())
+
+    peeked = _ACTION_PEEK.search(raw, 0, PEEK_CHARS)
+    if peeked and peeked.group(1) in actions:
+        limit = actions[peeked.group(1)].max_bytes
+    if size > limit:
+        raise RequestError(413, 'Слишком большой запрос')
+
+    try:
+        body = json.loads(raw)
+    except (ValueError, RecursionError):
+        raise RequestError(400, 'Некорректный JSON')
+    if type(body) is not dict:
+        raise RequestError(400, 'Некорректный JSON')
+
+    action = body.get('action')
+    schema = actions.get(action) if type(action) is str or action is None else None
+    if schema is None:
+        raise RequestError(400, 'Invalid action')
+    # Действие в начале тела могло не совпасть с настоящим
+    if size > schema.max_bytes:
+        raise RequestError(413, 'Слишком большой запрос')
+
+    parsed = {'action': action}
+    missing = []
+    for name, field in schema.fields.items():
+        value = body.get(name)
+        if value is not None:
+            try:
+                value = field.coerce(value)
+            except (ValueError, TypeError):
+                raise RequestError(400, f'Некорректное поле {name}')
+        if value is None or value == '' or value == []:
+            if field.required:
+                missing.append(name)
+            value = field.default
+        parsed[name] = value
+    if missing:
+        raise RequestError(400, schema.missing or f'Требуется {", ".join(missing)}')
+    return action, parsed
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import metrics
+
+
+class TTLCache:
+    '''Кэш в памяти инстанса функции с группами ключей и временем жизни записей.
+
+    Записи сгруппированы (например, по user_id), чтобы при изменении данных
+    пользователя сбрасывать все его записи разом. Кэш живёт между вызовами
+    тёплого инстанса и не разделяется между инстансами, поэтому ttl задаёт
+    верхнюю границу устаревания. devserver вызывает обработчик из нескольких
+    потоков, поэтому словари групп меняются только под блокировкой.
+    '''
+
+    def __init__(self, ttl: float, max_groups: int = 10000, name: str = 'default'):
+        self.ttl = ttl
+        self.max_groups = max_groups
+        self._groups = {}
+        self._lock = threading.Lock()
+        self._hit = (name, 'hit')
+        self._miss = (name, 'miss')
+
+    def get(self, group, key):
+        with self._lock:
+            value = self._lookup(group, key)
+        metrics.CACHE_LOOKUPS.inc(self._miss if value is None else self._hit)
+        return value
+
+    def _lookup(self, group, key):
+        entries = self._groups.get(group)
+        if not entries:
+            return None
+        item = entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del entries[key]
+            return None
+        return value
+
+    def set(self, group, key, value) -> None:
+        with self._lock:
+            entries = self._groups.get(group)
+            if entries is None:
+                if len(self._groups) >= self.max_groups:
+                    self._groups.pop(next(iter(self._groups)))
+                entries = self._groups[group] = {}
+            entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, group) -> None:
+        with self._lock:
+            self._groups.pop(group, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._groups.clear()
@@ -1,10 +1,158 @@
 import json
 import os
 import psycopg2
-import base64
-import boto3
-from datetime import datetime
+from instrument import instrumented, phase, annotate
+from db import connect, connect_for_read, read_your_writes, Statement, execute_atomic
+from storage import cdn_url, decode_and_hash, store_content, release_content
+from mediatype import sniff_media_type
+from cache import TTLCache
+from metrics import TOGGLES
+from request import Action, RequestError, parse_body, request_error, flag, ident, idents, keyset, number, text, MB
 
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+SELECT_CHANNEL = f'''
+    SELECT c.id, c.name, c.description, c.avatar_url, c.subscribers_count, c.is_private, c.created_at,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
+    FROM {SCHEMA}.channels c
+    JOIN {SCHEMA}.users u ON c.owner_id = u.id
+    WHERE c.id = %s
+'''
+
+SELECT_PUBLIC_CHANNELS = f'''
+    SELECT c.id, c.name, c.description, c.avatar_url, c.subscribers_count, c.is_private, c.created_at,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
+    FROM {SCHEMA}.channels c
+    JOIN {SCHEMA}.users u ON c.owner_id = u.id
+    WHERE c.is_private = FALSE
+    ORDER BY c.subscribers_count DESC
+    LIMIT 50
+'''
+
+INSERT_CHANNEL = f'''
+    INSERT INTO {SCHEMA}.channels (name, description, owner_id, avatar_url, avatar_digest, is_private) 
+    VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+'''
+
+INSERT_SUBSCRIPTION = f'''
+    INSERT INTO {SCHEMA}.channel_subscriptions (channel_id, user_id) VALUES (%s, %s)
+'''
+
+SET_SUBSCRIBERS_ONE = f'''
+    UPDATE {SCHEMA}.channels SET subscribers_count = 1 WHERE id = %s
+'''
+
+CREDIT_CHANNEL_REWARD = f'''
+    WITH credited AS (
+        UPDATE {SCHEMA}.users SET yn_balance = yn_balance + 50 WHERE id = %s RETURNING yn_balance
+    ), issued AS (
+        INSERT INTO {SCHEMA}.economy_events (kind, item, coins)
+        SELECT 'issue', 'channel', 50 FROM credited
+    )
+    SELECT yn_balance FROM credited
+'''
+
+
+# Подписка и отписка — по одному запросу: запись, счётчик канала и событие
+# для владельца в одном CTE
+SUBSCRIBE = Statement('channels_subscribe', ('integer', 'integer'), f'''
+    WITH subscribed AS (
+        INSERT INTO {SCHEMA}.channel_subscriptions (channel_id, user_id) VALUES ($1, $2)
+        RETURNING channel_id
+    ), counted AS (
+        UPDATE {SCHEMA}.channels SET subscribers_count = subscribers_count + 1
+        WHERE id = $1 AND EXISTS (SELECT 1 FROM subscribed)
+        RETURNING owner_id
+    ), notified AS (
+        INSERT INTO {SCHEMA}.notification_outbox (recipient_id, kind, target_id, actor_id)
+        SELECT owner_id, 'subscribe', $1, $2 FROM counted WHERE owner_id <> $2
+    )
+    SELECT count(*) FROM subscribed
+''')
+
+UNSUBSCRIBE = Statement('channels_unsubscribe', ('integer', 'integer'), f'''
+    WITH removed AS (
+        DELETE FROM {SCHEMA}.channel_subscriptions WHERE channel_id = $1 AND user_id = $2
+        RETURNING channel_id
+    ), counted AS (
+        UPDATE {SCHEMA}.channels SET subscribers_count = subscribers_count - 1
+        WHERE id = $1 AND EXISTS (SELECT 1 FROM removed)
+    )
+    SELECT count(*) FROM removed
+''')
+
+SELECT_CHANNEL_POSTS = f'''
+    SELECT p.id, p.content, p.media_url, p.media_type, p.likes_count, p.comments_count, p.created_at,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color,
+           p.thumbnail_url, p.media_variants
+    FROM {SCHEMA}.posts p
+    JOIN {SCHEMA}.users u ON p.user_id = u.id
+    WHERE p.channel_id = %s
+    ORDER BY p.created_at DESC
+    LIMIT 50
+'''
+
+SELECT_SUBSCRIPTIONS_PAGE_AFTER = f'''
+    SELECT c.id, c.name, c.description, c.avatar_url, c.subscribers_count, c.is_private, cs.subscribed_at
+    FROM {SCHEMA}.channel_subscriptions cs
+    JOIN {SCHEMA}.channels c ON cs.channel_id = c.id
+    WHERE cs.user_id = %s AND (cs.subscribed_at, cs.channel_id) < (%s, %s)
+    ORDER BY cs.subscribed_at DESC, cs.channel_id DESC
+    LIMIT %s
+'''
+
+SELECT_SUBSCRIPTIONS_PAGE = f'''
+    SELECT c.id, c.name, c.description, c.avatar_url, c.subscribers_count, c.is_private, cs.subscribed_at
+    FROM {SCHEMA}.channel_subscriptions cs
+    JOIN {SCHEMA}.channels c ON cs.channel_id = c.id
+    WHERE cs.user_id = %s
+    ORDER BY cs.subscribed_at DESC, cs.channel_id DESC
+    LIMIT %s
+'''
+
+SELECT_SUBSCRIBED_CHANNEL_IDS = f'''
+    SELECT channel_id FROM {SCHEMA}.channel_subscriptions
+    WHERE user_id = %s AND channel_id = ANY(%s)
+'''
+
+SUBSCRIPTIONS_PAGE_SIZE = 50
+SUBSCRIPTIONS_PAGE_MAX = 100
+SUBSCRIPTIONS_CHECK_MAX = 500
+
+subscriptions_cache = TTLCache(ttl=60, name='subscriptions')
+
+READ_ACTIONS = {'get_posts', 'get_subscriptions', 'check_subscriptions'}
+
+AVATAR_MAX_BYTES = 2 * MB
+
+ACTIONS = {
+    'create': Action({
+        'user_id': ident(required=True),
+        'name': text(100, required=True),
+        'description': text(1000),
+        'is_private': flag(),
+        'avatar_data': text(AVATAR_MAX_BYTES, default=None, strip=False),
+    }, max_bytes=AVATAR_MAX_BYTES, missing='Требуется user_id и name'),
+    'subscribe': Action({
+        'user_id': ident(required=True),
+        'channel_id': ident(required=True),
+    }, missing='Требуется user_id и channel_id'),
+    'get_posts': Action({
+        'channel_id': ident(required=True),
+    }, missing='Требуется channel_id'),
+    'get_subscriptions': Action({
+        'user_id': ident(required=True),
+        'cursor': keyset(),
+        'limit': number(),
+    }),
+    'check_subscriptions': Action({
+        'user_id': ident(required=True),
+        'channel_ids': idents(SUBSCRIPTIONS_CHECK_MAX),
+    }, missing='Требуется user_id и список channel_ids'),
+}
+
+@instrumented('channels')
+@read_your_writes
 def handler(event: dict, context) -> dict:
     '''API для работы с каналами - создание, подписка, получение постов канала'''
     method = event.get('httpMethod', 'GET')
@@ -22,22 +170,24 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        body = {}
+        action = None
+        if method == 'POST':
+            with phase('parse'):
+                action, body = parse_body(event, ACTIONS)
+        
+        if method == 'GET' or action in READ_ACTIONS:
+            conn = connect_for_read(event)
+        else:
+            conn = connect()
         cur = conn.cursor()
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
         
         if method == 'GET':
             query_params = event.get('queryStringParameters') or {}
             channel_id = query_params.get('channel_id')
             
             if channel_id:
-                cur.execute(f'''
-                    SELECT c.id, c.name, c.description, c.avatar_url, c.subscribers_count, c.is_private, c.created_at,
-                           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
-                    FROM {schema}.channels c
-                    JOIN {schema}.users u ON c.owner_id = u.id
-                    WHERE c.id = %s
-                ''', (channel_id,))
+                cur.execute(SELECT_CHANNEL, (channel_id,))
                 channel = cur.fetchone()
                 
                 if not channel:
@@ -66,22 +216,17 @@ def handler(event: dict, context) -> dict:
                     }
                 }
                 
+                with phase('serialize'):
+                    response_body = json.dumps({'channel': result})
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'channel': result}),
+                    'body': response_body,
                     'isBase64Encoded': False
                 }
             else:
-                cur.execute(f'''
-                    SELECT c.id, c.name, c.description, c.avatar_url, c.subscribers_count, c.is_private, c.created_at,
-                           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
-                    FROM {schema}.channels c
-                    JOIN {schema}.users u ON c.owner_id = u.id
-                    WHERE c.is_private = FALSE
-                    ORDER BY c.subscribers_count DESC
-                    LIMIT 50
-                ''')
+                cur.execute(SELECT_PUBLIC_CHANNELS)
                 channels = cur.fetchall()
                 
                 result = []
@@ -104,75 +249,68 @@ def handler(event: dict, context) -> dict:
                         }
                     })
                 
+                with phase('serialize'):
+                    response_body = json.dumps({'channels': result})
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'channels': result}),
+                    'body': response_body,
                     'isBase64Encoded': False
                 }
         
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
+            annotate(action=action)
             
             if action == 'create':
                 user_id = body.get('user_id')
-                name = body.get('name', '').strip()
-                description = body.get('description', '').strip()
-                is_private = body.get('is_private', False)
+                name = body.get('name')
+                description = body.get('description')
+                is_private = body.get('is_private')
                 avatar_data = body.get('avatar_data')
                 
-                if not user_id or not name:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется user_id и name'}),
-                        'isBase64Encoded': False
-                    }
-                
                 avatar_url = None
+                avatar_digest = None
                 if avatar_data:
                     try:
-                        s3 = boto3.client('s3',
-                            endpoint_url='https://bucket.poehali.dev',
-                            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-                        )
-                        
-                        file_key = f'channels/{user_id}_{datetime.now().timestamp()}.jpg'
-                        file_data = base64.b64decode(avatar_data)
-                        
-                        s3.put_object(
-                            Bucket='files',
-                            Key=file_key,
-                            Body=file_data,
-                            ContentType='image/jpeg'
-                        )
-                        
-                        avatar_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
+                        file_data, avatar_digest = decode_and_hash(avatar_data)
+                    except ValueError:
+                        file_data = None
+                    detected = sniff_media_type(file_data) if file_data else None
+                    if not detected or not detected[0].startswith('image/'):
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Аватар должен быть изображением'}),
+                            'isBase64Encoded': False
+                        }
+                    avatar_type, avatar_ext = detected
+                    try:
+                        file_key = store_content(conn, file_data, avatar_digest, avatar_type, avatar_ext)
+                        avatar_url = cdn_url(file_key)
                     except Exception as e:
+                        avatar_digest = None
                         print(f"Error uploading avatar: {e}")
                 
-                cur.execute(f'''
-                    INSERT INTO {schema}.channels (name, description, owner_id, avatar_url, is_private) 
-                    VALUES (%s, %s, %s, %s, %s) RETURNING id
-                ''', (name, description, user_id, avatar_url, is_private))
-                channel_id = cur.fetchone()[0]
-                
-                cur.execute(f'''
-                    INSERT INTO {schema}.channel_subscriptions (channel_id, user_id) VALUES (%s, %s)
-                ''', (channel_id, user_id))
-                
-                cur.execute(f'''
-                    UPDATE {schema}.channels SET subscribers_count = 1 WHERE id = %s
-                ''', (channel_id,))
-                
-                cur.execute(f'''
-                    UPDATE {schema}.users SET yn_balance = yn_balance + 50 WHERE id = %s RETURNING yn_balance
-                ''', (user_id,))
-                new_balance = cur.fetchone()[0]
-                
-                conn.commit()
+                # Ссылка на аватар уже зафиксирована: если канал не сохранится
+                # (занятое имя, неизвестный пользователь), её нужно отпустить
+                try:
+                    cur.execute(INSERT_CHANNEL, (name, description, user_id, avatar_url, avatar_digest, is_private))
+                    channel_id = cur.fetchone()[0]
+                    
+                    cur.execute(INSERT_SUBSCRIPTION, (channel_id, user_id))
+                    
+                    cur.execute(SET_SUBSCRIBERS_ONE, (channel_id,))
+                    
+                    cur.execute(CREDIT_CHANNEL_REWARD, (user_id,))
+                    new_balance = cur.fetchone()[0]
+                    
+                    conn.commit()
+                except Exception:
+                    if avatar_digest:
+                        release_content(conn, avatar_digest)
+                    raise
+                subscriptions_cache.invalidate(user_id)
                 
                 return {
                     'statusCode': 200,
@@ -189,22 +327,10 @@ def handler(event: dict, context) -> dict:
                 user_id = body.get('user_id')
                 channel_id = body.get('channel_id')
                 
-                if not all([user_id, channel_id]):
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется user_id и channel_id'}),
-                        'isBase64Encoded': False
-                    }
-                
                 try:
-                    cur.execute(f'''
-                        INSERT INTO {schema}.channel_subscriptions (channel_id, user_id) VALUES (%s, %s)
-                    ''', (channel_id, user_id))
-                    cur.execute(f'''
-                        UPDATE {schema}.channels SET subscribers_count = subscribers_count + 1 WHERE id = %s
-                    ''', (channel_id,))
-                    conn.commit()
+                    execute_atomic(conn, SUBSCRIBE, (channel_id, user_id))
+                    subscriptions_cache.invalidate(user_id)
+                    TOGGLES.inc(('subscribe', 'on'))
                     
                     return {
                         'statusCode': 200,
@@ -214,13 +340,9 @@ def handler(event: dict, context) -> dict:
                     }
                 except psycopg2.IntegrityError:
                     conn.rollback()
-                    cur.execute(f'''
-                        DELETE FROM {schema}.channel_subscriptions WHERE channel_id = %s AND user_id = %s
-                    ''', (channel_id, user_id))
-                    cur.execute(f'''
-                        UPDATE {schema}.channels SET subscribers_count = subscribers_count - 1 WHERE id = %s
-                    ''', (channel_id,))
-                    conn.commit()
+                    execute_atomic(conn, UNSUBSCRIBE, (channel_id, user_id))
+                    subscriptions_cache.invalidate(user_id)
+                    TOGGLES.inc(('subscribe', 'off'))
                     
                     return {
                         'statusCode': 200,
@@ -232,23 +354,7 @@ def handler(event: dict, context) -> dict:
             elif action == 'get_posts':
                 channel_id = body.get('channel_id')
                 
-                if not channel_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется channel_id'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(f'''
-                    SELECT p.id, p.content, p.media_url, p.media_type, p.likes_count, p.comments_count, p.created_at,
-                           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
-                    FROM {schema}.posts p
-                    JOIN {schema}.users u ON p.user_id = u.id
-                    WHERE p.channel_id = %s
-                    ORDER BY p.created_at DESC
-                    LIMIT 50
-                ''', (channel_id,))
+                cur.execute(SELECT_CHANNEL_POSTS, (channel_id,))
                 posts = cur.fetchall()
                 
                 result = []
@@ -261,6 +367,8 @@ def handler(event: dict, context) -> dict:
                         'likes_count': p[4],
                         'comments_count': p[5],
                         'created_at': p[6].isoformat() if p[6] else None,
+                        'thumbnail_url': p[13],
+                        'media_variants': p[14],
                         'author': {
                             'id': p[7],
                             'username': p[8],
@@ -271,10 +379,86 @@ def handler(event: dict, context) -> dict:
                         }
                     })
                 
+                with phase('serialize'):
+                    response_body = json.dumps({'posts': result})
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': response_body,
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'get_subscriptions':
+                user_id = body.get('user_id')
+                cursor = body.get('cursor')
+                limit = body.get('limit') or SUBSCRIPTIONS_PAGE_SIZE
+                limit = max(1, min(limit, SUBSCRIPTIONS_PAGE_MAX))
+                cache_key = ('page', cursor, limit)
+                page = subscriptions_cache.get(user_id, cache_key)
+                
+                if page is None:
+                    if cursor:
+                        cursor_ts, cursor_id = cursor
+                        cur.execute(SELECT_SUBSCRIPTIONS_PAGE_AFTER, (user_id, cursor_ts, cursor_id, limit + 1))
+                    else:
+                        cur.execute(SELECT_SUBSCRIPTIONS_PAGE, (user_id, limit + 1))
+                    rows = cur.fetchall()
+                    
+                    result = []
+                    for ch in rows[:limit]:
+                        result.append({
+                            'id': ch[0],
+                            'name': ch[1],
+                            'description': ch[2],
+                            'avatar_url': ch[3],
+                            'subscribers_count': ch[4],
+                            'is_private': ch[5],
+                            'subscribed_at': ch[6].isoformat() if ch[6] else None
+                        })
+                    
+                    next_cursor = None
+                    if len(rows) > limit:
+                        last = rows[limit - 1]
+                        next_cursor = f'{last[6].isoformat()}|{last[0]}'
+                    
+                    page = {'channels': result, 'next_cursor': next_cursor}
+                    subscriptions_cache.set(user_id, cache_key, page)
+                
+                with phase('serialize'):
+                    response_body = json.dumps(page)
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'posts': result}),
+                    'body': response_body,
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'check_subscriptions':
+                user_id = body.get('user_id')
+                channel_ids = list(dict.fromkeys(body.get('channel_ids')))
+                
+                subscribed = {}
+                missing = []
+                for cid in channel_ids:
+                    cached = subscriptions_cache.get(user_id, ('member', cid))
+                    if cached is None:
+                        missing.append(cid)
+                    else:
+                        subscribed[cid] = cached
+                
+                if missing:
+                    cur.execute(SELECT_SUBSCRIBED_CHANNEL_IDS, (user_id, missing))
+                    found = {row[0] for row in cur.fetchall()}
+                    for cid in missing:
+                        subscribed[cid] = cid in found
+                        subscriptions_cache.set(user_id, ('member', cid), cid in found)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'subscribed': {str(cid): subscribed[cid] for cid in channel_ids}}),
                     'isBase64Encoded': False
                 }
             
@@ -294,8 +478,12 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
     
+    except RequestError as e:
+        annotate(rejected=e.status)
+        return request_error(e)
+    
     except Exception as e:
-        print(f"Error: {e}")
+        annotate(error=repr(e))
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -1,10 +1,195 @@
 import json
 import os
 import psycopg2
-import base64
-import boto3
 from datetime import datetime, timedelta
+from instrument import instrumented, phase, annotate
+from db import connect, connect_for_read, read_your_writes, Statement, execute, execute_atomic
+from storage import cdn_url, decode_and_hash, store_content, begin_store_content, finish_store_content, release_content
+from mediatype import sniff_media_type
+from jobs import enqueue
+from ratelimit import RateLimiter, store_from_env, too_many_requests
+from cache import TTLCache
+from metrics import TOGGLES
+from request import Action, RequestError, parse_body, request_error, flag, ident, idents, text, MB
 
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+SELECT_FEED = f'''
+    SELECT p.id, p.content, p.media_url, p.media_type, p.channel_id, 
+           p.likes_count, p.comments_count, p.created_at, p.is_boosted,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color, u.is_premium,
+           p.thumbnail_url, p.media_variants
+    FROM {SCHEMA}.posts p
+    JOIN {SCHEMA}.users u ON p.user_id = u.id
+    ORDER BY p.is_boosted DESC, p.created_at DESC
+    LIMIT 50
+'''
+
+SELECT_POSTS_BY_IDS = f'''
+    SELECT p.id, p.content, p.media_url, p.media_type, p.channel_id, 
+           p.likes_count, p.comments_count, p.created_at, p.is_boosted,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color, u.is_premium,
+           p.thumbnail_url, p.media_variants
+    FROM {SCHEMA}.posts p
+    JOIN {SCHEMA}.users u ON p.user_id = u.id
+    WHERE p.id = ANY(%s)
+'''
+
+# Даты постов в условии оставляют в плане только их секции likes
+SELECT_LIKE_STATES = f'''
+    SELECT post_id, is_super_like FROM {SCHEMA}.likes
+    WHERE user_id = %s AND post_id = ANY(%s) AND post_created_at = ANY(%s)
+'''
+
+SELECT_SUPER_LIKES = f'SELECT super_likes_count FROM {SCHEMA}.users WHERE id = %s'
+
+# Пишущие действия — по одному запросу: вставка, счётчики, событие для
+# уведомлений, награда и её событие для сводок экономики в одном CTE, то есть
+# один обмен с сервером.
+# Буст берётся из строки автора внутри того же запроса.
+CREATE_POST = Statement('posts_create', ('integer', 'text', 'text', 'text', 'text', 'integer'), f'''
+    WITH new_post AS (
+        INSERT INTO {SCHEMA}.posts (user_id, content, media_url, media_type, media_digest, channel_id, is_boosted)
+        SELECT $1, $2, $3, $4, $5, $6, COALESCE(boost_active_until > NOW(), FALSE)
+        FROM {SCHEMA}.users WHERE id = $1
+        RETURNING id
+    ), credited AS (
+        UPDATE {SCHEMA}.users SET yn_balance = yn_balance + 20
+        WHERE id = $1 AND EXISTS (SELECT 1 FROM new_post)
+        RETURNING yn_balance
+    ), issued AS (
+        INSERT INTO {SCHEMA}.economy_events (kind, item, coins)
+        SELECT 'issue', 'post', 20 FROM credited
+    )
+    SELECT (SELECT id FROM new_post), (SELECT yn_balance FROM credited)
+''')
+
+# likes секционированы по дате создания поста: она берётся из posts, и условие
+# на post_created_at оставляет в плане одну секцию. Супер-лайк и награда меняют
+# одну строку users — в CTE это должен быть один UPDATE.
+LIKE_POST = Statement('posts_like', ('integer', 'boolean', 'integer'), f'''
+    WITH new_like AS (
+        INSERT INTO {SCHEMA}.likes (user_id, post_id, post_created_at, is_super_like)
+        SELECT $1, id, created_at, $2 FROM {SCHEMA}.posts WHERE id = $3
+        RETURNING post_id
+    ), counted AS (
+        UPDATE {SCHEMA}.posts SET likes_count = likes_count + CASE WHEN $2 THEN 3 ELSE 1 END
+        WHERE id = $3 AND EXISTS (SELECT 1 FROM new_like)
+        RETURNING user_id
+    ), notified AS (
+        INSERT INTO {SCHEMA}.notification_outbox (recipient_id, kind, target_id, actor_id)
+        SELECT user_id, 'like', $3, $1 FROM counted WHERE user_id <> $1
+    ), credited AS (
+        UPDATE {SCHEMA}.users
+        SET yn_balance = yn_balance + 5,
+            super_likes_count = super_likes_count - CASE WHEN $2 THEN 1 ELSE 0 END
+        WHERE id = $1 AND EXISTS (SELECT 1 FROM new_like)
+        RETURNING yn_balance
+    ), issued AS (
+        INSERT INTO {SCHEMA}.economy_events (kind, item, coins)
+        SELECT 'issue', 'like', 5 FROM credited
+    )
+    SELECT EXISTS (SELECT 1 FROM new_like), (SELECT yn_balance FROM credited)
+''')
+
+UNLIKE_POST = Statement('posts_unlike', ('integer', 'integer'), f'''
+    WITH removed AS (
+        DELETE FROM {SCHEMA}.likes
+        WHERE user_id = $1 AND post_id = $2
+          AND post_created_at = (SELECT created_at FROM {SCHEMA}.posts WHERE id = $2)
+        RETURNING is_super_like
+    )
+    UPDATE {SCHEMA}.posts
+    SET likes_count = likes_count - (SELECT CASE WHEN is_super_like THEN 3 ELSE 1 END FROM removed)
+    WHERE id = $2 AND EXISTS (SELECT 1 FROM removed)
+    RETURNING likes_count
+''')
+
+ADD_COMMENT = Statement('posts_comment', ('integer', 'integer', 'text'), f'''
+    WITH counted AS (
+        UPDATE {SCHEMA}.posts SET comments_count = comments_count + 1 WHERE id = $1
+        RETURNING id, user_id
+    ), new_comment AS (
+        INSERT INTO {SCHEMA}.comments (post_id, user_id, content)
+        SELECT id, $2, $3 FROM counted
+        RETURNING id
+    ), notified AS (
+        INSERT INTO {SCHEMA}.notification_outbox (recipient_id, kind, target_id, actor_id)
+        SELECT user_id, 'comment', $1, $2 FROM counted WHERE user_id <> $2
+    ), credited AS (
+        UPDATE {SCHEMA}.users SET yn_balance = yn_balance + 10
+        WHERE id = $2 AND EXISTS (SELECT 1 FROM counted)
+        RETURNING yn_balance
+    ), issued AS (
+        INSERT INTO {SCHEMA}.economy_events (kind, item, coins)
+        SELECT 'issue', 'comment', 10 FROM credited
+    )
+    SELECT (SELECT id FROM new_comment), (SELECT yn_balance FROM credited)
+''')
+
+SELECT_COMMENTS = f'''
+    SELECT c.id, c.content, c.likes_count, c.created_at,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
+    FROM {SCHEMA}.comments c
+    JOIN {SCHEMA}.users u ON c.user_id = u.id
+    WHERE c.post_id = %s AND c.created_at >= (SELECT created_at FROM {SCHEMA}.posts WHERE id = %s)
+    ORDER BY c.created_at ASC
+'''
+
+# (размер корзины, токенов в секунду) на пользователя
+RATE_LIMITS = {
+    'create': (10, 1 / 60),
+    'like': (60, 0.5),
+    'comment': (20, 0.2),
+}
+
+limiter = RateLimiter(RATE_LIMITS, store_from_env())
+
+GET_MANY_MAX = 300
+
+# Загрузка файла поста параллельно с запросами к БД; 0 — последовательно, для сравнения
+OVERLAP_UPLOADS = os.environ.get('MEDIA_UPLOAD_OVERLAP', '1') != '0'
+
+# Пост целиком по id; лайк и комментарий сбрасывают запись в своём инстансе,
+# в остальных счётчики отстают не больше чем на ttl
+posts_cache = TTLCache(ttl=10, max_groups=20000, name='posts')
+
+READ_ACTIONS = {'get_comments', 'get_many'}
+
+# Тело с файлом в base64; остальным действиям хватает предела по умолчанию
+MEDIA_MAX_BYTES = 10 * MB
+POST_CONTENT_MAX = 10000
+COMMENT_CONTENT_MAX = 2000
+
+ACTIONS = {
+    'create': Action({
+        'user_id': ident(required=True),
+        'content': text(POST_CONTENT_MAX, required=True),
+        'channel_id': ident(),
+        'media_data': text(MEDIA_MAX_BYTES, default=None, strip=False),
+        'media_type': text(100, default=None),
+    }, max_bytes=MEDIA_MAX_BYTES, missing='Требуется user_id и content'),
+    'like': Action({
+        'user_id': ident(required=True),
+        'post_id': ident(required=True),
+        'use_super_like': flag(),
+    }, missing='Требуется user_id и post_id'),
+    'comment': Action({
+        'user_id': ident(required=True),
+        'post_id': ident(required=True),
+        'content': text(COMMENT_CONTENT_MAX, required=True),
+    }, missing='Требуется user_id, post_id и content'),
+    'get_many': Action({
+        'user_id': ident(),
+        'post_ids': idents(GET_MANY_MAX, required=True),
+    }, missing=f'Требуется post_ids: от 1 до {GET_MANY_MAX} id'),
+    'get_comments': Action({
+        'post_id': ident(required=True),
+    }, missing='Требуется post_id'),
+}
+
+@instrumented('posts')
+@read_your_writes
 def handler(event: dict, context) -> dict:
     '''API для работы с постами, комментариями и историями'''
     method = event.get('httpMethod', 'GET')
@@ -22,20 +207,20 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        body = {}
+        action = None
+        if method == 'POST':
+            with phase('parse'):
+                action, body = parse_body(event, ACTIONS)
+        
+        if method == 'GET' or action in READ_ACTIONS:
+            conn = connect_for_read(event)
+        else:
+            conn = connect()
         cur = conn.cursor()
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
         
         if method == 'GET':
-            cur.execute(f'''
-                SELECT p.id, p.content, p.media_url, p.media_type, p.channel_id, 
-                       p.likes_count, p.comments_count, p.created_at, p.is_boosted,
-                       u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color, u.is_premium
-                FROM {schema}.posts p
-                JOIN {schema}.users u ON p.user_id = u.id
-                ORDER BY p.is_boosted DESC, p.created_at DESC
-                LIMIT 50
-            ''')
+            cur.execute(SELECT_FEED)
             posts = cur.fetchall()
             
             result = []
@@ -50,6 +235,8 @@ def handler(event: dict, context) -> dict:
                     'comments_count': post[6],
                     'created_at': post[7].isoformat() if post[7] else None,
                     'is_boosted': post[8],
+                    'thumbnail_url': post[16],
+                    'media_variants': post[17],
                     'author': {
                         'id': post[9],
                         'username': post[10],
@@ -61,78 +248,101 @@ def handler(event: dict, context) -> dict:
                     }
                 })
             
+            with phase('serialize'):
+                response_body = json.dumps({'posts': result})
+            
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'posts': result}),
+                'body': response_body,
                 'isBase64Encoded': False
             }
         
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
+            annotate(action=action)
             
-            if action == 'create':
-                user_id = body.get('user_id')
-                content = body.get('content', '').strip()
-                channel_id = body.get('channel_id')
-                media_data = body.get('media_data')
-                media_type = body.get('media_type')
-                
-                if not user_id or not content:
+            # Формат файла проверяется до лимита и до записи в БД: отклонённый файл не тратит токен
+            detected = None
+            if action == 'create' and body.get('media_data') and body.get('media_type'):
+                try:
+                    file_data, media_digest = decode_and_hash(body.get('media_data'))
+                    detected = sniff_media_type(file_data)
+                except ValueError:
+                    pass
+                if not detected:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется user_id и content'}),
+                        'body': json.dumps({'error': 'Неподдерживаемый формат медиа'}),
                         'isBase64Encoded': False
                     }
+            
+            if action in RATE_LIMITS and body.get('user_id'):
+                retry_after = limiter.check(conn, action, body.get('user_id'))
+                if retry_after:
+                    annotate(rate_limited=True)
+                    return too_many_requests(retry_after)
+            
+            if action == 'create':
+                user_id = body.get('user_id')
+                content = body.get('content')
+                channel_id = body.get('channel_id')
                 
                 media_url = None
+                media_type = None
+                pending_upload = None
                 
-                if media_data and media_type:
+                if detected:
+                    media_type, file_ext = detected
                     try:
-                        s3 = boto3.client('s3',
-                            endpoint_url='https://bucket.poehali.dev',
-                            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-                        )
-                        
-                        file_ext = 'jpg' if media_type.startswith('image') else 'mp4'
-                        file_key = f'posts/{user_id}_{datetime.now().timestamp()}.{file_ext}'
-                        
-                        file_data = base64.b64decode(media_data)
-                        
-                        s3.put_object(
-                            Bucket='files',
-                            Key=file_key,
-                            Body=file_data,
-                            ContentType=media_type
-                        )
-                        
-                        media_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
+                        if OVERLAP_UPLOADS:
+                            file_key, pending_upload = begin_store_content(conn, file_data, media_digest, media_type, file_ext)
+                        else:
+                            file_key = store_content(conn, file_data, media_digest, media_type, file_ext)
+                        media_url = cdn_url(file_key)
                     except Exception as e:
+                        # Сбой мог оборвать транзакцию соединения; пост сохраняется без медиа
                         print(f"Error uploading media: {e}")
+                        conn.rollback()
                 
-                cur.execute(f'''
-                    SELECT boost_active_until FROM {schema}.users WHERE id = %s
-                ''', (user_id,))
-                user_data = cur.fetchone()
-                is_boosted = False
-                if user_data and user_data[0]:
-                    is_boosted = datetime.now() < user_data[0]
-                
-                cur.execute(f'''
-                    INSERT INTO {schema}.posts (user_id, content, media_url, media_type, channel_id, is_boosted) 
-                    VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
-                ''', (user_id, content, media_url, media_type, channel_id, is_boosted))
-                post_id = cur.fetchone()[0]
-                
-                cur.execute(f'''
-                    UPDATE {schema}.users SET yn_balance = yn_balance + 20 WHERE id = %s RETURNING yn_balance
-                ''', (user_id,))
-                new_balance = cur.fetchone()[0]
+                if not media_url:
+                    post_id, new_balance = execute_atomic(conn, CREATE_POST, (user_id, content, None, None, None, channel_id))
+                else:
+                    # Файл грузится в фоне, пока идёт запрос к БД; ждём его только перед коммитом.
+                    # Ссылка на объект уже зафиксирована: если пост не сохранится, её нужно отпустить
+                    try:
+                        execute(cur, CREATE_POST, (user_id, content, media_url, media_type, media_digest, channel_id))
+                        post_id, new_balance = cur.fetchone()
+                        
+                        if post_id is not None:
+                            enqueue(cur, 'media.process', {'owner_type': 'post', 'owner_id': post_id, 'source_key': file_key, 'media_type': media_type})
+                    except Exception:
+                        release_content(conn, media_digest, pending_upload)
+                        raise
+                    
+                    if post_id is None:
+                        release_content(conn, media_digest, pending_upload)
+                    else:
+                        try:
+                            finish_store_content(conn, media_digest, pending_upload)
+                        except Exception as e:
+                            # Транзакция поста откачена, ссылка отпущена; как и при синхронной загрузке, пост сохраняется без медиа
+                            print(f"Error uploading media: {e}")
+                            post_id, new_balance = execute_atomic(conn, CREATE_POST, (user_id, content, None, None, None, channel_id))
+                        else:
+                            try:
+                                conn.commit()
+                            except Exception:
+                                release_content(conn, media_digest)
+                                raise
                 
-                conn.commit()
+                if post_id is None:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Пользователь не найден'}),
+                        'isBase64Encoded': False
+                    }
                 
                 return {
                     'statusCode': 200,
@@ -148,18 +358,10 @@ def handler(event: dict, context) -> dict:
             elif action == 'like':
                 user_id = body.get('user_id')
                 post_id = body.get('post_id')
-                use_super_like = body.get('use_super_like', False)
-                
-                if not user_id or not post_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется user_id и post_id'}),
-                        'isBase64Encoded': False
-                    }
+                use_super_like = body.get('use_super_like')
                 
                 if use_super_like:
-                    cur.execute(f'SELECT super_likes_count FROM {schema}.users WHERE id = %s', (user_id,))
+                    cur.execute(SELECT_SUPER_LIKES, (user_id,))
                     super_likes = cur.fetchone()[0] or 0
                     if super_likes <= 0:
                         return {
@@ -170,25 +372,16 @@ def handler(event: dict, context) -> dict:
                         }
                 
                 try:
-                    cur.execute(f'''
-                        INSERT INTO {schema}.likes (user_id, post_id, is_super_like) VALUES (%s, %s, %s)
-                    ''', (user_id, post_id, use_super_like))
-                    
-                    like_value = 3 if use_super_like else 1
-                    cur.execute(f'''
-                        UPDATE {schema}.posts SET likes_count = likes_count + %s WHERE id = %s
-                    ''', (like_value, post_id))
-                    
-                    if use_super_like:
-                        cur.execute(f'''
-                            UPDATE {schema}.users SET super_likes_count = super_likes_count - 1 WHERE id = %s
-                        ''', (user_id,))
-                    
-                    cur.execute(f'''
-                        UPDATE {schema}.users SET yn_balance = yn_balance + 5 WHERE id = %s RETURNING yn_balance
-                    ''', (user_id,))
-                    new_balance = cur.fetchone()[0]
-                    conn.commit()
+                    liked, new_balance = execute_atomic(conn, LIKE_POST, (user_id, use_super_like, post_id))
+                    if not liked:
+                        return {
+                            'statusCode': 404,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Пост не найден'}),
+                            'isBase64Encoded': False
+                        }
+                    posts_cache.invalidate(post_id)
+                    TOGGLES.inc(('like', 'on'))
                     
                     return {
                         'statusCode': 200,
@@ -202,20 +395,11 @@ def handler(event: dict, context) -> dict:
                         'isBase64Encoded': False
                     }
                 except psycopg2.IntegrityError:
+                    # Лайк уже есть: повторное нажатие снимает его
                     conn.rollback()
-                    cur.execute(f'''
-                        SELECT is_super_like FROM {schema}.likes WHERE user_id = %s AND post_id = %s
-                    ''', (user_id, post_id))
-                    was_super = cur.fetchone()[0]
-                    like_value = 3 if was_super else 1
-                    
-                    cur.execute(f'''
-                        DELETE FROM {schema}.likes WHERE user_id = %s AND post_id = %s
-                    ''', (user_id, post_id))
-                    cur.execute(f'''
-                        UPDATE {schema}.posts SET likes_count = likes_count - %s WHERE id = %s
-                    ''', (like_value, post_id))
-                    conn.commit()
+                    execute_atomic(conn, UNLIKE_POST, (user_id, post_id))
+                    posts_cache.invalidate(post_id)
+                    TOGGLES.inc(('like', 'off'))
                     
                     return {
                         'statusCode': 200,
@@ -227,32 +411,17 @@ def handler(event: dict, context) -> dict:
             elif action == 'comment':
                 user_id = body.get('user_id')
                 post_id = body.get('post_id')
-                content = body.get('content', '').strip()
+                content = body.get('content')
                 
-                if not all([user_id, post_id, content]):
+                comment_id, new_balance = execute_atomic(conn, ADD_COMMENT, (post_id, user_id, content))
+                if comment_id is None:
                     return {
-                        'statusCode': 400,
+                        'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется user_id, post_id и content'}),
+                        'body': json.dumps({'error': 'Пост не найден'}),
                         'isBase64Encoded': False
                     }
-                
-                cur.execute(f'''
-                    INSERT INTO {schema}.comments (post_id, user_id, content) 
-                    VALUES (%s, %s, %s) RETURNING id
-                ''', (post_id, user_id, content))
-                comment_id = cur.fetchone()[0]
-                
-                cur.execute(f'''
-                    UPDATE {schema}.posts SET comments_count = comments_count + 1 WHERE id = %s
-                ''', (post_id,))
-                
-                cur.execute(f'''
-                    UPDATE {schema}.users SET yn_balance = yn_balance + 10 WHERE id = %s RETURNING yn_balance
-                ''', (user_id,))
-                new_balance = cur.fetchone()[0]
-                
-                conn.commit()
+                posts_cache.invalidate(post_id)
                 
                 return {
                     'statusCode': 200,
@@ -265,25 +434,77 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
             
+            elif action == 'get_many':
+                user_id = body.get('user_id')
+                post_ids = body.get('post_ids')
+                
+                found = {}
+                for post_id in post_ids:
+                    cached = posts_cache.get(post_id, 'post')
+                    if cached is not None:
+                        found[post_id] = cached
+                misses = list(set(post_ids) - found.keys())
+                annotate(get_many=len(post_ids), cache_hits=len(found))
+                
+                if misses:
+                    cur.execute(SELECT_POSTS_BY_IDS, (misses,))
+                    for post in cur.fetchall():
+                        found[post[0]] = {
+                            'id': post[0],
+                            'content': post[1],
+                            'media_url': post[2],
+                            'media_type': post[3],
+                            'channel_id': post[4],
+                            'likes_count': post[5],
+                            'comments_count': post[6],
+                            'created_at': post[7].isoformat() if post[7] else None,
+                            'is_boosted': post[8],
+                            'thumbnail_url': post[16],
+                            'media_variants': post[17],
+                            'author': {
+                                'id': post[9],
+                                'username': post[10],
+                                'display_name': post[11],
+                                'avatar_url': post[12],
+                                'is_verified': post[13],
+                                'verification_color': post[14],
+                                'is_premium': post[15]
+                            }
+                        }
+                        posts_cache.set(post[0], 'post', found[post[0]])
+                
+                liked = {}
+                if user_id and found:
+                    created = list({datetime.fromisoformat(p['created_at']) for p in found.values() if p['created_at']})
+                    cur.execute(SELECT_LIKE_STATES, (user_id, list(found), created))
+                    liked = dict(cur.fetchall())
+                
+                result = []
+                for post_id in dict.fromkeys(post_ids):
+                    if post_id in found:
+                        post = dict(found[post_id])
+                        if user_id:
+                            post['liked'] = post_id in liked
+                            post['is_super_like'] = liked.get(post_id, False)
+                        result.append(post)
+                
+                with phase('serialize'):
+                    response_body = json.dumps({
+                        'posts': result,
+                        'missing': [post_id for post_id in dict.fromkeys(post_ids) if post_id not in found]
+                    })
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': response_body,
+                    'isBase64Encoded': False
+                }
+            
             elif action == 'get_comments':
                 post_id = body.get('post_id')
                 
-                if not post_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется post_id'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(f'''
-                    SELECT c.id, c.content, c.likes_count, c.created_at,
-                           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
-                    FROM {schema}.comments c
-                    JOIN {schema}.users u ON c.user_id = u.id
-                    WHERE c.post_id = %s
-                    ORDER BY c.created_at ASC
-                ''', (post_id,))
+                cur.execute(SELECT_COMMENTS, (post_id, post_id))
                 comments = cur.fetchall()
                 
                 result = []
@@ -303,10 +524,13 @@ def handler(event: dict, context) -> dict:
                         }
                     })
                 
+                with phase('serialize'):
+                    response_body = json.dumps({'comments': result})
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'comments': result}),
+                    'body': response_body,
                     'isBase64Encoded': False
                 }
             
@@ -326,8 +550,12 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
     
+    except RequestError as e:
+        annotate(rejected=e.status)
+        return request_error(e)
+    
     except Exception as e:
-        print(f"Error: {e}")
+        annotate(error=repr(e))
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,195 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import psycopg2.extensions
+
+import metrics
+
+MAX_QUERIES_LOGGED = 50
+PROFILE_TOP_N = 15
+
+_cold_start = True
+_current_trace = ContextVar('current_trace', default=None)
+
+
+class RequestTrace:
+    '''Замеры одного вызова: фазы, запросы к БД и произвольные поля для лога.'''
+
+    def __init__(self, function_name: str, event: dict):
+        self.function_name = function_name
+        self.method = event.get('httpMethod', 'GET')
+        self.fields = {}
+        self.phases = {}
+        self.queries = []
+        self.query_count = 0
+        self.round_trips = 0
+
+    def add_phase(self, name: str, elapsed_ms: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed_ms
+
+    def add_query(self, query, elapsed_ms: float, rowcount: int) -> None:
+        self.query_count += 1
+        self.add_phase('db', elapsed_ms)
+        if len(self.queries) < MAX_QUERIES_LOGGED:
+            if isinstance(query, bytes):
+                query = query.decode('utf-8', 'replace')
+            self.queries.append({
+                'sql': ' '.join(str(query).split())[:160],
+                'ms': round(elapsed_ms, 3),
+                'rows': rowcount
+            })
+
+
+@contextmanager
+def phase(name: str):
+    '''Засекает время фазы (connect, s3, serialize, ...) текущего вызова.'''
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_phase(name, (time.perf_counter() - start) * 1000)
+
+
+def round_trip(count: int = 1) -> None:
+    '''Учитывает обмен с БД вне курсора: COMMIT, ROLLBACK.'''
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.round_trips += count
+
+
+def annotate(**fields) -> None:
+    '''Добавляет поля (action, error, ...) в лог текущего вызова.'''
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+class TracedCursor(psycopg2.extensions.cursor):
+    '''Курсор, засекающий каждый запрос; подключается через cursor_factory.'''
+
+    def execute(self, query, vars=None):
+        try:
+            trace = _current_trace.get()
+            if trace is None:
+                return super().execute(query, vars)
+            # Вне транзакции psycopg2 сначала отдельно отправляет BEGIN
+            conn = self.connection
+            opens = not conn.autocommit and conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            trace.round_trips += 2 if opens else 1
+            start = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                trace.add_query(query, (time.perf_counter() - start) * 1000, self.rowcount)
+        except psycopg2.Error as e:
+            metrics.DB_ERRORS.inc((type(e).__name__,))
+            raise
+
+
+def _profile_summary(profiler: cProfile.Profile) -> list:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative')
+    summary = []
+    for func in stats.fcn_list[:PROFILE_TOP_N]:
+        calls, _, total_time, cumulative_time, _ = stats.stats[func]
+        filename, line, name = func
+        summary.append({
+            'func': f'{os.path.basename(filename)}:{line}:{name}',
+            'calls': calls,
+            'tottime_ms': round(total_time * 1000, 3),
+            'cumtime_ms': round(cumulative_time * 1000, 3)
+        })
+    return summary
+
+
+def emit(record: dict) -> None:
+    '''Пишет запись в лог; локальные стенды подменяют её своим сборщиком.'''
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+def record_metrics(trace: RequestTrace, status, total_ms: float) -> None:
+    '''Счётчик и гистограмма вызова; действие без action — метод запроса.'''
+    action = str(trace.fields.get('action') or trace.method.lower())
+    metrics.REQUESTS.inc((action, str(status)))
+    metrics.REQUEST_SECONDS.observe((action,), total_ms / 1000)
+    error = trace.fields.get('error')
+    if error and status == 500:
+        # В поле лога — repr исключения; в метку идёт только имя класса
+        metrics.HANDLER_ERRORS.inc((action, str(error).split('(', 1)[0]))
+
+
+def instrumented(function_name: str):
+    '''Оборачивает handler: пишет в stdout JSON-строку с таймингами вызова.
+
+    PROFILE_SAMPLE_RATE (0..1) включает cProfile для доли вызовов; сводка
+    профиля прикладывается к логу, если вызов дольше PROFILE_SLOW_MS.
+    Раз в METRICS_PUSH_SECONDS в лог пишется и выгрузка метрик инстанса.
+    '''
+    metrics.bind(function_name)
+
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            global _cold_start
+            cold_start = _cold_start
+            _cold_start = False
+
+            trace = RequestTrace(function_name, event)
+            token = _current_trace.set(trace)
+            sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+            profiler = cProfile.Profile() if sample_rate and random.random() < sample_rate else None
+            response = None
+            start = time.perf_counter()
+            try:
+                if profiler:
+                    response = profiler.runcall(handler, event, context)
+                else:
+                    response = handler(event, context)
+                return response
+            except Exception as e:
+                trace.fields['error'] = repr(e)
+                raise
+            finally:
+                total_ms = (time.perf_counter() - start) * 1000
+                _current_trace.reset(token)
+                body = response.get('body', '') if isinstance(response, dict) else ''
+                record = {
+                    'type': 'request',
+                    'function': function_name,
+                    'method': trace.method,
+                    **trace.fields,
+                    'status': response.get('statusCode') if isinstance(response, dict) else 500,
+                    'cold_start': cold_start,
+                    'total_ms': round(total_ms, 3),
+                    'phases': {name: round(ms, 3) for name, ms in trace.phases.items()},
+                    'query_count': trace.query_count,
+                    'round_trips': trace.round_trips,
+                    'queries': trace.queries,
+                    'response_bytes': len(body.encode('utf-8')) if isinstance(body, str) else len(body or b'')
+                }
+                if profiler and total_ms >= float(os.environ.get('PROFILE_SLOW_MS', '500')):
+                    record['profile'] = _profile_summary(profiler)
+                emit(record)
+                record_metrics(trace, record['status'], total_ms)
+                if metrics.push_due():
+                    emit({
+                        'type': 'metrics',
+                        'function': function_name,
+                        'instance': metrics.INSTANCE,
+                        'exposition': metrics.render()
+                    })
+        return wrapper
+    return decorate
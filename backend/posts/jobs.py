@@ -0,0 +1,18 @@
+import json
+import os
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+INSERT_JOB = f'''
+    INSERT INTO {SCHEMA}.jobs (task, payload, run_at, dedupe_key)
+    VALUES (%s, %s, NOW() + %s * INTERVAL '1 second', %s)
+    ON CONFLICT (dedupe_key) WHERE dedupe_key IS NOT NULL AND status IN ('pending', 'running') DO NOTHING
+'''
+
+
+def enqueue(cur, task: str, payload: dict, delay_seconds: float = 0, dedupe_key: str = None) -> None:
+    '''Ставит задачу в очередь в текущей транзакции: она выполнится, только если транзакция закоммитится.
+
+    dedupe_key не даёт поставить вторую такую же задачу, пока первая не выполнена.
+    '''
+    cur.execute(INSERT_JOB, (task, json.dumps(payload), delay_seconds, dedupe_key))
@@ -0,0 +1,133 @@
+import json
+import math
+import os
+import threading
+import time
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+LEASE_FRACTION = 0.2
+LEASE_TTL = 10.0
+MAX_LOCAL_ENTRIES = 10000
+
+_AVAILABLE = f'LEAST(%(capacity)s, r.tokens + %(rate)s * EXTRACT(EPOCH FROM NOW() - r.updated_at))'
+
+TAKE_TOKENS = f'''
+    INSERT INTO {SCHEMA}.rate_limits AS r (bucket, tokens, granted, updated_at)
+    VALUES (%(bucket)s, %(capacity)s - LEAST(%(count)s, %(capacity)s), LEAST(%(count)s, %(capacity)s), NOW())
+    ON CONFLICT (bucket) DO UPDATE SET
+        granted = LEAST(%(count)s, FLOOR({_AVAILABLE})),
+        tokens = {_AVAILABLE} - LEAST(%(count)s, FLOOR({_AVAILABLE})),
+        updated_at = NOW()
+    RETURNING granted, tokens
+'''
+
+
+class MemoryBucketStore:
+    '''Корзины в памяти процесса: для локального запуска и как замена общего хранилища в тестах.'''
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, conn, bucket: str, capacity: int, rate: float, count: int):
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(bucket, (capacity, now))
+            tokens = min(capacity, tokens + rate * (now - updated))
+            granted = min(count, int(tokens))
+            self._buckets[bucket] = (tokens - granted, now)
+            return granted, tokens - granted
+
+
+class PostgresBucketStore:
+    '''Общие для всех инстансов корзины в таблице rate_limits: пополнение и списание одним UPSERT.'''
+
+    def take(self, conn, bucket: str, capacity: int, rate: float, count: int):
+        cur = conn.cursor()
+        cur.execute(TAKE_TOKENS, {'bucket': bucket, 'capacity': capacity, 'rate': rate, 'count': count})
+        granted, tokens = cur.fetchone()
+        conn.commit()
+        cur.close()
+        return int(granted), float(tokens)
+
+
+def store_from_env():
+    '''RATE_LIMIT_STORE: postgres (по умолчанию), memory или off.'''
+    kind = os.environ.get('RATE_LIMIT_STORE', 'postgres')
+    if kind == 'off':
+        return None
+    if kind == 'memory':
+        return MemoryBucketStore()
+    return PostgresBucketStore()
+
+
+def client_ip(event: dict):
+    '''IP клиента или None: без адреса все такие клиенты попали бы в одну корзину.'''
+    return event.get('requestContext', {}).get('identity', {}).get('sourceIp') or None
+
+
+class RateLimiter:
+    '''Token bucket на пару (действие, субъект) поверх общего хранилища.
+
+    Инстанс берёт из общей корзины сразу несколько токенов (аренду) и тратит
+    их без обращения к БД. Получив отказ, он запоминает, когда появится
+    следующий токен, и до этого момента отклоняет запросы тоже без БД.
+    Неиспользованная аренда сгорает через LEASE_TTL секунд.
+    '''
+
+    def __init__(self, limits: dict, store):
+        self.limits = limits
+        self.store = store
+        self._leases = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+
+    def check(self, conn, action: str, subject) -> float:
+        '''Списывает токен; возвращает 0, если действие разрешено, иначе через сколько секунд повторить.'''
+        if self.store is None or action not in self.limits:
+            return 0.0
+        capacity, rate = self.limits[action]
+        bucket = f'{action}:{subject}'
+        now = time.monotonic()
+
+        with self._lock:
+            blocked_until = self._blocked_until.get(bucket, 0.0)
+            if now < blocked_until:
+                return blocked_until - now
+            leased, expires = self._leases.get(bucket, (0, 0.0))
+            if leased > 0 and now < expires:
+                self._leases[bucket] = (leased - 1, expires)
+                return 0.0
+
+        lease = max(1, int(capacity * LEASE_FRACTION))
+        granted, tokens = self.store.take(conn, bucket, capacity, rate, lease)
+
+        with self._lock:
+            if len(self._leases) + len(self._blocked_until) > MAX_LOCAL_ENTRIES:
+                self._prune(now)
+            if granted:
+                self._leases[bucket] = (granted - 1, now + LEASE_TTL)
+                self._blocked_until.pop(bucket, None)
+                return 0.0
+            retry_after = (1 - tokens) / rate
+            self._blocked_until[bucket] = now + retry_after
+            self._leases.pop(bucket, None)
+            return retry_after
+
+    def _prune(self, now: float) -> None:
+        self._leases = {k: v for k, v in self._leases.items() if v[0] > 0 and v[1] > now}
+        self._blocked_until = {k: v for k, v in self._blocked_until.items() if v > now}
+
+
+def too_many_requests(retry_after: float) -> dict:
+    return {
+        'statusCode': 429,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Retry-After': str(math.ceil(retry_after))
+        },
+        'body': json.dumps({'error': 'Слишком много запросов, попробуйте позже', 'retry_after': math.ceil(retry_after)}),
+        'isBase64Encoded': False
+    }
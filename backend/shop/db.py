@@ -0,0 +1,278 @@
+import functools
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+import psycopg2
+import psycopg2.extensions
+
+import metrics
+from instrument import annotate, phase, round_trip, TracedCursor
+
+FRESH_WINDOW_SECONDS = 5
+REPLICA_MAX_LAG_SECONDS = 2.0
+REPLICA_CONNECT_TIMEOUT = 2
+REPLICA_RETRY_SECONDS = 30.0
+LAG_CHECK_INTERVAL = 5.0
+# Размер пула на функцию; 0 — новое соединение на каждый вызов, как в облаке
+POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', '0'))
+
+SELECT_REPLICA_LAG = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+_request = ContextVar('db_request', default=None)
+_replica_state = {'down_until': 0.0, 'checked_at': 0.0, 'lagging': False}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    '''Соединение, которое close() возвращает в пул, если оно из пула.
+
+    prepared — имена подготовленных на соединении запросов; есть только у
+    соединений из пула, одноразовым готовить запросы незачем.
+    '''
+
+    pool = None
+    prepared = None
+
+    def commit(self):
+        if self.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            round_trip()
+        super().commit()
+
+    def rollback(self):
+        if self.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            round_trip()
+        super().rollback()
+
+    def close(self):
+        pool, self.pool = self.pool, None
+        if pool is None or self.closed:
+            return super().close()
+        pool.release(self)
+
+
+class PrimaryConnection(PooledConnection):
+    '''Соединение с основной базой; коммит помечает запрос как пишущий.'''
+
+    def commit(self):
+        super().commit()
+        request = _request.get()
+        if request is not None:
+            request['wrote'] = True
+
+
+class ConnectionPool:
+    '''Соединения, переживающие вызовы обработчика в одном процессе.
+
+    Нужен локальному серверу и стендам, где один процесс обслуживает много
+    запросов параллельно. Свободные соединения берутся последними
+    вернувшимися; при нехватке acquire ждёт, пока соединение не вернут.
+    '''
+
+    def __init__(self, name: str, dsn: str, size: int, **kwargs):
+        self.name = name
+        self.dsn = dsn
+        self.kwargs = kwargs
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _report(self) -> None:
+        metrics.POOL_IN_USE.set((self.name,), self._in_use)
+        metrics.POOL_IDLE.set((self.name,), len(self._idle))
+
+    def acquire(self):
+        start = time.perf_counter()
+        self._slots.acquire()
+        metrics.POOL_WAIT_SECONDS.observe((self.name,), time.perf_counter() - start)
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            self._report()
+        if conn is None or conn.closed:
+            try:
+                conn = psycopg2.connect(self.dsn, **self.kwargs)
+                metrics.DB_CONNECTS.inc((self.name,))
+            except Exception:
+                with self._lock:
+                    self._in_use -= 1
+                    self._report()
+                self._slots.release()
+                raise
+            conn.prepared = set()
+        conn.pool = self
+        return conn
+
+    def release(self, conn) -> None:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with self._lock:
+                self._idle.append(conn)
+        except psycopg2.Error:
+            conn.close()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._report()
+            self._slots.release()
+
+
+def _connect(name: str, dsn: str, **kwargs):
+    if not POOL_SIZE:
+        conn = psycopg2.connect(dsn, **kwargs)
+        metrics.DB_CONNECTS.inc((name,))
+        return conn
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(name, ConnectionPool(name, dsn, POOL_SIZE, **kwargs))
+    return pool.acquire()
+
+
+def connect():
+    with phase('connect'):
+        return _connect('primary', os.environ['DATABASE_URL'], connection_factory=PrimaryConnection,
+                        cursor_factory=TracedCursor)
+
+
+class Statement:
+    '''Горячий запрос с параметрами $1..$n и их типами для PREPARE.
+
+    На соединении из пула запрос готовится один раз и дальше выполняется
+    через EXECUTE без повторного разбора; на одноразовом соединении
+    отправляется как обычный запрос. Один и тот же $n можно использовать
+    в тексте несколько раз.
+    '''
+
+    def __init__(self, name: str, types: tuple, sql: str):
+        self.name = name
+        self.sql = sql
+        self.arity = len(types)
+        self.prepare_sql = f'PREPARE {name} ({", ".join(types)}) AS {sql}'
+        self.execute_sql = f'EXECUTE {name} ({", ".join(["%s"] * self.arity)})' if types else f'EXECUTE {name}'
+        self.plain_sql = re.sub(r'\$(\d+)', r'%(p\1)s', sql)
+
+
+def execute(cur, statement: Statement, params: tuple = ()) -> None:
+    '''Выполняет Statement: EXECUTE подготовленного запроса или обычный запрос.'''
+    conn = cur.connection
+    if conn.prepared is None:
+        cur.execute(statement.plain_sql, {f'p{i + 1}': value for i, value in enumerate(params)})
+        return
+    if statement.name not in conn.prepared:
+        # PREPARE не транзакционный: откат транзакции вызывающего его не отменит
+        cur.execute(statement.prepare_sql)
+        conn.prepared.add(statement.name)
+    cur.execute(statement.execute_sql, params)
+
+
+def execute_atomic(conn, statement: Statement, params: tuple = ()):
+    '''Выполняет пишущий запрос отдельной транзакцией и возвращает первую строку.
+
+    Если транзакция не открыта, запрос идёт в autocommit: без BEGIN и COMMIT
+    вся транзакция занимает один обмен с сервером. Иначе запрос выполняется
+    в открытой транзакции, и она коммитится.
+    '''
+    cur = conn.cursor()
+    try:
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.autocommit = True
+            try:
+                execute(cur, statement, params)
+                row = cur.fetchone()
+            finally:
+                conn.autocommit = False
+            request = _request.get()
+            if request is not None:
+                request['wrote'] = True
+        else:
+            execute(cur, statement, params)
+            row = cur.fetchone()
+            conn.commit()
+        return row
+    finally:
+        cur.close()
+
+
+def _wants_primary(event: dict) -> bool:
+    params = event.get('queryStringParameters') or {}
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    marker = params.get('fresh_until') or headers.get('x-fresh-until')
+    try:
+        return marker is not None and time.time() * 1000 < int(marker)
+    except ValueError:
+        return False
+
+
+def _replica_usable(conn) -> bool:
+    '''Проверка отставания не чаще раза в LAG_CHECK_INTERVAL секунд на инстанс.'''
+    now = time.monotonic()
+    if now - _replica_state['checked_at'] < LAG_CHECK_INTERVAL:
+        return not _replica_state['lagging']
+    cur = conn.cursor()
+    cur.execute(SELECT_REPLICA_LAG)
+    lag = float(cur.fetchone()[0])
+    cur.close()
+    _replica_state['checked_at'] = now
+    _replica_state['lagging'] = lag > REPLICA_MAX_LAG_SECONDS
+    annotate(replica_lag=round(lag, 3))
+    return not _replica_state['lagging']
+
+
+def connect_for_read(event: dict):
+    '''Соединение для чтения: реплика, если она задана, жива и не отстаёт.
+
+    На основную базу читаем, если клиент недавно писал (маркер fresh_until
+    от предыдущего ответа), если DATABASE_REPLICA_URL не задан, реплика
+    не отвечает (повторная попытка через REPLICA_RETRY_SECONDS) или отстаёт
+    больше чем на REPLICA_MAX_LAG_SECONDS.
+    '''
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    if not replica_url or _wants_primary(event) or time.monotonic() < _replica_state['down_until']:
+        annotate(db='primary')
+        return connect()
+    try:
+        with phase('connect'):
+            conn = _connect('replica', replica_url, connect_timeout=REPLICA_CONNECT_TIMEOUT,
+                            connection_factory=PooledConnection, cursor_factory=TracedCursor)
+        conn.set_session(readonly=True)
+        if _replica_usable(conn):
+            annotate(db='replica')
+            return conn
+        conn.close()
+    except psycopg2.OperationalError as e:
+        print(f'Replica unavailable, using primary: {e}')
+        _replica_state['down_until'] = time.monotonic() + REPLICA_RETRY_SECONDS
+    annotate(db='primary')
+    return connect()
+
+
+def read_your_writes(handler):
+    '''Добавляет к ответу на пишущий запрос заголовок X-Fresh-Until.
+
+    Клиент возвращает его значение в параметре fresh_until, и следующие
+    FRESH_WINDOW_SECONDS его чтения идут на основную базу, а не на реплику.
+    '''
+    @functools.wraps(handler)
+    def wrapper(event: dict, context) -> dict:
+        token = _request.set({'wrote': False})
+        try:
+            response = handler(event, context)
+            if _request.get()['wrote'] and isinstance(response, dict):
+                headers = response.setdefault('headers', {})
+                headers['X-Fresh-Until'] = str(int((time.time() + FRESH_WINDOW_SECONDS) * 1000))
+                headers['Access-Control-Expose-Headers'] = 'X-Fresh-Until'
+            return response
+        finally:
+            _request.reset(token)
+    return wrapper
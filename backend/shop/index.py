@@ -1,8 +1,116 @@
 import json
 import os
-import psycopg2
-from datetime import datetime, timedelta
+from datetime import timedelta
+from instrument import instrumented, phase, annotate
+from db import connect, connect_for_read, read_your_writes
+from request import Action, RequestError, parse_body, request_error, ident, keyset, number, text
 
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+SELECT_BALANCE = f'SELECT yn_balance FROM {SCHEMA}.users WHERE id = %s'
+
+DEBIT_BALANCE = f'UPDATE {SCHEMA}.users SET yn_balance = yn_balance - %s WHERE id = %s RETURNING yn_balance'
+
+# Продажа попадает в сводки экономики тем же запросом, что и в историю покупок
+INSERT_PURCHASE = f'''
+    WITH purchase AS (
+        INSERT INTO {SCHEMA}.purchases (user_id, item_type, item_name, price)
+        VALUES (%s, %s, %s, %s)
+        RETURNING item_type, price
+    )
+    INSERT INTO {SCHEMA}.economy_events (kind, item, coins)
+    SELECT 'sale', item_type, price FROM purchase
+'''
+
+# История покупок идёт по индексу (user_id, created_at DESC, id DESC);
+# курсор — created_at|id последней строки страницы
+SELECT_PURCHASES_PAGE_AFTER = f'''
+    SELECT id, item_type, item_name, price, created_at
+    FROM {SCHEMA}.purchases
+    WHERE user_id = %s AND (created_at, id) < (%s, %s)
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+'''
+
+SELECT_PURCHASES_PAGE = f'''
+    SELECT id, item_type, item_name, price, created_at
+    FROM {SCHEMA}.purchases
+    WHERE user_id = %s
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+'''
+
+PURCHASES_PAGE_SIZE = 20
+PURCHASES_PAGE_MAX = 100
+
+# Параметры GET истории покупок; limit больше PURCHASES_PAGE_MAX урезается
+HISTORY_PARAMS = {
+    'user_id': ident(),
+    'limit': number(default=PURCHASES_PAGE_SIZE, min_value=1),
+    'cursor': keyset(),
+}
+
+# У покупки нет поля action — схема под ключом None
+ACTIONS = {
+    None: Action({
+        'user_id': ident(required=True),
+        'item_type': text(50, required=True),
+        'item_name': text(100, required=True),
+        'price': number(required=True, min_value=1),
+    }, missing='Missing required fields'),
+}
+
+ACTIVATE_PREMIUM = f'''
+    UPDATE {SCHEMA}.users 
+    SET is_premium = TRUE, 
+        verification_color = 'blue',
+        is_verified = TRUE 
+    WHERE id = %s
+'''
+
+ACTIVATE_VERIFICATION = f'''
+    UPDATE {SCHEMA}.users 
+    SET is_verified = TRUE, 
+        verification_color = 'red' 
+    WHERE id = %s
+'''
+
+# Окно буста открывается сразу и продлевает действующее; закроет его задача
+# entitlements.tick. boost_active_until — конец самого дальнего окна, его
+# читает создание поста.
+GRANT_BOOST = f'''
+    WITH granted AS (
+        INSERT INTO {SCHEMA}.entitlements (user_id, kind, starts_at, ends_at, state)
+        SELECT id, 'boost', NOW(), GREATEST(boost_active_until, NOW()) + %s, 'active'
+        FROM {SCHEMA}.users WHERE id = %s
+        RETURNING user_id, ends_at
+    )
+    UPDATE {SCHEMA}.users u SET boost_active_until = g.ends_at
+    FROM granted g WHERE u.id = g.user_id
+'''
+
+BOOST_DURATION = timedelta(hours=24)
+
+SET_CUSTOM_THEME = f'''
+    UPDATE {SCHEMA}.users 
+    SET custom_theme = 'red-dark' 
+    WHERE id = %s
+'''
+
+ADD_SUPER_LIKES = f'''
+    UPDATE {SCHEMA}.users 
+    SET super_likes_count = super_likes_count + 50 
+    WHERE id = %s
+'''
+
+ENABLE_PREMIUM_EMOJI = f'''
+    UPDATE {SCHEMA}.users 
+    SET premium_emoji_enabled = TRUE 
+    WHERE id = %s
+'''
+
+@instrumented('shop')
+@read_your_writes
 def handler(event: dict, context) -> dict:
     '''API для покупок в магазине с премиум функциями'''
     method = event.get('httpMethod', 'GET')
@@ -12,13 +120,86 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    if method == 'GET':
+        annotate(action='history')
+        params = event.get('queryStringParameters') or {}
+        query = {}
+        for name, field in HISTORY_PARAMS.items():
+            value = params.get(name)
+            try:
+                query[name] = field.coerce(value) if value else field.default
+            except (ValueError, TypeError):
+                annotate(rejected=400)
+                return request_error(RequestError(400, f'Некорректный параметр {name}'))
+        
+        if query['user_id'] is None:
+            annotate(rejected=400)
+            return request_error(RequestError(400, 'Требуется user_id'))
+        
+        user_id = query['user_id']
+        cursor = query['cursor']
+        limit = min(query['limit'], PURCHASES_PAGE_MAX)
+        
+        try:
+            conn = connect_for_read(event)
+            cur = conn.cursor()
+            
+            if cursor:
+                cur.execute(SELECT_PURCHASES_PAGE_AFTER, (user_id, *cursor, limit + 1))
+            else:
+                cur.execute(SELECT_PURCHASES_PAGE, (user_id, limit + 1))
+            rows = cur.fetchall()
+            
+            purchases = []
+            for p in rows[:limit]:
+                purchases.append({
+                    'id': p[0],
+                    'item_type': p[1],
+                    'item_name': p[2],
+                    'price': p[3],
+                    'created_at': p[4].isoformat() if p[4] else None
+                })
+            
+            next_cursor = None
+            if len(rows) > limit:
+                last = rows[limit - 1]
+                next_cursor = f'{last[4].isoformat()}|{last[0]}'
+            
+            with phase('serialize'):
+                response_body = json.dumps({
+                    'purchases': purchases,
+                    'next_cursor': next_cursor
+                })
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': response_body,
+                'isBase64Encoded': False
+            }
+        
+        except Exception as e:
+            annotate(error=repr(e))
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        
+        finally:
+            if 'cur' in locals():
+                cur.close()
+            if 'conn' in locals():
+                conn.close()
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -28,25 +209,18 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        body = json.loads(event.get('body', '{}'))
+        with phase('parse'):
+            _, body = parse_body(event, ACTIONS)
         user_id = body.get('user_id')
         item_type = body.get('item_type')
         item_name = body.get('item_name')
         price = body.get('price')
+        annotate(action='purchase', item_type=item_type)
         
-        if not user_id or not item_type or not item_name or not price:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Missing required fields'}),
-                'isBase64Encoded': False
-            }
-        
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = connect()
         cur = conn.cursor()
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
         
-        cur.execute(f'SELECT yn_balance FROM {schema}.users WHERE id = %s', (user_id,))
+        cur.execute(SELECT_BALANCE, (user_id,))
         result = cur.fetchone()
         
         if not result:
@@ -67,69 +241,35 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
         
-        cur.execute(
-            f'UPDATE {schema}.users SET yn_balance = yn_balance - %s WHERE id = %s RETURNING yn_balance',
-            (price, user_id)
-        )
+        cur.execute(DEBIT_BALANCE, (price, user_id))
         new_balance = cur.fetchone()[0]
         
-        cur.execute(
-            f'INSERT INTO {schema}.purchases (user_id, item_type, item_name, price) VALUES (%s, %s, %s, %s)',
-            (user_id, item_type, item_name, price)
-        )
+        cur.execute(INSERT_PURCHASE, (user_id, item_type, item_name, price))
         
         message = f'{item_name} успешно приобретен!'
         
         if item_type == 'premium_account':
-            cur.execute(f'''
-                UPDATE {schema}.users 
-                SET is_premium = TRUE, 
-                    verification_color = 'blue',
-                    is_verified = TRUE 
-                WHERE id = %s
-            ''', (user_id,))
+            cur.execute(ACTIVATE_PREMIUM, (user_id,))
             message = 'Премиум аккаунт активирован! Получена синяя галочка и доступ ко всем темам радуги!'
         
         elif item_type == 'verification':
-            cur.execute(f'''
-                UPDATE {schema}.users 
-                SET is_verified = TRUE, 
-                    verification_color = 'red' 
-                WHERE id = %s
-            ''', (user_id,))
+            cur.execute(ACTIVATE_VERIFICATION, (user_id,))
             message = 'Верификация получена! Красная галочка установлена!'
         
         elif item_type == 'boost':
-            boost_until = datetime.now() + timedelta(hours=24)
-            cur.execute(f'''
-                UPDATE {schema}.users 
-                SET boost_active_until = %s 
-                WHERE id = %s
-            ''', (boost_until, user_id))
+            cur.execute(GRANT_BOOST, (BOOST_DURATION, user_id))
             message = 'Бустер активирован! Ваши посты будут в топе 24 часа!'
         
         elif item_type == 'custom_theme':
-            cur.execute(f'''
-                UPDATE {schema}.users 
-                SET custom_theme = 'red-dark' 
-                WHERE id = %s
-            ''', (user_id,))
+            cur.execute(SET_CUSTOM_THEME, (user_id,))
             message = 'Красно-темная тема установлена в профиль!'
         
         elif item_type == 'super_likes':
-            cur.execute(f'''
-                UPDATE {schema}.users 
-                SET super_likes_count = super_likes_count + 50 
-                WHERE id = %s
-            ''', (user_id,))
+            cur.execute(ADD_SUPER_LIKES, (user_id,))
             message = '50 супер-лайков добавлено! Каждый супер-лайк считается за 3 обычных!'
         
         elif item_type == 'premium_emoji':
-            cur.execute(f'''
-                UPDATE {schema}.users 
-                SET premium_emoji_enabled = TRUE 
-                WHERE id = %s
-            ''', (user_id,))
+            cur.execute(ENABLE_PREMIUM_EMOJI, (user_id,))
             message = 'Премиум эмодзи разблокированы! Теперь вы можете добавлять эмодзи в посты!'
         
         conn.commit()
@@ -145,7 +285,12 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
+    except RequestError as e:
+        annotate(rejected=e.status)
+        return request_error(e)
+    
     except Exception as e:
+        annotate(error=repr(e))
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -1,12 +1,125 @@
 import json
 import os
-import psycopg2
-import base64
-import boto3
 from datetime import datetime, timedelta
+from instrument import instrumented, phase, annotate
+from db import connect, connect_for_read, read_your_writes
+from storage import cdn_url, decode_and_hash, store_content, release_content
+from mediatype import sniff_media_type
+from jobs import enqueue
+from sketch import viewer_hash, register_update, estimate
+from ratelimit import RateLimiter, store_from_env, too_many_requests
+from request import Action, RequestError, parse_body, request_error, ident, keyset, number, text, MB
 
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+SELECT_ACTIVE_STORIES = f'''
+    SELECT s.id, s.media_url, s.media_type, s.views_count, s.created_at, s.expires_at,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color,
+           s.thumbnail_url, s.media_variants
+    FROM {SCHEMA}.stories s
+    JOIN {SCHEMA}.users u ON s.user_id = u.id
+    WHERE s.expires_at > NOW()
+    ORDER BY s.created_at DESC
+'''
+
+INSERT_STORY = f'''
+    INSERT INTO {SCHEMA}.stories (user_id, media_url, media_type, media_digest, expires_at) 
+    VALUES (%s, %s, %s, %s, %s) RETURNING id
+'''
+
+CREDIT_STORY_REWARD = f'''
+    WITH credited AS (
+        UPDATE {SCHEMA}.users SET yn_balance = yn_balance + 15 WHERE id = %s RETURNING yn_balance
+    ), issued AS (
+        INSERT INTO {SCHEMA}.economy_events (kind, item, coins)
+        SELECT 'issue', 'story', 15 FROM credited
+    )
+    SELECT yn_balance FROM credited
+'''
+
+INSERT_STORY_VIEW = f'''
+    INSERT INTO {SCHEMA}.story_views (story_id, user_id, story_created_at)
+    SELECT id, %s, created_at FROM {SCHEMA}.stories WHERE id = %s AND (views_count < %s OR %s)
+    ON CONFLICT (story_id, user_id, story_created_at) DO NOTHING
+    RETURNING id
+'''
+
+INCREMENT_STORY_VIEWS = f'''
+    UPDATE {SCHEMA}.stories SET views_count = views_count + 1 WHERE id = %s AND views_count < %s
+'''
+
+RAISE_VIEWER_REGISTER = f'''
+    UPDATE {SCHEMA}.stories SET viewer_sketch = set_byte(viewer_sketch, %s, %s)
+    WHERE id = %s AND get_byte(viewer_sketch, %s) < %s
+    RETURNING viewer_sketch
+'''
+
+SET_ESTIMATED_VIEWS = f'''
+    UPDATE {SCHEMA}.stories SET views_count = %s WHERE id = %s AND views_count >= %s AND views_count < %s
+'''
+
+SELECT_STORY_VIEWS_COUNT = f'''
+    SELECT user_id, views_count, created_at FROM {SCHEMA}.stories WHERE id = %s
+'''
+
+SELECT_STORY_VIEWERS_PAGE_AFTER = f'''
+    SELECT u.id, u.username, u.display_name, u.avatar_url, u.is_verified, sv.viewed_at
+    FROM {SCHEMA}.story_views sv
+    JOIN {SCHEMA}.users u ON sv.user_id = u.id
+    WHERE sv.story_id = %s AND sv.story_created_at = %s AND (sv.viewed_at, sv.user_id) < (%s, %s)
+    ORDER BY sv.viewed_at DESC, sv.user_id DESC
+    LIMIT %s
+'''
+
+SELECT_STORY_VIEWERS_PAGE = f'''
+    SELECT u.id, u.username, u.display_name, u.avatar_url, u.is_verified, sv.viewed_at
+    FROM {SCHEMA}.story_views sv
+    JOIN {SCHEMA}.users u ON sv.user_id = u.id
+    WHERE sv.story_id = %s AND sv.story_created_at = %s
+    ORDER BY sv.viewed_at DESC, sv.user_id DESC
+    LIMIT %s
+'''
+
+# Первые EXACT_VIEWERS_LIMIT зрителей считаются точно, дальше views_count берётся
+# из HyperLogLog, а в story_views попадает примерно каждый VIEWERS_SAMPLE_RATE-й зритель
+EXACT_VIEWERS_LIMIT = 1000
+VIEWERS_SAMPLE_RATE = 10
+VIEWERS_PAGE_SIZE = 50
+VIEWERS_PAGE_MAX = 100
+
+# (размер корзины, токенов в секунду) на пользователя
+RATE_LIMITS = {
+    'create': (5, 1 / 300),
+}
+
+limiter = RateLimiter(RATE_LIMITS, store_from_env())
+
+READ_ACTIONS = {'viewers'}
+
+MEDIA_MAX_BYTES = 10 * MB
+
+ACTIONS = {
+    'create': Action({
+        'user_id': ident(required=True),
+        'media_data': text(MEDIA_MAX_BYTES, required=True, strip=False),
+        'media_type': text(100, required=True),
+    }, max_bytes=MEDIA_MAX_BYTES, missing='Требуется user_id, media_data и media_type'),
+    'view': Action({
+        'user_id': ident(required=True),
+        'story_id': ident(required=True),
+    }, missing='Требуется user_id и story_id'),
+    'viewers': Action({
+        'user_id': ident(required=True),
+        'story_id': ident(required=True),
+        'cursor': keyset(),
+        'limit': number(),
+    }, missing='Требуется user_id и story_id'),
+}
+
+@instrumented('stories')
+@read_your_writes
 def handler(event: dict, context) -> dict:
-    '''API для работы с историями - создание, просмотр, получение'''
+    '''API для работы с историями - создание, просмотр, получение, список зрителей'''
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -22,24 +135,20 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        body = {}
+        action = None
+        if method == 'POST':
+            with phase('parse'):
+                action, body = parse_body(event, ACTIONS)
+        
+        if method == 'GET' or action in READ_ACTIONS:
+            conn = connect_for_read(event)
+        else:
+            conn = connect()
         cur = conn.cursor()
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
         
         if method == 'GET':
-            cur.execute(f'''
-                DELETE FROM {schema}.stories WHERE expires_at < NOW()
-            ''')
-            conn.commit()
-            
-            cur.execute(f'''
-                SELECT s.id, s.media_url, s.media_type, s.views_count, s.created_at, s.expires_at,
-                       u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
-                FROM {schema}.stories s
-                JOIN {schema}.users u ON s.user_id = u.id
-                WHERE s.expires_at > NOW()
-                ORDER BY s.created_at DESC
-            ''')
+            cur.execute(SELECT_ACTIVE_STORIES)
             stories = cur.fetchall()
             
             user_stories = {}
@@ -64,55 +173,54 @@ def handler(event: dict, context) -> dict:
                     'media_type': story[2],
                     'views_count': story[3],
                     'created_at': story[4].isoformat() if story[4] else None,
-                    'expires_at': story[5].isoformat() if story[5] else None
+                    'expires_at': story[5].isoformat() if story[5] else None,
+                    'thumbnail_url': story[12],
+                    'media_variants': story[13]
                 })
             
             result = list(user_stories.values())
             
+            with phase('serialize'):
+                response_body = json.dumps({'stories': result})
+            
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'stories': result}),
+                'body': response_body,
                 'isBase64Encoded': False
             }
         
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
+            annotate(action=action)
             
+            # Формат файла проверяется до лимита и до записи в БД: отклонённый файл не тратит токен
             if action == 'create':
-                user_id = body.get('user_id')
-                media_data = body.get('media_data')
-                media_type = body.get('media_type')
-                
-                if not all([user_id, media_data, media_type]):
+                try:
+                    file_data, media_digest = decode_and_hash(body.get('media_data'))
+                    detected = sniff_media_type(file_data)
+                except ValueError:
+                    detected = None
+                if not detected:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется user_id, media_data и media_type'}),
+                        'body': json.dumps({'error': 'Неподдерживаемый формат медиа'}),
                         'isBase64Encoded': False
                     }
+            
+            if action in RATE_LIMITS and body.get('user_id'):
+                retry_after = limiter.check(conn, action, body.get('user_id'))
+                if retry_after:
+                    annotate(rate_limited=True)
+                    return too_many_requests(retry_after)
+            
+            if action == 'create':
+                user_id = body.get('user_id')
+                media_type, file_ext = detected
                 
                 try:
-                    s3 = boto3.client('s3',
-                        endpoint_url='https://bucket.poehali.dev',
-                        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-                    )
-                    
-                    file_ext = 'jpg' if media_type.startswith('image') else 'mp4'
-                    file_key = f'stories/{user_id}_{datetime.now().timestamp()}.{file_ext}'
-                    
-                    file_data = base64.b64decode(media_data)
-                    
-                    s3.put_object(
-                        Bucket='files',
-                        Key=file_key,
-                        Body=file_data,
-                        ContentType=media_type
-                    )
-                    
-                    media_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
+                    file_key = store_content(conn, file_data, media_digest, media_type, file_ext)
+                    media_url = cdn_url(file_key)
                 except Exception as e:
                     return {
                         'statusCode': 500,
@@ -123,18 +231,20 @@ def handler(event: dict, context) -> dict:
                 
                 expires_at = datetime.now() + timedelta(hours=24)
                 
-                cur.execute(f'''
-                    INSERT INTO {schema}.stories (user_id, media_url, media_type, expires_at) 
-                    VALUES (%s, %s, %s, %s) RETURNING id
-                ''', (user_id, media_url, media_type, expires_at))
-                story_id = cur.fetchone()[0]
-                
-                cur.execute(f'''
-                    UPDATE {schema}.users SET yn_balance = yn_balance + 15 WHERE id = %s RETURNING yn_balance
-                ''', (user_id,))
-                new_balance = cur.fetchone()[0]
-                
-                conn.commit()
+                # Ссылка на объект уже зафиксирована: без сохранённой истории её нужно отпустить
+                try:
+                    cur.execute(INSERT_STORY, (user_id, media_url, media_type, media_digest, expires_at))
+                    story_id = cur.fetchone()[0]
+                    
+                    enqueue(cur, 'media.process', {'owner_type': 'story', 'owner_id': story_id, 'source_key': file_key, 'media_type': media_type})
+                    
+                    cur.execute(CREDIT_STORY_REWARD, (user_id,))
+                    new_balance = cur.fetchone()[0]
+                    
+                    conn.commit()
+                except Exception:
+                    release_content(conn, media_digest)
+                    raise
                 
                 return {
                     'statusCode': 200,
@@ -151,29 +261,94 @@ def handler(event: dict, context) -> dict:
                 user_id = body.get('user_id')
                 story_id = body.get('story_id')
                 
-                if not all([user_id, story_id]):
+                hll_hash, sample_hash = viewer_hash(user_id)
+                register, rank = register_update(hll_hash)
+                
+                # Повторные просмотры и зрители, не поднявшие регистр, строку истории не трогают
+                cur.execute(RAISE_VIEWER_REGISTER, (register, rank, story_id, register, rank))
+                raised = cur.fetchone()
+                
+                sampled = sample_hash % VIEWERS_SAMPLE_RATE == 0
+                cur.execute(INSERT_STORY_VIEW, (user_id, story_id, EXACT_VIEWERS_LIMIT, sampled))
+                if cur.fetchone():
+                    cur.execute(INCREMENT_STORY_VIEWS, (story_id, EXACT_VIEWERS_LIMIT))
+                
+                if raised:
+                    unique_viewers = estimate(bytes(raised[0]))
+                    cur.execute(SET_ESTIMATED_VIEWS, (unique_viewers, story_id, EXACT_VIEWERS_LIMIT, unique_viewers))
+                
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True}),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'viewers':
+                user_id = body.get('user_id')
+                story_id = body.get('story_id')
+                cursor = body.get('cursor')
+                limit = body.get('limit') or VIEWERS_PAGE_SIZE
+                limit = max(1, min(limit, VIEWERS_PAGE_MAX))
+                
+                cur.execute(SELECT_STORY_VIEWS_COUNT, (story_id,))
+                story = cur.fetchone()
+                
+                if not story:
                     return {
-                        'statusCode': 400,
+                        'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется user_id и story_id'}),
+                        'body': json.dumps({'error': 'История не найдена'}),
                         'isBase64Encoded': False
                     }
                 
-                try:
-                    cur.execute(f'''
-                        INSERT INTO {schema}.story_views (story_id, user_id) VALUES (%s, %s)
-                    ''', (story_id, user_id))
-                    cur.execute(f'''
-                        UPDATE {schema}.stories SET views_count = views_count + 1 WHERE id = %s
-                    ''', (story_id,))
-                    conn.commit()
-                except psycopg2.IntegrityError:
-                    conn.rollback()
+                if story[0] != user_id:
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Список зрителей доступен только автору'}),
+                        'isBase64Encoded': False
+                    }
+                
+                if cursor:
+                    cursor_ts, cursor_id = cursor
+                    cur.execute(SELECT_STORY_VIEWERS_PAGE_AFTER, (story_id, story[2], cursor_ts, cursor_id, limit + 1))
+                else:
+                    cur.execute(SELECT_STORY_VIEWERS_PAGE, (story_id, story[2], limit + 1))
+                rows = cur.fetchall()
+                
+                viewers = []
+                for row in rows[:limit]:
+                    viewers.append({
+                        'user': {
+                            'id': row[0],
+                            'username': row[1],
+                            'display_name': row[2],
+                            'avatar_url': row[3],
+                            'is_verified': row[4]
+                        },
+                        'viewed_at': row[5].isoformat() if row[5] else None
+                    })
+                
+                next_cursor = None
+                if len(rows) > limit:
+                    last = rows[limit - 1]
+                    next_cursor = f'{last[5].isoformat()}|{last[0]}'
+                
+                with phase('serialize'):
+                    response_body = json.dumps({
+                        'viewers': viewers,
+                        'next_cursor': next_cursor,
+                        'views_count': story[1],
+                        'sampled': story[1] >= EXACT_VIEWERS_LIMIT
+                    })
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': response_body,
                     'isBase64Encoded': False
                 }
             
@@ -193,8 +368,12 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
     
+    except RequestError as e:
+        annotate(rejected=e.status)
+        return request_error(e)
+    
     except Exception as e:
-        print(f"Error: {e}")
+        annotate(error=repr(e))
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,145 @@
+'''Счётчики, гистограммы и датчики инстанса функции в текстовом формате Prometheus.
+
+Все семейства объявлены здесь, чтобы у каждой функции был один и тот же
+набор метрик. instrumented() привязывает модуль к имени функции: оно
+попадает в метку function каждой строки, поэтому выгрузки нескольких
+функций (devserver держит их в одном процессе) можно склеить через
+render(sources). В облаке инстанс раз в METRICS_PUSH_SECONDS пишет
+выгрузку в лог записью type=metrics; локально её отдаёт GET /metrics.
+'''
+import os
+import threading
+import time
+import uuid
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '60'))
+
+INSTANCE = uuid.uuid4().hex[:12]
+
+_families = {}
+_state = {'function': 'unknown', 'pushed_at': time.monotonic()}
+
+
+class Family:
+    '''Семейство метрик: значения по кортежу значений меток.'''
+
+    def __init__(self, name: str, kind: str, help: str, labels: tuple = (), buckets: tuple = None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        _families[name] = self
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, labels: tuple, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def observe(self, labels: tuple, value: float) -> None:
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Счётчики корзин, затем сумма и число наблюдений
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self, function: str):
+        '''Строки выгрузки: (имя, {метка: значение}, число).'''
+        with self._lock:
+            values = {k: list(v) if isinstance(v, list) else v for k, v in self._values.items()}
+        for key, value in values.items():
+            labels = {'function': function, **dict(zip(self.labels, key))}
+            if self.kind != 'histogram':
+                yield self.name, labels, value
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets, value):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': repr(bound)}, cumulative
+            yield f'{self.name}_bucket', {**labels, 'le': '+Inf'}, value[-1]
+            yield f'{self.name}_sum', labels, value[-2]
+            yield f'{self.name}_count', labels, value[-1]
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> Family:
+    return Family(name, 'counter', help, labels)
+
+
+def gauge(name: str, help: str, labels: tuple = ()) -> Family:
+    return Family(name, 'gauge', help, labels)
+
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Family:
+    return Family(name, 'histogram', help, labels, buckets)
+
+
+REQUESTS = counter('yna_requests_total', 'Вызовы обработчика', ('action', 'status'))
+REQUEST_SECONDS = histogram('yna_request_duration_seconds', 'Длительность вызова обработчика', ('action',))
+HANDLER_ERRORS = counter('yna_handler_errors_total', 'Исключения, превращённые обработчиком в ответ 500', ('action', 'error'))
+DB_ERRORS = counter('yna_db_errors_total', 'Ошибки запросов к БД по классу исключения', ('error',))
+TOGGLES = counter('yna_toggles_total', 'Переключения лайка и подписки: on — вставка, off — снятие после IntegrityError', ('action', 'state'))
+S3_UPLOAD_BYTES = counter('yna_s3_upload_bytes_total', 'Байт загружено в бакет')
+S3_UPLOAD_SECONDS = histogram('yna_s3_upload_duration_seconds', 'Длительность put_object')
+S3_ERRORS = counter('yna_s3_errors_total', 'Ошибки обращений к бакету', ('operation',))
+DB_CONNECTS = counter('yna_db_connects_total', 'Новые соединения с БД', ('target',))
+POOL_IN_USE = gauge('yna_db_pool_in_use', 'Выданные соединения пула', ('target',))
+POOL_IDLE = gauge('yna_db_pool_idle', 'Свободные соединения пула', ('target',))
+POOL_WAIT_SECONDS = histogram('yna_db_pool_wait_seconds', 'Ожидание свободного соединения пула', ('target',))
+CACHE_LOOKUPS = counter('yna_cache_lookups_total', 'Обращения к TTLCache', ('cache', 'result'))
+
+
+def bind(function: str) -> None:
+    _state['function'] = function
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(sources: list = None) -> str:
+    '''Выгрузка в текстовом формате Prometheus.
+
+    sources — модули metrics нескольких функций (у каждой своя копия);
+    одноимённые семейства печатаются одним блоком HELP/TYPE.
+    '''
+    sources = sources or [None]
+    lines = []
+    for name, family in _families.items():
+        lines.append(f'# HELP {name} {family.help}')
+        lines.append(f'# TYPE {name} {family.kind}')
+        for source in sources:
+            if source is None:
+                owner, function = family, _state['function']
+            else:
+                owner, function = source._families[name], source._state['function']
+            for sample, labels, value in owner.samples(function):
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f'{sample}{{{label_text}}} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def push_due() -> bool:
+    '''Пора ли писать выгрузку в лог; METRICS_PUSH_SECONDS=0 отключает запись.'''
+    if PUSH_SECONDS <= 0:
+        return False
+    now = time.monotonic()
+    if now - _state['pushed_at'] < PUSH_SECONDS:
+        return False
+    _state['pushed_at'] = now
+    return True
@@ -0,0 +1,31 @@
+import hashlib
+import math
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+HASH_BITS = 64
+EMPTY_SKETCH_HEX = '00' * REGISTERS
+
+
+def viewer_hash(user_id: int):
+    '''Два независимых 64-битных хэша зрителя: для регистров HyperLogLog и для выборки.'''
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
+
+def register_update(hll_hash: int):
+    '''Номер регистра и его новое значение (позиция первой единицы в оставшихся битах).'''
+    index = hll_hash >> (HASH_BITS - PRECISION)
+    rest = hll_hash & ((1 << (HASH_BITS - PRECISION)) - 1)
+    rank = (HASH_BITS - PRECISION) - rest.bit_length() + 1
+    return index, rank
+
+
+def estimate(sketch: bytes) -> int:
+    '''Оценка числа уникальных зрителей; на малых значениях — линейный подсчёт по пустым регистрам.'''
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    raw = alpha * REGISTERS * REGISTERS / sum(2.0 ** -r for r in sketch)
+    zeros = sketch.count(0)
+    if raw <= 2.5 * REGISTERS and zeros:
+        return round(REGISTERS * math.log(REGISTERS / zeros))
+    return round(raw)
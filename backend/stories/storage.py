@@ -0,0 +1,202 @@
+import base64
+import binascii
+import contextvars
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import metrics
+from instrument import phase
+
+BUCKET = 'files'
+ENDPOINT_URL = 'https://bucket.poehali.dev'
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+DECODE_CHUNK_CHARS = 4 * 256 * 1024
+UPLOAD_THREADS = 4
+
+ACQUIRE_MEDIA_OBJECT = f'''
+    INSERT INTO {SCHEMA}.media_objects (digest, file_key, content_type, size_bytes) VALUES (%s, %s, %s, %s)
+    ON CONFLICT (digest) DO UPDATE SET ref_count = {SCHEMA}.media_objects.ref_count + 1, updated_at = NOW()
+    RETURNING file_key, uploaded
+'''
+
+MARK_MEDIA_UPLOADED = f'''
+    UPDATE {SCHEMA}.media_objects SET uploaded = TRUE WHERE digest = %s
+'''
+
+RELEASE_MEDIA_OBJECT = f'''
+    UPDATE {SCHEMA}.media_objects SET ref_count = ref_count - 1, updated_at = NOW() WHERE digest = %s
+'''
+
+_s3_client = None
+_upload_executor = None
+
+
+def get_s3():
+    '''Клиент S3, создаётся один раз на инстанс функции.
+
+    boto3 импортируется здесь, а не на уровне модуля: он заметно удлиняет
+    холодный старт, а чтениям S3 не нужен.
+    '''
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client('s3',
+            endpoint_url=ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return _s3_client
+
+
+def cdn_url(file_key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
+
+
+def upload(file_key: str, data: bytes, content_type: str) -> str:
+    '''Загружает файл в бакет и возвращает его CDN-ссылку.'''
+    start = time.perf_counter()
+    try:
+        with phase('s3'):
+            get_s3().put_object(
+                Bucket=BUCKET,
+                Key=file_key,
+                Body=data,
+                ContentType=content_type
+            )
+    except Exception:
+        metrics.S3_ERRORS.inc(('put',))
+        raise
+    metrics.S3_UPLOAD_SECONDS.observe((), time.perf_counter() - start)
+    metrics.S3_UPLOAD_BYTES.inc((), len(data))
+    return cdn_url(file_key)
+
+
+def download(file_key: str) -> bytes:
+    try:
+        with phase('s3'):
+            return get_s3().get_object(Bucket=BUCKET, Key=file_key)['Body'].read()
+    except Exception:
+        metrics.S3_ERRORS.inc(('get',))
+        raise
+
+
+def delete(file_key: str) -> None:
+    try:
+        with phase('s3'):
+            get_s3().delete_object(Bucket=BUCKET, Key=file_key)
+    except Exception:
+        metrics.S3_ERRORS.inc(('delete',))
+        raise
+
+
+def decode_and_hash(media_data: str):
+    '''Декодирует base64 порциями, попутно считая sha256: (bytes, hex-дайджест).'''
+    with phase('decode'):
+        digest = hashlib.sha256()
+        chunks = []
+        try:
+            for start in range(0, len(media_data), DECODE_CHUNK_CHARS):
+                chunk = base64.b64decode(media_data[start:start + DECODE_CHUNK_CHARS])
+                digest.update(chunk)
+                chunks.append(chunk)
+        except binascii.Error:
+            # Переносы строк и прочий мусор сбивают выравнивание порций
+            data = base64.b64decode(media_data)
+            return data, hashlib.sha256(data).hexdigest()
+        return b''.join(chunks), digest.hexdigest()
+
+
+def content_key(digest: str, ext: str) -> str:
+    return f'media/{digest[:2]}/{digest}.{ext}'
+
+
+def store_content(conn, data: bytes, digest: str, content_type: str, ext: str) -> str:
+    '''Кладёт файл по хэшу содержимого и берёт на него ссылку; возвращает ключ в бакете.
+
+    Ссылка фиксируется отдельной транзакцией до загрузки: сборщик мусора
+    удаляет только объекты с ref_count <= 0, поэтому файл не пропадёт, пока
+    его грузит параллельный запрос. Повторная загрузка того же содержимого
+    пропускается, если объект уже в бакете.
+    '''
+    cur = conn.cursor()
+    cur.execute(ACQUIRE_MEDIA_OBJECT, (digest, content_key(digest, ext), content_type, len(data)))
+    file_key, uploaded = cur.fetchone()
+    conn.commit()
+    if not uploaded:
+        try:
+            upload(file_key, data, content_type)
+        except Exception:
+            cur.execute(RELEASE_MEDIA_OBJECT, (digest,))
+            conn.commit()
+            raise
+        cur.execute(MARK_MEDIA_UPLOADED, (digest,))
+        conn.commit()
+    cur.close()
+    return file_key
+
+
+def release_content(conn, digest: str, pending=None) -> None:
+    '''Отпускает ссылку, взятую store_content или begin_store_content, если владелец не сохранился.
+
+    Ссылка зафиксирована отдельной транзакцией, поэтому откат транзакции
+    вызывающего её не снимает: транзакция откатывается, ссылка снимается
+    своей. Иначе ref_count остаётся поднятым и сборщик мусора объект не удалит.
+    Фоновая загрузка pending сначала отменяется или дожидается: файл не должен
+    попасть в бакет после того, как сборщик мог удалить объект без ссылок.
+    '''
+    if pending is not None and not pending.cancel():
+        with phase('upload_wait'):
+            wait([pending])
+    conn.rollback()
+    cur = conn.cursor()
+    cur.execute(RELEASE_MEDIA_OBJECT, (digest,))
+    conn.commit()
+    cur.close()
+
+
+def _uploads() -> ThreadPoolExecutor:
+    global _upload_executor
+    if _upload_executor is None:
+        _upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_THREADS, thread_name_prefix='s3-upload')
+    return _upload_executor
+
+
+def begin_store_content(conn, data: bytes, digest: str, content_type: str, ext: str):
+    '''Как store_content, но файл грузится в фоне: возвращает (ключ, загрузка или None).
+
+    Ссылка фиксируется сразу, как в store_content. Пока файл грузится,
+    вызывающий продолжает свою транзакцию и перед коммитом вызывает
+    finish_store_content. Загрузка видит контекст вызова, поэтому её фаза
+    s3 попадает в лог запроса.
+    '''
+    cur = conn.cursor()
+    cur.execute(ACQUIRE_MEDIA_OBJECT, (digest, content_key(digest, ext), content_type, len(data)))
+    file_key, uploaded = cur.fetchone()
+    conn.commit()
+    cur.close()
+    if uploaded:
+        return file_key, None
+    return file_key, _uploads().submit(contextvars.copy_context().run, upload, file_key, data, content_type)
+
+
+def finish_store_content(conn, digest: str, pending) -> None:
+    '''Дожидается фоновой загрузки и отмечает объект в транзакции вызывающего.
+
+    Если загрузка не удалась, откатывает эту транзакцию, отпускает ссылку
+    на объект и пробрасывает исключение.
+    '''
+    if pending is None:
+        return
+    cur = conn.cursor()
+    try:
+        with phase('upload_wait'):
+            pending.result()
+    except Exception:
+        conn.rollback()
+        cur.execute(RELEASE_MEDIA_OBJECT, (digest,))
+        conn.commit()
+        cur.close()
+        raise
+    cur.execute(MARK_MEDIA_UPLOADED, (digest,))
+    cur.close()
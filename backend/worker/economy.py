@@ -0,0 +1,41 @@
+import os
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+FOLD_BATCH = 5000
+FOLD_MAX_BATCHES = 20
+
+# Порция событий прибавляется к обеим сводкам одним запросом; CTE hourly не
+# используется в итоговом SELECT, но как изменяющий данные выполняется всегда
+FOLD_EVENTS = f'''
+    WITH batch AS (
+        DELETE FROM {SCHEMA}.economy_events
+        WHERE id IN (SELECT id FROM {SCHEMA}.economy_events ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING occurred_at, kind, item, coins
+    ), hourly AS (
+        INSERT INTO {SCHEMA}.economy_hourly AS h (hour, kind, item, events, coins)
+        SELECT date_trunc('hour', occurred_at), kind, item, count(*), sum(coins)
+        FROM batch GROUP BY 1, 2, 3
+        ON CONFLICT (hour, kind, item) DO UPDATE SET
+            events = h.events + EXCLUDED.events,
+            coins = h.coins + EXCLUDED.coins
+    )
+    INSERT INTO {SCHEMA}.economy_daily AS d (day, kind, item, events, coins)
+    SELECT occurred_at::date, kind, item, count(*), sum(coins)
+    FROM batch GROUP BY 1, 2, 3
+    ON CONFLICT (day, kind, item) DO UPDATE SET
+        events = d.events + EXCLUDED.events,
+        coins = d.coins + EXCLUDED.coins
+'''
+
+
+def fold(conn, payload: dict) -> None:
+    '''Задача economy.fold: переносит события юнакоинов в почасовые и посуточные сводки.'''
+    cur = conn.cursor()
+    for _ in range(payload.get('max_batches', FOLD_MAX_BATCHES)):
+        cur.execute(FOLD_EVENTS, (FOLD_BATCH,))
+        folded = cur.rowcount
+        conn.commit()
+        if not folded:
+            break
+    cur.close()
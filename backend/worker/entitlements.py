@@ -0,0 +1,97 @@
+import os
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+BATCH = 1000
+MAX_BATCHES = 20
+
+# Порция наступивших переходов; SKIP LOCKED разводит параллельных воркеров
+OPEN_DUE = f'''
+    UPDATE {SCHEMA}.entitlements SET state = 'active'
+    WHERE id IN (
+        SELECT id FROM {SCHEMA}.entitlements
+        WHERE state = 'scheduled' AND starts_at <= NOW()
+        ORDER BY starts_at LIMIT %s FOR UPDATE SKIP LOCKED
+    )
+    RETURNING kind, user_id, starts_at
+'''
+
+CLOSE_DUE = f'''
+    UPDATE {SCHEMA}.entitlements SET state = 'expired'
+    WHERE id IN (
+        SELECT id FROM {SCHEMA}.entitlements
+        WHERE state = 'active' AND ends_at <= NOW()
+        ORDER BY ends_at LIMIT %s FOR UPDATE SKIP LOCKED
+    )
+    RETURNING kind, user_id, starts_at
+'''
+
+# Что переключить при открытии и закрытии окна каждого вида. Запросы получают
+# массивы users и starts (user_id и начало окна для каждого перехода) и
+# выполняются в транзакции смены состояния. У вида без записи меняется только state.
+TRANSITIONS = {
+    'boost': {
+        'open': [
+            f'''
+            UPDATE {SCHEMA}.users u SET boost_active_until = a.ends_at
+            FROM (
+                SELECT user_id, max(ends_at) AS ends_at FROM {SCHEMA}.entitlements
+                WHERE kind = 'boost' AND state = 'active' AND user_id = ANY(%(users)s)
+                GROUP BY user_id
+            ) a
+            WHERE u.id = a.user_id AND (u.boost_active_until IS NULL OR u.boost_active_until < a.ends_at)
+            ''',
+            # Посты, созданные с начала окна до его открытия воркером
+            f'''
+            UPDATE {SCHEMA}.posts p SET is_boosted = TRUE
+            FROM unnest(%(users)s::integer[], %(starts)s::timestamp[]) AS o(user_id, starts_at)
+            WHERE p.user_id = o.user_id AND p.created_at >= o.starts_at AND NOT p.is_boosted
+            ''',
+        ],
+        'close': [
+            f'''
+            UPDATE {SCHEMA}.posts p SET is_boosted = FALSE
+            WHERE p.user_id = ANY(%(users)s) AND p.is_boosted
+              AND NOT EXISTS (
+                  SELECT 1 FROM {SCHEMA}.entitlements e
+                  WHERE e.user_id = p.user_id AND e.kind = 'boost' AND e.state = 'active'
+              )
+            ''',
+            f'''
+            UPDATE {SCHEMA}.users SET boost_active_until = NULL
+            WHERE id = ANY(%(users)s) AND boost_active_until <= NOW()
+            ''',
+        ],
+    },
+}
+
+
+def apply(cur, transition: str, rows: list) -> None:
+    '''Выполняет запросы перехода для порции строк (kind, user_id, starts_at).'''
+    by_kind = {}
+    for kind, user_id, starts_at in rows:
+        by_kind.setdefault(kind, ([], []))
+        by_kind[kind][0].append(user_id)
+        by_kind[kind][1].append(starts_at)
+    for kind, (users, starts) in by_kind.items():
+        for statement in TRANSITIONS.get(kind, {}).get(transition, []):
+            cur.execute(statement, {'users': users, 'starts': starts})
+
+
+def tick(conn, payload: dict) -> None:
+    '''Задача entitlements.tick: открывает и закрывает наступившие окна.
+
+    Каждая порция — отдельная транзакция: смена state и флаги коммитятся
+    вместе, поэтому упавший воркер не оставит окно наполовину переключённым.
+    '''
+    cur = conn.cursor()
+    for transition, statement in (('open', OPEN_DUE), ('close', CLOSE_DUE)):
+        for _ in range(payload.get('max_batches', MAX_BATCHES)):
+            cur.execute(statement, (BATCH,))
+            rows = cur.fetchall()
+            if rows:
+                apply(cur, transition, rows)
+            conn.commit()
+            if len(rows) < BATCH:
+                break
+    cur.close()
@@ -0,0 +1,82 @@
+import json
+import os
+import psycopg2
+from instrument import instrumented, phase, annotate, TracedCursor
+from jobqueue import drain, schedule_periodic
+from tasks import HANDLERS, PERIODIC
+from request import Action, RequestError, parse_body, request_error, names, number
+
+DEFAULT_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 100
+TIME_BUDGET_SECONDS = 20
+
+# У вызова очереди нет поля action — схема под ключом None; limit больше MAX_BATCH_SIZE урезается
+ACTIONS = {
+    None: Action({
+        'tasks': names(100, 64),
+        'limit': number(default=DEFAULT_BATCH_SIZE, min_value=1),
+    }),
+}
+
+@instrumented('worker')
+def handler(event: dict, context) -> dict:
+    '''Фоновая очередь задач: варианты медиа, удаление неиспользуемых файлов, истёкшие истории'''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    try:
+        with phase('parse'):
+            _, body = parse_body(event, ACTIONS)
+        tasks = body.get('tasks') or list(HANDLERS)
+        limit = min(body.get('limit'), MAX_BATCH_SIZE)
+        annotate(action='drain')
+
+        if any(task not in HANDLERS for task in tasks):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid task'}),
+                'isBase64Encoded': False
+            }
+
+        with phase('connect'):
+            conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=TracedCursor)
+
+        schedule_periodic(conn, PERIODIC)
+        stats = drain(conn, HANDLERS, PERIODIC, limit, TIME_BUDGET_SECONDS, tasks=tasks)
+        annotate(**stats)
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(stats),
+            'isBase64Encoded': False
+        }
+
+    except RequestError as e:
+        annotate(rejected=e.status)
+        return request_error(e)
+
+    except Exception as e:
+        annotate(error=repr(e))
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    finally:
+        if 'conn' in locals():
+            conn.close()
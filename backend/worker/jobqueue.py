@@ -0,0 +1,141 @@
+import os
+import random
+import socket
+import time
+
+from instrument import phase
+from jobs import enqueue
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+VISIBILITY_TIMEOUT_MINUTES = 10
+
+# Зависшая задача с исчерпанными попытками не возвращается в очередь: иначе
+# задача, роняющая воркер, перезапускалась бы бесконечно
+REQUEUE_STALE_JOBS = f'''
+    UPDATE {SCHEMA}.jobs SET
+        status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'pending' END,
+        last_error = CASE WHEN attempts >= max_attempts THEN 'visibility timeout' ELSE last_error END,
+        locked_by = NULL, locked_at = NULL, updated_at = NOW()
+    WHERE status = 'running' AND locked_at < NOW() - INTERVAL '{VISIBILITY_TIMEOUT_MINUTES} minutes'
+'''
+
+CLAIM_JOBS = f'''
+    UPDATE {SCHEMA}.jobs
+    SET status = 'running', attempts = attempts + 1, locked_by = %s, locked_at = NOW(), updated_at = NOW()
+    WHERE id IN (
+        SELECT id FROM {SCHEMA}.jobs
+        WHERE status = 'pending' AND run_at <= NOW() AND task = ANY(%s)
+        ORDER BY run_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, task, payload, attempts, max_attempts
+'''
+
+DELETE_JOB = f'''
+    DELETE FROM {SCHEMA}.jobs WHERE id = %s
+'''
+
+RETRY_JOB = f'''
+    UPDATE {SCHEMA}.jobs
+    SET status = 'pending', run_at = NOW() + %s * INTERVAL '1 second', last_error = %s,
+        locked_by = NULL, locked_at = NULL, updated_at = NOW()
+    WHERE id = %s
+'''
+
+BURY_JOB = f'''
+    UPDATE {SCHEMA}.jobs
+    SET status = 'dead', last_error = %s, locked_by = NULL, locked_at = NULL, updated_at = NOW()
+    WHERE id = %s
+'''
+
+RESURRECT_DEAD_JOBS = f'''
+    UPDATE {SCHEMA}.jobs SET status = 'pending', attempts = 0, run_at = NOW(), updated_at = NOW()
+    WHERE status = 'dead' AND (%s::text IS NULL OR task = %s)
+'''
+
+SELECT_QUEUE_STATS = f'''
+    SELECT task, status, count(*), min(run_at) FROM {SCHEMA}.jobs GROUP BY task, status ORDER BY task, status
+'''
+
+
+def worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def backoff_seconds(attempts: int) -> float:
+    '''Экспоненциальная задержка перед повтором с разбросом ±50%, чтобы повторы не шли пачкой.'''
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def schedule_periodic(conn, periodic: dict) -> None:
+    '''Ставит периодические задачи, которых ещё нет в очереди (после сбоя или при первом запуске).'''
+    cur = conn.cursor()
+    for task in periodic:
+        enqueue(cur, task, {}, 0, dedupe_key=task)
+    conn.commit()
+    cur.close()
+
+
+def claim(conn, tasks: list, limit: int, locked_by: str) -> list:
+    cur = conn.cursor()
+    cur.execute(REQUEUE_STALE_JOBS)
+    cur.execute(CLAIM_JOBS, (locked_by, list(tasks), limit))
+    jobs = [
+        {'id': row[0], 'task': row[1], 'payload': row[2], 'attempts': row[3], 'max_attempts': row[4]}
+        for row in cur.fetchall()
+    ]
+    conn.commit()
+    cur.close()
+    return jobs
+
+
+def run_job(conn, job: dict, handlers: dict, periodic: dict) -> str:
+    '''Выполняет задачу; результат задачи и удаление строки из очереди коммитятся вместе.
+
+    Возвращает 'done', 'retry' или 'dead'.
+    '''
+    cur = conn.cursor()
+    try:
+        with phase(f'task:{job["task"]}'):
+            handlers[job['task']](conn, job['payload'])
+        cur.execute(DELETE_JOB, (job['id'],))
+        if job['task'] in periodic:
+            enqueue(cur, job['task'], {}, periodic[job['task']], dedupe_key=job['task'])
+        conn.commit()
+        return 'done'
+    except Exception as e:
+        conn.rollback()
+        error = repr(e)[:2000]
+        print(f"Job {job['id']} ({job['task']}) failed on attempt {job['attempts']}: {error}")
+        if job['attempts'] >= job['max_attempts']:
+            cur.execute(BURY_JOB, (error, job['id']))
+            if job['task'] in periodic:
+                enqueue(cur, job['task'], {}, periodic[job['task']], dedupe_key=job['task'])
+            outcome = 'dead'
+        else:
+            cur.execute(RETRY_JOB, (backoff_seconds(job['attempts']), error, job['id']))
+            outcome = 'retry'
+        conn.commit()
+        return outcome
+    finally:
+        cur.close()
+
+
+def drain(conn, handlers: dict, periodic: dict, limit: int, time_budget: float, batch_size: int = 10,
+          tasks: list = None) -> dict:
+    '''Выполняет до limit задач, пока не истечёт time_budget секунд или не опустеет очередь.'''
+    deadline = time.monotonic() + time_budget
+    locked_by = worker_id()
+    stats = {'done': 0, 'retry': 0, 'dead': 0}
+    while sum(stats.values()) < limit and time.monotonic() < deadline:
+        jobs = claim(conn, tasks or list(handlers), min(batch_size, limit - sum(stats.values())), locked_by)
+        if not jobs:
+            break
+        for job in jobs:
+            stats[run_job(conn, job, handlers, periodic)] += 1
+    return stats
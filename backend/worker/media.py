@@ -0,0 +1,157 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from instrument import phase
+from storage import delete, download, upload
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+VARIANT_WIDTHS = (320, 640, 1080)
+THUMBNAIL_SIZE = 160
+JPEG_QUALITY = 82
+GC_GRACE_MINUTES = 10
+GC_BATCH_SIZE = 100
+
+OWNER_TABLES = {'post': 'posts', 'story': 'stories'}
+
+SELECT_STORED_VARIANTS = f'''
+    SELECT variants FROM {SCHEMA}.media_objects WHERE file_key = %s AND variants IS NOT NULL
+'''
+
+STORE_VARIANTS = f'''
+    UPDATE {SCHEMA}.media_objects SET variants = %s WHERE file_key = %s
+'''
+
+CLAIM_UNREFERENCED = f'''
+    SELECT digest, file_key FROM {SCHEMA}.media_objects
+    WHERE ref_count <= 0 AND updated_at < NOW() - INTERVAL '{GC_GRACE_MINUTES} minutes'
+    ORDER BY updated_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+'''
+
+DELETE_MEDIA_OBJECTS = f'''
+    DELETE FROM {SCHEMA}.media_objects WHERE digest = ANY(%s) AND ref_count <= 0
+'''
+
+SET_VARIANTS = {
+    owner_type: f'UPDATE {SCHEMA}.{table} SET thumbnail_url = %s, media_variants = %s WHERE id = %s'
+    for owner_type, table in OWNER_TABLES.items()
+}
+
+
+def _to_jpeg(image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def render_image_variants(data: bytes, base_key: str) -> dict:
+    '''Квадратное превью и уменьшенные по ширине копии; больше оригинала не растягиваем.'''
+    from PIL import Image, ImageOps
+
+    with phase('decode'):
+        image = Image.open(io.BytesIO(data))
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+    with phase('resize'):
+        thumbnail = _to_jpeg(ImageOps.fit(image, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS))
+        widths = {}
+        for width in VARIANT_WIDTHS:
+            if width >= image.width:
+                break
+            height = round(image.height * width / image.width)
+            widths[width] = _to_jpeg(image.resize((width, height), Image.LANCZOS))
+
+    variants = {'thumbnail': upload(f'{base_key}_thumb.jpg', thumbnail, 'image/jpeg'), 'widths': {}}
+    for width, variant in widths.items():
+        variants['widths'][str(width)] = upload(f'{base_key}_w{width}.jpg', variant, 'image/jpeg')
+    return variants
+
+
+def extract_poster(data: bytes) -> bytes:
+    '''Кадр для постера видео через ffmpeg; для роликов короче секунды берём первый кадр.'''
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise RuntimeError('ffmpeg не найден')
+    with tempfile.NamedTemporaryFile(suffix='.video') as source:
+        source.write(data)
+        source.flush()
+        for offset in ('1', '0'):
+            with phase('ffmpeg'):
+                result = subprocess.run(
+                    [ffmpeg, '-v', 'error', '-ss', offset, '-i', source.name,
+                     '-frames:v', '1', '-f', 'image2', '-vcodec', 'mjpeg', 'pipe:1'],
+                    capture_output=True, timeout=60
+                )
+            if result.returncode == 0 and result.stdout:
+                return result.stdout
+    raise RuntimeError(f'ffmpeg: {result.stderr.decode(errors="replace")[:200]}')
+
+
+def variant_keys(source_key: str) -> list:
+    base_key = source_key.rsplit('.', 1)[0]
+    return [f'{base_key}_thumb.jpg', f'{base_key}_poster.jpg'] + [f'{base_key}_w{w}.jpg' for w in VARIANT_WIDTHS]
+
+
+def render_variants(source_key: str, media_type: str) -> dict:
+    data = download(source_key)
+    base_key = source_key.rsplit('.', 1)[0]
+    if media_type.startswith('video/'):
+        poster = extract_poster(data)
+        variants = render_image_variants(poster, base_key)
+        variants['poster'] = upload(f'{base_key}_poster.jpg', poster, 'image/jpeg')
+        return variants
+    return render_image_variants(data, base_key)
+
+
+def process_media(conn, payload: dict) -> None:
+    '''Задача media.process: варианты для файла поста или истории.
+
+    Одинаковое содержимое лежит под одним ключом, поэтому уже готовые
+    варианты переиспользуются без скачивания оригинала.
+    '''
+    cur = conn.cursor()
+    cur.execute(SELECT_STORED_VARIANTS, (payload['source_key'],))
+    row = cur.fetchone()
+    if row:
+        variants = row[0]
+    else:
+        variants = render_variants(payload['source_key'], payload['media_type'])
+        cur.execute(STORE_VARIANTS, (json.dumps(variants), payload['source_key']))
+    cur.execute(SET_VARIANTS[payload['owner_type']], (variants['thumbnail'], json.dumps(variants), payload['owner_id']))
+    cur.close()
+
+
+def collect_garbage(conn, payload: dict) -> None:
+    '''Задача media.gc: удаляет из бакета файлы, на которые больше не ссылается ни один пост, история или канал.
+
+    Строки блокируются до конца транзакции: параллельная загрузка того же
+    содержимого дождётся удаления и создаст объект заново.
+    '''
+    cur = conn.cursor()
+    cur.execute(CLAIM_UNREFERENCED, (payload.get('limit', GC_BATCH_SIZE),))
+    rows = cur.fetchall()
+    deleted = []
+    for digest, file_key in rows:
+        try:
+            for key in [file_key] + variant_keys(file_key):
+                delete(key)
+            deleted.append(digest)
+        except Exception as e:
+            print(f'Error deleting {file_key}: {e}')
+    if deleted:
+        cur.execute(DELETE_MEDIA_OBJECTS, (deleted,))
+    cur.close()
@@ -0,0 +1,39 @@
+MAGIC_PREFIXES = [
+    (b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (b'GIF87a', 'image/gif', 'gif'),
+    (b'GIF89a', 'image/gif', 'gif'),
+    (b'\x1a\x45\xdf\xa3', 'video/webm', 'webm')
+]
+
+# HEIC/HEIF Pillow в воркере не декодирует: варианты для них не построить
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'mif1', b'msf1'}
+
+# Контейнер ftyp несут и другие форматы (AVIF, 3GP, M4A): mp4 — только известные бренды
+MP4_BRANDS = {
+    b'isom', b'iso2', b'iso3', b'iso4', b'iso5', b'iso6',
+    b'mp41', b'mp42', b'avc1', b'dash', b'M4V ', b'MSNV', b'mmp4',
+}
+
+
+def sniff_media_type(data: bytes):
+    '''Определяет формат по сигнатуре файла: (content_type, расширение) или None.
+
+    Заявленному клиентом media_type не доверяем: по нему любое не-изображение
+    раньше сохранялось как .mp4.
+    '''
+    for prefix, content_type, ext in MAGIC_PREFIXES:
+        if data.startswith(prefix):
+            return content_type, ext
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    if data[4:8] == b'ftyp':
+        brand = data[8:12]
+        if brand in HEIF_BRANDS:
+            # Не сохраняем под видом mp4, а отклоняем
+            return None
+        if brand == b'qt  ':
+            return 'video/quicktime', 'mov'
+        if brand in MP4_BRANDS:
+            return 'video/mp4', 'mp4'
+    return None
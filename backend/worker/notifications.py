@@ -0,0 +1,57 @@
+import os
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+FOLD_BATCH = 5000
+FOLD_MAX_BATCHES = 20
+RECENT_ACTORS = 3
+RETAIN_READ_DAYS = 90
+
+# Порция событий сливается в непрочитанную строку на (получатель, вид, объект);
+# если строка уже есть, растут счётчик и список последних участников.
+# Повторный лайк после снятия посчитается дважды: точное число есть у поста.
+FOLD_EVENTS = f'''
+    WITH batch AS (
+        DELETE FROM {SCHEMA}.notification_outbox
+        WHERE id IN (SELECT id FROM {SCHEMA}.notification_outbox ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING id, recipient_id, kind, target_id, actor_id
+    ), grouped AS (
+        SELECT recipient_id, kind, target_id, count(DISTINCT actor_id) AS actors,
+               (array_agg(actor_id ORDER BY id DESC))[1:{RECENT_ACTORS}] AS recent
+        FROM batch GROUP BY recipient_id, kind, target_id
+    )
+    INSERT INTO {SCHEMA}.notifications AS n (user_id, kind, target_id, actors_count, recent_actor_ids)
+    SELECT recipient_id, kind, target_id, actors, recent FROM grouped
+    ON CONFLICT (user_id, kind, target_id) WHERE NOT is_read DO UPDATE SET
+        actors_count = n.actors_count + EXCLUDED.actors_count,
+        recent_actor_ids = (EXCLUDED.recent_actor_ids || n.recent_actor_ids)[1:{RECENT_ACTORS}],
+        updated_at = NOW()
+'''
+
+DELETE_OLD_READ = f'''
+    DELETE FROM {SCHEMA}.notifications
+    WHERE is_read AND updated_at < NOW() - make_interval(days => %s)
+'''
+
+
+def fold(conn, payload: dict) -> None:
+    '''Задача notifications.fold: переносит события из outbox в уведомления.
+
+    Порции коммитятся по отдельности, как в stats.fold: строка популярного
+    автора блокируется только на время одной порции.
+    '''
+    cur = conn.cursor()
+    for _ in range(payload.get('max_batches', FOLD_MAX_BATCHES)):
+        cur.execute(FOLD_EVENTS, (FOLD_BATCH,))
+        folded = cur.rowcount
+        conn.commit()
+        if not folded:
+            break
+    cur.close()
+
+
+def prune(conn, payload: dict) -> None:
+    '''Задача notifications.prune: удаляет давно прочитанные уведомления.'''
+    cur = conn.cursor()
+    cur.execute(DELETE_OLD_READ, (payload.get('retain_days', RETAIN_READ_DAYS),))
+    cur.close()
@@ -0,0 +1,81 @@
+import os
+from datetime import date
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+MONTHS_AHEAD = 3
+
+# Ключ секционирования и срок хранения секций в месяцах (None — хранить всегда).
+# Просмотры нужны только пока жива история (сутки), поэтому старые секции удаляются.
+POLICIES = {
+    'likes': {'key': 'post_created_at', 'retain_months': None},
+    'comments': {'key': 'created_at', 'retain_months': None},
+    'story_views': {'key': 'story_created_at', 'retain_months': 2},
+    'messages': {'key': 'created_at', 'retain_months': None},
+}
+
+ENSURE_PARTITIONS = f'''
+    SELECT {SCHEMA}.ensure_monthly_partitions(%s, %s, %s, %s, %s)
+'''
+
+SELECT_PARTITIONS = f'''
+    SELECT c.relname, c.reltuples::bigint, pg_total_relation_size(c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    JOIN pg_namespace n ON n.oid = p.relnamespace
+    WHERE n.nspname = %s AND p.relname = %s
+    ORDER BY c.relname
+'''
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_month(table: str, name: str):
+    '''Месяц секции по имени вида <таблица>_pYYYYMM; None для default и чужих таблиц.'''
+    suffix = name[len(table) + 2:]
+    if not name.startswith(f'{table}_p') or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def list_partitions(cur, table: str) -> list:
+    cur.execute(SELECT_PARTITIONS, (SCHEMA, table))
+    return cur.fetchall()
+
+
+def ensure(cur, table: str, months_ahead: int = MONTHS_AHEAD, start: date = None) -> int:
+    '''Создаёт секции с start (по умолчанию текущего месяца) на months_ahead месяцев вперёд.'''
+    this_month = date.today().replace(day=1)
+    start = (start or this_month).replace(day=1)
+    cur.execute(ENSURE_PARTITIONS, (SCHEMA, table, POLICIES[table]['key'], start, add_months(this_month, months_ahead)))
+    return cur.fetchone()[0]
+
+
+def retire(cur, table: str, retain_months: int, drop: bool = True) -> list:
+    '''Отсоединяет (и при drop удаляет) секции, целиком старше retain_months месяцев.'''
+    cutoff = add_months(date.today().replace(day=1), -retain_months)
+    retired = []
+    for name, _, _ in list_partitions(cur, table):
+        month = partition_month(table, name)
+        if month is None or add_months(month, 1) > cutoff:
+            continue
+        cur.execute(f'ALTER TABLE {SCHEMA}.{table} DETACH PARTITION {SCHEMA}.{name}')
+        if drop:
+            cur.execute(f'DROP TABLE {SCHEMA}.{name}')
+        retired.append(name)
+    return retired
+
+
+def maintain(conn, payload: dict) -> None:
+    '''Задача partitions.maintain: секции наперёд и удаление устаревших по POLICIES.'''
+    cur = conn.cursor()
+    for table, policy in POLICIES.items():
+        created = ensure(cur, table, payload.get('months_ahead', MONTHS_AHEAD))
+        retired = retire(cur, table, policy['retain_months']) if policy['retain_months'] else []
+        if created or retired:
+            print(f'{table}: created {created} partitions, retired {", ".join(retired) or "none"}')
+    cur.close()
@@ -0,0 +1,107 @@
+import os
+
+from economy import fold as fold_economy
+from entitlements import tick as tick_entitlements
+from media import collect_garbage, process_media
+from notifications import fold as fold_notifications, prune as prune_notifications
+from partitions import maintain as maintain_partitions
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+DELETE_EXPIRED_STORIES = f'''
+    WITH expired AS (
+        DELETE FROM {SCHEMA}.stories WHERE expires_at < NOW() RETURNING media_digest
+    ), released AS (
+        SELECT media_digest, count(*) AS refs FROM expired WHERE media_digest IS NOT NULL GROUP BY media_digest
+    )
+    UPDATE {SCHEMA}.media_objects m SET ref_count = m.ref_count - r.refs, updated_at = NOW()
+    FROM released r
+    WHERE m.digest = r.media_digest
+'''
+
+DELETE_IDLE_RATE_LIMITS = f'''
+    DELETE FROM {SCHEMA}.rate_limits WHERE updated_at < NOW() - INTERVAL '1 hour'
+'''
+
+STATS_FOLD_BATCH = 5000
+STATS_FOLD_MAX_BATCHES = 20
+
+FOLD_USER_STATS = f'''
+    WITH batch AS (
+        DELETE FROM {SCHEMA}.user_stats_deltas
+        WHERE id IN (SELECT id FROM {SCHEMA}.user_stats_deltas ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING user_id, posts, likes, comments, subscribers, channels
+    ), summed AS (
+        SELECT user_id, sum(posts) AS posts, sum(likes) AS likes, sum(comments) AS comments,
+               sum(subscribers) AS subscribers, sum(channels) AS channels
+        FROM batch GROUP BY user_id
+    )
+    INSERT INTO {SCHEMA}.user_stats AS s
+        (user_id, posts_count, likes_received, comments_received, subscribers_count, channels_count)
+    SELECT user_id, posts, likes, comments, subscribers, channels FROM summed
+    ON CONFLICT (user_id) DO UPDATE SET
+        posts_count = s.posts_count + EXCLUDED.posts_count,
+        likes_received = s.likes_received + EXCLUDED.likes_received,
+        comments_received = s.comments_received + EXCLUDED.comments_received,
+        subscribers_count = s.subscribers_count + EXCLUDED.subscribers_count,
+        channels_count = s.channels_count + EXCLUDED.channels_count,
+        updated_at = NOW()
+'''
+
+
+def expire_stories(conn, payload: dict) -> None:
+    '''Задача stories.expire: удаляет истёкшие истории и отпускает ссылки на их файлы.'''
+    cur = conn.cursor()
+    cur.execute(DELETE_EXPIRED_STORIES)
+    cur.close()
+
+
+def prune_rate_limits(conn, payload: dict) -> None:
+    '''Задача ratelimit.prune: корзины, не тронутые час, уже полные — их можно удалить.'''
+    cur = conn.cursor()
+    cur.execute(DELETE_IDLE_RATE_LIMITS)
+    cur.close()
+
+
+def fold_user_stats(conn, payload: dict) -> None:
+    '''Задача stats.fold: сворачивает приращения из триггеров в user_stats.
+
+    Порции коммитятся по отдельности, чтобы длинный хвост приращений не
+    держал блокировки строк user_stats до конца задачи.
+    '''
+    cur = conn.cursor()
+    for _ in range(payload.get('max_batches', STATS_FOLD_MAX_BATCHES)):
+        cur.execute(FOLD_USER_STATS, (STATS_FOLD_BATCH,))
+        folded = cur.rowcount
+        conn.commit()
+        if not folded:
+            break
+    cur.close()
+
+
+# Задача получает соединение и payload; коммит делает очередь вместе с удалением задачи
+HANDLERS = {
+    'media.process': process_media,
+    'media.gc': collect_garbage,
+    'stories.expire': expire_stories,
+    'ratelimit.prune': prune_rate_limits,
+    'partitions.maintain': maintain_partitions,
+    'stats.fold': fold_user_stats,
+    'notifications.fold': fold_notifications,
+    'notifications.prune': prune_notifications,
+    'entitlements.tick': tick_entitlements,
+    'economy.fold': fold_economy,
+}
+
+# Периодические задачи и интервал в секундах между запусками
+PERIODIC = {
+    'stories.expire': 60,
+    'media.gc': 300,
+    'ratelimit.prune': 3600,
+    'partitions.maintain': 86400,
+    'stats.fold': 30,
+    'notifications.fold': 15,
+    'notifications.prune': 86400,
+    'entitlements.tick': 60,
+    'economy.fold': 60,
+}
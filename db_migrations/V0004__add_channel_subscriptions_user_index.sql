@@ -0,0 +1,4 @@
+-- Индекс для постраничного списка подписок пользователя (новые сверху).
+-- Проверка подписки по (user_id, channel_id) обслуживается уникальным индексом UNIQUE(user_id, channel_id).
+CREATE INDEX IF NOT EXISTS idx_channel_subscriptions_user_subscribed
+ON t_p61541260_yna_social_network_g.channel_subscriptions(user_id, subscribed_at DESC, channel_id DESC);
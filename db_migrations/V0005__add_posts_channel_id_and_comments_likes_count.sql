@@ -0,0 +1,13 @@
+-- Обработчики работают с posts.channel_id и comments.likes_count, которых не было в начальной схеме
+ALTER TABLE t_p61541260_yna_social_network_g.posts
+ADD COLUMN IF NOT EXISTS channel_id INTEGER REFERENCES t_p61541260_yna_social_network_g.channels(id);
+
+UPDATE t_p61541260_yna_social_network_g.posts p
+SET channel_id = c.id
+FROM t_p61541260_yna_social_network_g.channels c
+WHERE p.channel = c.name AND p.channel_id IS NULL;
+
+ALTER TABLE t_p61541260_yna_social_network_g.comments
+ADD COLUMN IF NOT EXISTS likes_count INTEGER DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_posts_channel_id ON t_p61541260_yna_social_network_g.posts(channel_id, created_at DESC);
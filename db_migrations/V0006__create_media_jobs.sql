@@ -0,0 +1,24 @@
+-- Очередь обработки медиа: превью, варианты по ширине и постер для видео
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.media_jobs (
+    id SERIAL PRIMARY KEY,
+    owner_type VARCHAR(20) NOT NULL,
+    owner_id INTEGER NOT NULL,
+    source_key TEXT NOT NULL,
+    media_type VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_jobs_pending
+ON t_p61541260_yna_social_network_g.media_jobs(id) WHERE status = 'pending';
+
+ALTER TABLE t_p61541260_yna_social_network_g.posts
+ADD COLUMN IF NOT EXISTS thumbnail_url TEXT,
+ADD COLUMN IF NOT EXISTS media_variants JSONB;
+
+ALTER TABLE t_p61541260_yna_social_network_g.stories
+ADD COLUMN IF NOT EXISTS thumbnail_url TEXT,
+ADD COLUMN IF NOT EXISTS media_variants JSONB;
@@ -0,0 +1,24 @@
+-- Медиа хранится по sha256 содержимого; ref_count считает посты, истории и каналы, которые на него ссылаются
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.media_objects (
+    digest CHAR(64) PRIMARY KEY,
+    file_key TEXT NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    size_bytes BIGINT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    uploaded BOOLEAN NOT NULL DEFAULT FALSE,
+    variants JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_objects_unreferenced
+ON t_p61541260_yna_social_network_g.media_objects(updated_at) WHERE ref_count <= 0;
+
+ALTER TABLE t_p61541260_yna_social_network_g.posts
+ADD COLUMN IF NOT EXISTS media_digest CHAR(64);
+
+ALTER TABLE t_p61541260_yna_social_network_g.stories
+ADD COLUMN IF NOT EXISTS media_digest CHAR(64);
+
+ALTER TABLE t_p61541260_yna_social_network_g.channels
+ADD COLUMN IF NOT EXISTS avatar_digest CHAR(64);
@@ -0,0 +1,39 @@
+-- Очередь отложенных задач: обработчики только добавляют строку, воркеры забирают её через FOR UPDATE SKIP LOCKED.
+-- Выполненные задачи удаляются, исчерпавшие попытки остаются со статусом 'dead'.
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.jobs (
+    id BIGSERIAL PRIMARY KEY,
+    task VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    dedupe_key VARCHAR(100),
+    locked_by VARCHAR(100),
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_runnable
+ON t_p61541260_yna_social_network_g.jobs(run_at) WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_jobs_running
+ON t_p61541260_yna_social_network_g.jobs(locked_at) WHERE status = 'running';
+
+CREATE INDEX IF NOT EXISTS idx_jobs_dead
+ON t_p61541260_yna_social_network_g.jobs(task, updated_at) WHERE status = 'dead';
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe
+ON t_p61541260_yna_social_network_g.jobs(dedupe_key) WHERE dedupe_key IS NOT NULL AND status IN ('pending', 'running');
+
+-- Незавершённые задачи обработки медиа переезжают в общую очередь
+INSERT INTO t_p61541260_yna_social_network_g.jobs (task, payload)
+SELECT 'media.process', json_build_object(
+    'owner_type', owner_type, 'owner_id', owner_id, 'source_key', source_key, 'media_type', media_type
+)
+FROM t_p61541260_yna_social_network_g.media_jobs
+WHERE status IN ('pending', 'processing');
+
+DROP TABLE IF EXISTS t_p61541260_yna_social_network_g.media_jobs;
@@ -0,0 +1,7 @@
+-- Регистры HyperLogLog (2^12 по байту) для оценки уникальных зрителей истории.
+-- Точные строки в story_views пишутся для первых зрителей, дальше — выборочно.
+ALTER TABLE t_p61541260_yna_social_network_g.stories
+ADD COLUMN IF NOT EXISTS viewer_sketch BYTEA NOT NULL DEFAULT decode(repeat('00', 4096), 'hex');
+
+CREATE INDEX IF NOT EXISTS idx_story_views_story_viewed
+ON t_p61541260_yna_social_network_g.story_views(story_id, viewed_at DESC, user_id DESC);
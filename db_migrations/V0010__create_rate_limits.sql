@@ -0,0 +1,11 @@
+-- Общие корзины token bucket для ограничения частоты запросов.
+-- UNLOGGED: после сбоя БД корзины просто начнутся заново полными.
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.rate_limits (
+    bucket VARCHAR(200) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    granted INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limits_updated
+ON t_p61541260_yna_social_network_g.rate_limits(updated_at);
@@ -0,0 +1,188 @@
+-- Помесячное секционирование растущих таблиц активности.
+-- Уникальный ключ секционированной таблицы обязан включать ключ секционирования,
+-- поэтому likes секционируются по дате создания поста, а story_views — истории:
+-- все строки одного поста (истории) лежат в одной секции, и UNIQUE(post_id, user_id)
+-- по-прежнему действует глобально. comments и messages секционируются по created_at.
+-- Секции создаёт ensure_monthly_partitions (её же вызывает scripts/partitions.py),
+-- строки вне созданных секций попадают в <таблица>_default.
+
+CREATE OR REPLACE FUNCTION t_p61541260_yna_social_network_g.ensure_monthly_partitions(
+    p_schema TEXT, p_table TEXT, p_key TEXT, p_from DATE, p_to DATE
+) RETURNS INTEGER AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::date;
+    v_next DATE;
+    v_partition TEXT;
+    v_default TEXT := p_table || '_default';
+    v_has_rows BOOLEAN;
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= p_to LOOP
+        v_next := (v_month + INTERVAL '1 month')::date;
+        v_partition := p_table || '_p' || to_char(v_month, 'YYYYMM');
+        IF to_regclass(format('%I.%I', p_schema, v_partition)) IS NULL THEN
+            v_has_rows := FALSE;
+            IF to_regclass(format('%I.%I', p_schema, v_default)) IS NOT NULL THEN
+                EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I.%I WHERE %I >= %L AND %I < %L)',
+                               p_schema, v_default, p_key, v_month, p_key, v_next) INTO v_has_rows;
+            END IF;
+            IF v_has_rows THEN
+                -- Строки этого месяца уже осели в default: переносим их в новую секцию
+                EXECUTE format('CREATE TABLE %I.%I (LIKE %I.%I INCLUDING DEFAULTS)',
+                               p_schema, v_partition, p_schema, p_table);
+                EXECUTE format('WITH moved AS (DELETE FROM %I.%I WHERE %I >= %L AND %I < %L RETURNING *) '
+                               'INSERT INTO %I.%I SELECT * FROM moved',
+                               p_schema, v_default, p_key, v_month, p_key, v_next, p_schema, v_partition);
+                EXECUTE format('ALTER TABLE %I.%I ATTACH PARTITION %I.%I FOR VALUES FROM (%L) TO (%L)',
+                               p_schema, p_table, p_schema, v_partition, v_month, v_next);
+            ELSE
+                EXECUTE format('CREATE TABLE %I.%I PARTITION OF %I.%I FOR VALUES FROM (%L) TO (%L)',
+                               p_schema, v_partition, p_schema, p_table, v_month, v_next);
+            END IF;
+            v_created := v_created + 1;
+        END IF;
+        v_month := v_next;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+UPDATE t_p61541260_yna_social_network_g.posts SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+UPDATE t_p61541260_yna_social_network_g.stories SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+
+-- likes
+ALTER TABLE t_p61541260_yna_social_network_g.likes RENAME TO likes_unpartitioned;
+ALTER TABLE t_p61541260_yna_social_network_g.likes_unpartitioned DROP CONSTRAINT IF EXISTS likes_pkey;
+ALTER TABLE t_p61541260_yna_social_network_g.likes_unpartitioned DROP CONSTRAINT IF EXISTS likes_user_id_post_id_key;
+DROP INDEX IF EXISTS t_p61541260_yna_social_network_g.idx_likes_post_id;
+
+CREATE TABLE t_p61541260_yna_social_network_g.likes (
+    id INTEGER NOT NULL DEFAULT nextval('t_p61541260_yna_social_network_g.likes_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.users(id),
+    post_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.posts(id),
+    post_created_at TIMESTAMP NOT NULL,
+    is_super_like BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (post_created_at);
+
+CREATE TABLE t_p61541260_yna_social_network_g.likes_default
+PARTITION OF t_p61541260_yna_social_network_g.likes DEFAULT;
+
+SELECT t_p61541260_yna_social_network_g.ensure_monthly_partitions(
+    't_p61541260_yna_social_network_g', 'likes', 'post_created_at',
+    COALESCE((SELECT min(created_at) FROM t_p61541260_yna_social_network_g.posts), CURRENT_TIMESTAMP)::date,
+    (CURRENT_DATE + INTERVAL '3 months')::date
+);
+
+INSERT INTO t_p61541260_yna_social_network_g.likes (id, user_id, post_id, post_created_at, is_super_like, created_at)
+SELECT l.id, l.user_id, l.post_id, p.created_at, l.is_super_like, l.created_at
+FROM t_p61541260_yna_social_network_g.likes_unpartitioned l
+JOIN t_p61541260_yna_social_network_g.posts p ON p.id = l.post_id;
+
+ALTER SEQUENCE t_p61541260_yna_social_network_g.likes_id_seq OWNED BY t_p61541260_yna_social_network_g.likes.id;
+DROP TABLE t_p61541260_yna_social_network_g.likes_unpartitioned;
+
+ALTER TABLE t_p61541260_yna_social_network_g.likes ADD PRIMARY KEY (id, post_created_at);
+ALTER TABLE t_p61541260_yna_social_network_g.likes ADD CONSTRAINT likes_post_id_user_id_key UNIQUE (post_id, user_id, post_created_at);
+
+-- comments
+ALTER TABLE t_p61541260_yna_social_network_g.comments RENAME TO comments_unpartitioned;
+ALTER TABLE t_p61541260_yna_social_network_g.comments_unpartitioned DROP CONSTRAINT IF EXISTS comments_pkey;
+DROP INDEX IF EXISTS t_p61541260_yna_social_network_g.idx_comments_post_id;
+
+CREATE TABLE t_p61541260_yna_social_network_g.comments (
+    id INTEGER NOT NULL DEFAULT nextval('t_p61541260_yna_social_network_g.comments_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.users(id),
+    post_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.posts(id),
+    content TEXT NOT NULL,
+    likes_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE t_p61541260_yna_social_network_g.comments_default
+PARTITION OF t_p61541260_yna_social_network_g.comments DEFAULT;
+
+SELECT t_p61541260_yna_social_network_g.ensure_monthly_partitions(
+    't_p61541260_yna_social_network_g', 'comments', 'created_at',
+    COALESCE((SELECT min(created_at) FROM t_p61541260_yna_social_network_g.comments_unpartitioned), CURRENT_TIMESTAMP)::date,
+    (CURRENT_DATE + INTERVAL '3 months')::date
+);
+
+INSERT INTO t_p61541260_yna_social_network_g.comments (id, user_id, post_id, content, likes_count, created_at)
+SELECT id, user_id, post_id, content, likes_count, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM t_p61541260_yna_social_network_g.comments_unpartitioned;
+
+ALTER SEQUENCE t_p61541260_yna_social_network_g.comments_id_seq OWNED BY t_p61541260_yna_social_network_g.comments.id;
+DROP TABLE t_p61541260_yna_social_network_g.comments_unpartitioned;
+
+ALTER TABLE t_p61541260_yna_social_network_g.comments ADD PRIMARY KEY (id, created_at);
+CREATE INDEX idx_comments_post_id ON t_p61541260_yna_social_network_g.comments(post_id, created_at);
+
+-- story_views: просмотры уже удалённых историй не переносим
+ALTER TABLE t_p61541260_yna_social_network_g.story_views RENAME TO story_views_unpartitioned;
+ALTER TABLE t_p61541260_yna_social_network_g.story_views_unpartitioned DROP CONSTRAINT IF EXISTS story_views_pkey;
+ALTER TABLE t_p61541260_yna_social_network_g.story_views_unpartitioned DROP CONSTRAINT IF EXISTS story_views_story_id_user_id_key;
+DROP INDEX IF EXISTS t_p61541260_yna_social_network_g.idx_story_views_story_viewed;
+
+CREATE TABLE t_p61541260_yna_social_network_g.story_views (
+    id INTEGER NOT NULL DEFAULT nextval('t_p61541260_yna_social_network_g.story_views_id_seq'),
+    story_id INTEGER NOT NULL,
+    user_id INTEGER,
+    story_created_at TIMESTAMP NOT NULL,
+    viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (story_created_at);
+
+CREATE TABLE t_p61541260_yna_social_network_g.story_views_default
+PARTITION OF t_p61541260_yna_social_network_g.story_views DEFAULT;
+
+SELECT t_p61541260_yna_social_network_g.ensure_monthly_partitions(
+    't_p61541260_yna_social_network_g', 'story_views', 'story_created_at',
+    COALESCE((SELECT min(created_at) FROM t_p61541260_yna_social_network_g.stories), CURRENT_TIMESTAMP)::date,
+    (CURRENT_DATE + INTERVAL '3 months')::date
+);
+
+INSERT INTO t_p61541260_yna_social_network_g.story_views (id, story_id, user_id, story_created_at, viewed_at)
+SELECT v.id, v.story_id, v.user_id, s.created_at, v.viewed_at
+FROM t_p61541260_yna_social_network_g.story_views_unpartitioned v
+JOIN t_p61541260_yna_social_network_g.stories s ON s.id = v.story_id;
+
+ALTER SEQUENCE t_p61541260_yna_social_network_g.story_views_id_seq OWNED BY t_p61541260_yna_social_network_g.story_views.id;
+DROP TABLE t_p61541260_yna_social_network_g.story_views_unpartitioned;
+
+ALTER TABLE t_p61541260_yna_social_network_g.story_views ADD PRIMARY KEY (id, story_created_at);
+ALTER TABLE t_p61541260_yna_social_network_g.story_views ADD CONSTRAINT story_views_story_id_user_id_key UNIQUE (story_id, user_id, story_created_at);
+CREATE INDEX idx_story_views_story_viewed
+ON t_p61541260_yna_social_network_g.story_views(story_id, viewed_at DESC, user_id DESC);
+
+-- messages
+ALTER TABLE t_p61541260_yna_social_network_g.messages RENAME TO messages_unpartitioned;
+ALTER TABLE t_p61541260_yna_social_network_g.messages_unpartitioned DROP CONSTRAINT IF EXISTS messages_pkey;
+DROP INDEX IF EXISTS t_p61541260_yna_social_network_g.idx_messages_chat_id;
+DROP INDEX IF EXISTS t_p61541260_yna_social_network_g.idx_messages_created_at;
+
+CREATE TABLE t_p61541260_yna_social_network_g.messages (
+    id INTEGER NOT NULL DEFAULT nextval('t_p61541260_yna_social_network_g.messages_id_seq'),
+    chat_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.chats(id),
+    user_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.users(id),
+    content TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE t_p61541260_yna_social_network_g.messages_default
+PARTITION OF t_p61541260_yna_social_network_g.messages DEFAULT;
+
+SELECT t_p61541260_yna_social_network_g.ensure_monthly_partitions(
+    't_p61541260_yna_social_network_g', 'messages', 'created_at',
+    COALESCE((SELECT min(created_at) FROM t_p61541260_yna_social_network_g.messages_unpartitioned), CURRENT_TIMESTAMP)::date,
+    (CURRENT_DATE + INTERVAL '3 months')::date
+);
+
+INSERT INTO t_p61541260_yna_social_network_g.messages (id, chat_id, user_id, content, created_at)
+SELECT id, chat_id, user_id, content, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM t_p61541260_yna_social_network_g.messages_unpartitioned;
+
+ALTER SEQUENCE t_p61541260_yna_social_network_g.messages_id_seq OWNED BY t_p61541260_yna_social_network_g.messages.id;
+DROP TABLE t_p61541260_yna_social_network_g.messages_unpartitioned;
+
+ALTER TABLE t_p61541260_yna_social_network_g.messages ADD PRIMARY KEY (id, created_at);
+CREATE INDEX idx_messages_chat_id ON t_p61541260_yna_social_network_g.messages(chat_id, created_at);
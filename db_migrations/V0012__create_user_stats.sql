@@ -0,0 +1,118 @@
+-- Сводная статистика пользователя для профиля: читается одной строкой.
+-- Триггеры не обновляют user_stats напрямую (у популярных авторов строка стала бы
+-- горячей), а дописывают приращения в user_stats_deltas; задача stats.fold
+-- периодически сворачивает их в user_stats.
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES t_p61541260_yna_social_network_g.users(id),
+    posts_count INTEGER NOT NULL DEFAULT 0,
+    likes_received INTEGER NOT NULL DEFAULT 0,
+    comments_received INTEGER NOT NULL DEFAULT 0,
+    subscribers_count INTEGER NOT NULL DEFAULT 0,
+    channels_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.user_stats_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    posts INTEGER NOT NULL DEFAULT 0,
+    likes INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    subscribers INTEGER NOT NULL DEFAULT 0,
+    channels INTEGER NOT NULL DEFAULT 0
+);
+
+-- Вид события передаётся аргументом: у секционированных таблиц TG_TABLE_NAME — имя секции
+CREATE OR REPLACE FUNCTION t_p61541260_yna_social_network_g.record_user_stats_delta() RETURNS trigger AS $$
+DECLARE
+    v_row RECORD;
+    v_sign INTEGER;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        v_row := NEW;
+        v_sign := 1;
+    ELSE
+        v_row := OLD;
+        v_sign := -1;
+    END IF;
+
+    IF TG_ARGV[0] = 'posts' THEN
+        INSERT INTO t_p61541260_yna_social_network_g.user_stats_deltas (user_id, posts)
+        VALUES (v_row.user_id, v_sign);
+    ELSIF TG_ARGV[0] = 'likes' THEN
+        INSERT INTO t_p61541260_yna_social_network_g.user_stats_deltas (user_id, likes)
+        SELECT user_id, v_sign FROM t_p61541260_yna_social_network_g.posts WHERE id = v_row.post_id;
+    ELSIF TG_ARGV[0] = 'comments' THEN
+        INSERT INTO t_p61541260_yna_social_network_g.user_stats_deltas (user_id, comments)
+        SELECT user_id, v_sign FROM t_p61541260_yna_social_network_g.posts WHERE id = v_row.post_id;
+    ELSIF TG_ARGV[0] = 'subscriptions' THEN
+        INSERT INTO t_p61541260_yna_social_network_g.user_stats_deltas (user_id, subscribers)
+        SELECT owner_id, v_sign FROM t_p61541260_yna_social_network_g.channels
+        WHERE id = v_row.channel_id AND owner_id IS NOT NULL;
+    ELSIF TG_ARGV[0] = 'channels' AND v_row.owner_id IS NOT NULL THEN
+        INSERT INTO t_p61541260_yna_social_network_g.user_stats_deltas (user_id, channels)
+        VALUES (v_row.owner_id, v_sign);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_stats_delta ON t_p61541260_yna_social_network_g.posts;
+CREATE TRIGGER user_stats_delta AFTER INSERT OR DELETE ON t_p61541260_yna_social_network_g.posts
+FOR EACH ROW EXECUTE PROCEDURE t_p61541260_yna_social_network_g.record_user_stats_delta('posts');
+
+DROP TRIGGER IF EXISTS user_stats_delta ON t_p61541260_yna_social_network_g.likes;
+CREATE TRIGGER user_stats_delta AFTER INSERT OR DELETE ON t_p61541260_yna_social_network_g.likes
+FOR EACH ROW EXECUTE PROCEDURE t_p61541260_yna_social_network_g.record_user_stats_delta('likes');
+
+DROP TRIGGER IF EXISTS user_stats_delta ON t_p61541260_yna_social_network_g.comments;
+CREATE TRIGGER user_stats_delta AFTER INSERT OR DELETE ON t_p61541260_yna_social_network_g.comments
+FOR EACH ROW EXECUTE PROCEDURE t_p61541260_yna_social_network_g.record_user_stats_delta('comments');
+
+DROP TRIGGER IF EXISTS user_stats_delta ON t_p61541260_yna_social_network_g.channel_subscriptions;
+CREATE TRIGGER user_stats_delta AFTER INSERT OR DELETE ON t_p61541260_yna_social_network_g.channel_subscriptions
+FOR EACH ROW EXECUTE PROCEDURE t_p61541260_yna_social_network_g.record_user_stats_delta('subscriptions');
+
+DROP TRIGGER IF EXISTS user_stats_delta ON t_p61541260_yna_social_network_g.channels;
+CREATE TRIGGER user_stats_delta AFTER INSERT OR DELETE ON t_p61541260_yna_social_network_g.channels
+FOR EACH ROW EXECUTE PROCEDURE t_p61541260_yna_social_network_g.record_user_stats_delta('channels');
+
+-- Полный пересчёт по исходным таблицам: при развёртывании и после массовой заливки
+-- с отключёнными триггерами. Запускать при отсутствии записи, иначе приращения,
+-- закоммиченные во время пересчёта, потеряются.
+CREATE OR REPLACE FUNCTION t_p61541260_yna_social_network_g.rebuild_user_stats() RETURNS void AS $$
+BEGIN
+    DELETE FROM t_p61541260_yna_social_network_g.user_stats_deltas;
+    DELETE FROM t_p61541260_yna_social_network_g.user_stats;
+    INSERT INTO t_p61541260_yna_social_network_g.user_stats
+        (user_id, posts_count, likes_received, comments_received, subscribers_count, channels_count)
+    SELECT u.id, COALESCE(p.n, 0), COALESCE(l.n, 0), COALESCE(c.n, 0), COALESCE(s.n, 0), COALESCE(ch.n, 0)
+    FROM t_p61541260_yna_social_network_g.users u
+    LEFT JOIN (
+        SELECT user_id, count(*) AS n FROM t_p61541260_yna_social_network_g.posts GROUP BY user_id
+    ) p ON p.user_id = u.id
+    LEFT JOIN (
+        SELECT p.user_id, count(*) AS n
+        FROM t_p61541260_yna_social_network_g.likes l
+        JOIN t_p61541260_yna_social_network_g.posts p ON p.id = l.post_id
+        GROUP BY p.user_id
+    ) l ON l.user_id = u.id
+    LEFT JOIN (
+        SELECT p.user_id, count(*) AS n
+        FROM t_p61541260_yna_social_network_g.comments c
+        JOIN t_p61541260_yna_social_network_g.posts p ON p.id = c.post_id
+        GROUP BY p.user_id
+    ) c ON c.user_id = u.id
+    LEFT JOIN (
+        SELECT ch.owner_id AS user_id, count(*) AS n
+        FROM t_p61541260_yna_social_network_g.channel_subscriptions cs
+        JOIN t_p61541260_yna_social_network_g.channels ch ON ch.id = cs.channel_id
+        GROUP BY ch.owner_id
+    ) s ON s.user_id = u.id
+    LEFT JOIN (
+        SELECT owner_id AS user_id, count(*) AS n FROM t_p61541260_yna_social_network_g.channels GROUP BY owner_id
+    ) ch ON ch.user_id = u.id;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT t_p61541260_yna_social_network_g.rebuild_user_stats();
@@ -0,0 +1,35 @@
+-- Уведомления о лайках, комментариях и подписках.
+-- Обработчики пишут событие в notification_outbox в той же транзакции, что и
+-- сам лайк; задача notifications.fold забирает события порциями и сливает их
+-- в одну непрочитанную строку notifications на (получатель, вид, объект):
+-- всплеск из тысячи лайков даёт одну строку "1000 человек оценили ваш пост".
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    recipient_id INTEGER NOT NULL,
+    kind VARCHAR(20) NOT NULL,
+    target_id INTEGER NOT NULL,
+    actor_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.notifications (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.users(id),
+    kind VARCHAR(20) NOT NULL,
+    target_id INTEGER NOT NULL,
+    actors_count INTEGER NOT NULL DEFAULT 0,
+    recent_actor_ids INTEGER[] NOT NULL DEFAULT '{}',
+    is_read BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Не больше одной непрочитанной строки на объект: цель ON CONFLICT при слиянии.
+-- Ведущий user_id делает этот же индекс индексом для счётчика непрочитанных.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_unread
+    ON t_p61541260_yna_social_network_g.notifications (user_id, kind, target_id)
+    WHERE NOT is_read;
+
+-- Лента уведомлений: курсор (updated_at, id) по убыванию
+CREATE INDEX IF NOT EXISTS idx_notifications_inbox
+    ON t_p61541260_yna_social_network_g.notifications (user_id, updated_at DESC, id DESC);
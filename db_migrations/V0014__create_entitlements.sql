@@ -0,0 +1,41 @@
+-- Ограниченные по времени права (буст, в будущем и другие платные функции).
+-- Окно проходит состояния scheduled -> active -> expired; переходы делает
+-- задача entitlements.tick и в той же транзакции переключает флаги
+-- пользователя и его постов.
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.entitlements (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES t_p61541260_yna_social_network_g.users(id),
+    kind VARCHAR(30) NOT NULL,
+    starts_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ends_at TIMESTAMP NOT NULL,
+    state VARCHAR(10) NOT NULL DEFAULT 'scheduled',
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Очереди открытия и закрытия окон: частичные индексы содержат только ждущие строки
+CREATE INDEX IF NOT EXISTS idx_entitlements_opening
+    ON t_p61541260_yna_social_network_g.entitlements (starts_at) WHERE state = 'scheduled';
+
+CREATE INDEX IF NOT EXISTS idx_entitlements_closing
+    ON t_p61541260_yna_social_network_g.entitlements (ends_at) WHERE state = 'active';
+
+CREATE INDEX IF NOT EXISTS idx_entitlements_user_active
+    ON t_p61541260_yna_social_network_g.entitlements (user_id, kind) WHERE state = 'active';
+
+-- Действующие бусты переносятся в окна; посты истёкших бустов перестают быть в топе
+INSERT INTO t_p61541260_yna_social_network_g.entitlements (user_id, kind, starts_at, ends_at, state)
+SELECT id, 'boost', CURRENT_TIMESTAMP, boost_active_until, 'active'
+FROM t_p61541260_yna_social_network_g.users
+WHERE boost_active_until > CURRENT_TIMESTAMP;
+
+UPDATE t_p61541260_yna_social_network_g.users
+SET boost_active_until = NULL
+WHERE boost_active_until <= CURRENT_TIMESTAMP;
+
+UPDATE t_p61541260_yna_social_network_g.posts p
+SET is_boosted = FALSE
+WHERE p.is_boosted
+  AND NOT EXISTS (
+      SELECT 1 FROM t_p61541260_yna_social_network_g.users u
+      WHERE u.id = p.user_id AND u.boost_active_until > CURRENT_TIMESTAMP
+  );
@@ -0,0 +1,48 @@
+-- История покупок по пользователю: курсор (created_at, id) по убыванию
+CREATE INDEX IF NOT EXISTS idx_purchases_user_created
+    ON t_p61541260_yna_social_network_g.purchases (user_id, created_at DESC, id DESC);
+
+-- Движение юнакоинов: начисления (kind = 'issue', item — за что) и продажи
+-- (kind = 'sale', item — item_type). Обработчики дописывают события в том же
+-- запросе, что меняет баланс; задача economy.fold забирает их порциями и
+-- прибавляет к почасовым и посуточным сводкам, которые и читают отчёты.
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.economy_events (
+    id BIGSERIAL PRIMARY KEY,
+    occurred_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    kind VARCHAR(10) NOT NULL,
+    item VARCHAR(50) NOT NULL,
+    coins INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.economy_hourly (
+    hour TIMESTAMP NOT NULL,
+    kind VARCHAR(10) NOT NULL,
+    item VARCHAR(50) NOT NULL,
+    events BIGINT NOT NULL DEFAULT 0,
+    coins BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, kind, item)
+);
+
+CREATE TABLE IF NOT EXISTS t_p61541260_yna_social_network_g.economy_daily (
+    day DATE NOT NULL,
+    kind VARCHAR(10) NOT NULL,
+    item VARCHAR(50) NOT NULL,
+    events BIGINT NOT NULL DEFAULT 0,
+    coins BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, kind, item)
+);
+
+-- Продажи до миграции попадают в сводки сразу; истории начислений нет
+INSERT INTO t_p61541260_yna_social_network_g.economy_hourly (hour, kind, item, events, coins)
+SELECT date_trunc('hour', created_at), 'sale', item_type, count(*), sum(price)
+FROM t_p61541260_yna_social_network_g.purchases
+WHERE created_at IS NOT NULL
+GROUP BY 1, 3
+ON CONFLICT DO NOTHING;
+
+INSERT INTO t_p61541260_yna_social_network_g.economy_daily (day, kind, item, events, coins)
+SELECT created_at::date, 'sale', item_type, count(*), sum(price)
+FROM t_p61541260_yna_social_network_g.purchases
+WHERE created_at IS NOT NULL
+GROUP BY 1, 3
+ON CONFLICT DO NOTHING;
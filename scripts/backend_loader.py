@@ -0,0 +1,37 @@
+'''Загрузка функций backend/ в один процесс для локальных стендов.
+
+Каждая функция импортирует соседние модули по коротким именам (index,
+instrument, storage, ...), и у разных функций эти имена совпадают. Загрузчик
+импортирует функцию в изолированном окружении sys.modules и возвращает её
+модули, не давая функциям подменять модули друг друга.
+'''
+import importlib
+import sys
+import threading
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTIONS = ['auth', 'channels', 'posts', 'shop', 'stories']
+
+_lock = threading.Lock()
+
+
+def load_function(name: str) -> dict:
+    '''Импортирует backend/<name>/index.py и возвращает {имя модуля: модуль}.'''
+    function_dir = BACKEND / name
+    local_names = {path.stem for path in function_dir.glob('*.py')}
+    with _lock:
+        saved = {n: sys.modules.pop(n) for n in list(sys.modules) if n in local_names}
+        sys.path.insert(0, str(function_dir))
+        try:
+            importlib.import_module('index')
+            modules = {n: sys.modules.pop(n) for n in list(sys.modules) if n in local_names}
+        finally:
+            sys.path.remove(str(function_dir))
+            sys.modules.update(saved)
+    return modules
+
+
+def load_all(names=None) -> dict:
+    '''Загружает функции и возвращает {функция: {имя модуля: модуль}}.'''
+    return {name: load_function(name) for name in (names or FUNCTIONS)}
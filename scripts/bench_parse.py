@@ -0,0 +1,160 @@
+'''Фазз-замер разбора тела запроса (request.py): во что обходится проверка
+корректного запроса и как быстро отклоняются испорченные.
+
+Тела строятся из схем, повторяющих ACTIONS функции posts: корректные,
+с лишним размером (по Content-Length и без него), обрезанный JSON, поля
+неверных типов и случайные мутации. Для каждой группы печатаются коды
+ответов и задержка parse_body рядом с голым json.loads того же тела.
+Любое исключение, кроме RequestError, считается падением и печатается.
+
+    python scripts/bench_parse.py
+    python scripts/bench_parse.py --iterations 5000 --seed 7 --save parse.json
+'''
+import argparse
+import base64
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from loadtest import git_revision, percentile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend' / 'posts'))
+from request import Action, RequestError, parse_body, flag, ident, idents, text, MB  # noqa: E402
+
+MEDIA_MAX_BYTES = 10 * MB
+
+# Те же поля и пределы, что у backend/posts; index.py не импортируется,
+# чтобы замер не требовал psycopg2 и настроек БД
+ACTIONS = {
+    'create': Action({
+        'user_id': ident(required=True),
+        'content': text(10000, required=True),
+        'channel_id': ident(),
+        'media_data': text(MEDIA_MAX_BYTES, default=None, strip=False),
+        'media_type': text(100, default=None),
+    }, max_bytes=MEDIA_MAX_BYTES),
+    'like': Action({'user_id': ident(required=True), 'post_id': ident(required=True), 'use_super_like': flag()}),
+    'comment': Action({'user_id': ident(required=True), 'post_id': ident(required=True), 'content': text(2000, required=True)}),
+    'get_many': Action({'user_id': ident(), 'post_ids': idents(300, required=True)}),
+}
+
+JUNK_VALUES = [None, True, -1, 0, 2 ** 40, 1.5, '', 'abc', '１２', [], [1, 'x'], {}, {'a': [1]}, 'x' * 20000]
+
+
+def valid_body(rng: random.Random, media_bytes: int) -> dict:
+    action = rng.choice(['like', 'comment', 'get_many', 'create'])
+    body = {'action': action, 'user_id': rng.randint(1, 10 ** 6)}
+    if action == 'like':
+        body.update(post_id=rng.randint(1, 10 ** 7), use_super_like=rng.random() < 0.1)
+    elif action == 'comment':
+        body.update(post_id=rng.randint(1, 10 ** 7), content='Отличный пост! ' * rng.randint(1, 20))
+    elif action == 'get_many':
+        body['post_ids'] = [rng.randint(1, 10 ** 7) for _ in range(rng.randint(1, 300))]
+    else:
+        body.update(content='Новый пост ' * rng.randint(1, 50), media_type='image/jpeg',
+                    media_data=base64.b64encode(rng.randbytes(media_bytes)).decode())
+    return body
+
+
+def mutate(rng: random.Random, body: dict) -> dict:
+    body = dict(body)
+    for _ in range(rng.randint(1, 3)):
+        key = rng.choice(list(body) + ['post_ids', 'extra'])
+        if rng.random() < 0.2:
+            body.pop(key, None)
+        else:
+            body[key] = rng.choice(JUNK_VALUES)
+    return body
+
+
+def cases(rng: random.Random, iterations: int, media_bytes: int):
+    '''(группа, событие) для каждого замера.'''
+    for _ in range(iterations):
+        body = valid_body(rng, media_bytes)
+        raw = json.dumps(body, ensure_ascii=False)
+        yield 'valid', {'body': raw}
+        yield 'wrong types', {'body': json.dumps(mutate(rng, body), ensure_ascii=False)}
+        yield 'truncated', {'body': raw[:rng.randint(0, max(0, len(raw) - 1))]}
+        yield 'random bytes', {'body': rng.randbytes(rng.randint(1, 512)).decode('latin-1')}
+        if body['action'] != 'create':
+            # Мелкое действие с мегабайтом мусора: action находится в начале тела
+            yield 'oversized', {'body': raw[:-1] + ', "pad": "' + 'x' * MB + '"}'}
+        else:
+            # Заголовок сообщает размер раньше, чем тело попало в разбор
+            yield 'oversized', {'body': raw, 'headers': {'Content-Length': str(MEDIA_MAX_BYTES + 1)}}
+
+
+def warm(raw: str) -> None:
+    try:
+        json.loads(raw)
+    except ValueError:
+        pass
+
+
+def measure(event: dict):
+    # Первый разбор тела дороже из-за холодного кэша; оба замера идут после прогрева
+    warm(event['body'])
+    start = time.perf_counter()
+    try:
+        parse_body(event, ACTIONS)
+        status = 200
+    except RequestError as e:
+        status = e.status
+    parse_us = (time.perf_counter() - start) * 1e6
+
+    start = time.perf_counter()
+    warm(event['body'])
+    loads_us = (time.perf_counter() - start) * 1e6
+    return status, parse_us, loads_us
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000, help='корректных тел; из каждого строятся остальные группы')
+    parser.add_argument('--media-kb', type=int, default=256, help='размер файла в create')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='сохранить результат в JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    groups = {}
+    crashes = []
+    for group, event in cases(rng, args.iterations, args.media_kb * 1024):
+        try:
+            status, parse_us, loads_us = measure(event)
+        except Exception as e:
+            crashes.append((group, repr(e), event['body'][:200]))
+            continue
+        g = groups.setdefault(group, {'statuses': Counter(), 'parse': [], 'loads': []})
+        g['statuses'][status] += 1
+        g['parse'].append(parse_us)
+        g['loads'].append(loads_us)
+
+    print(f'{"group":<14} {"n":>6} {"p50 us":>9} {"p99 us":>9} {"loads p50":>10}  statuses')
+    report = {'revision': git_revision(), 'seed': args.seed, 'groups': {}, 'crashes': len(crashes)}
+    for group, g in groups.items():
+        parse_sorted, loads_sorted = sorted(g['parse']), sorted(g['loads'])
+        row = {
+            'n': len(parse_sorted),
+            'p50_us': percentile(parse_sorted, 50),
+            'p99_us': percentile(parse_sorted, 99),
+            'loads_p50_us': percentile(loads_sorted, 50),
+            'statuses': dict(g['statuses']),
+        }
+        report['groups'][group] = row
+        statuses = ', '.join(f'{s}: {n}' for s, n in sorted(g['statuses'].items()))
+        print(f'{group:<14} {row["n"]:>6} {row["p50_us"]:>9.1f} {row["p99_us"]:>9.1f} {row["loads_p50_us"]:>10.1f}  {statuses}')
+
+    for group, error, body in crashes[:10]:
+        print(f'crash in {group}: {error} on {body!r}')
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if crashes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
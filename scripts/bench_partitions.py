@@ -0,0 +1,157 @@
+'''Задержка вставки и чтения likes, comments и story_views до и после секционирования.
+
+Сравниваются две схемы с одинаковыми данными: одна развёрнута до V0010
+(обычные таблицы), другая — со всеми миграциями (секции по месяцам).
+Запросы те же, что выполняют обработчики; вставки откатываются, чтобы
+объём таблиц не менялся между прогонами.
+
+    python scripts/datagen.py --schema bench_flat bootstrap --reset --target 10
+    python scripts/datagen.py --schema bench_flat generate --posts 500000 --likes 3000000
+    python scripts/datagen.py --schema bench_parted bootstrap --reset
+    python scripts/datagen.py --schema bench_parted generate --posts 500000 --likes 3000000
+    python scripts/bench_partitions.py --before bench_flat --after bench_parted --save partitions.json
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from loadtest import git_revision, percentile
+
+COMMENTS_COLUMNS = '''
+    SELECT c.id, c.content, c.likes_count, c.created_at,
+           u.id, u.username, u.display_name, u.avatar_url, u.is_verified, u.verification_color
+    FROM {s}.comments c
+    JOIN {s}.users u ON c.user_id = u.id
+'''
+
+VIEWERS_COLUMNS = '''
+    SELECT u.id, u.username, u.display_name, u.avatar_url, u.is_verified, sv.viewed_at
+    FROM {s}.story_views sv
+    JOIN {s}.users u ON sv.user_id = u.id
+'''
+
+QUERIES = {
+    'before': {
+        'insert_like': '''
+            INSERT INTO {s}.likes (user_id, post_id, is_super_like) VALUES (%(user)s, %(post)s, FALSE)
+            ON CONFLICT DO NOTHING
+        ''',
+        'find_like': 'SELECT is_super_like FROM {s}.likes WHERE user_id = %(user)s AND post_id = %(post)s',
+        'insert_comment': '''
+            INSERT INTO {s}.comments (post_id, user_id, content) VALUES (%(post)s, %(user)s, 'bench') RETURNING id
+        ''',
+        'get_comments': COMMENTS_COLUMNS + 'WHERE c.post_id = %(post)s ORDER BY c.created_at ASC',
+        'insert_story_view': '''
+            INSERT INTO {s}.story_views (story_id, user_id) VALUES (%(story)s, %(user)s) ON CONFLICT DO NOTHING
+        ''',
+        'story_viewers': VIEWERS_COLUMNS + '''
+            WHERE sv.story_id = %(story)s ORDER BY sv.viewed_at DESC, sv.user_id DESC LIMIT 50
+        ''',
+    },
+    'after': {
+        'insert_like': '''
+            INSERT INTO {s}.likes (user_id, post_id, post_created_at, is_super_like)
+            SELECT %(user)s, id, created_at, FALSE FROM {s}.posts WHERE id = %(post)s
+            ON CONFLICT DO NOTHING
+        ''',
+        'find_like': '''
+            SELECT is_super_like FROM {s}.likes
+            WHERE user_id = %(user)s AND post_id = %(post)s
+              AND post_created_at = (SELECT created_at FROM {s}.posts WHERE id = %(post)s)
+        ''',
+        'insert_comment': '''
+            INSERT INTO {s}.comments (post_id, user_id, content) VALUES (%(post)s, %(user)s, 'bench') RETURNING id
+        ''',
+        'get_comments': COMMENTS_COLUMNS + '''
+            WHERE c.post_id = %(post)s AND c.created_at >= (SELECT created_at FROM {s}.posts WHERE id = %(post)s)
+            ORDER BY c.created_at ASC
+        ''',
+        'insert_story_view': '''
+            INSERT INTO {s}.story_views (story_id, user_id, story_created_at)
+            SELECT id, %(user)s, created_at FROM {s}.stories WHERE id = %(story)s
+            ON CONFLICT DO NOTHING
+        ''',
+        'story_viewers': VIEWERS_COLUMNS + '''
+            WHERE sv.story_id = %(story)s
+              AND sv.story_created_at = (SELECT created_at FROM {s}.stories WHERE id = %(story)s)
+            ORDER BY sv.viewed_at DESC, sv.user_id DESC LIMIT 50
+        ''',
+    },
+}
+
+
+def id_range(cur, schema: str, table: str) -> tuple:
+    cur.execute(f'SELECT min(id), max(id) FROM {schema}.{table}')
+    low, high = cur.fetchone()
+    if low is None:
+        raise SystemExit(f'{schema}.{table} пуста: сначала scripts/datagen.py generate')
+    return low, high
+
+
+def run_layout(conn, layout: str, schema: str, iterations: int, seed: int) -> dict:
+    '''Прогоняет каждую операцию iterations раз на одинаковой последовательности id.'''
+    cur = conn.cursor()
+    ranges = {table: id_range(cur, schema, table) for table in ('users', 'posts', 'stories')}
+    conn.rollback()
+    results = {}
+    for op, template in QUERIES[layout].items():
+        statement = template.format(s=schema)
+        rng = random.Random(seed)
+        latencies = []
+        for _ in range(iterations + iterations // 10):
+            params = {'user': rng.randint(*ranges['users']), 'post': rng.randint(*ranges['posts']),
+                      'story': rng.randint(*ranges['stories'])}
+            started = time.perf_counter()
+            cur.execute(statement, params)
+            if cur.description:
+                cur.fetchall()
+            latencies.append((time.perf_counter() - started) * 1000)
+            conn.rollback()
+        latencies = sorted(latencies[iterations // 10:])
+        results[op] = {'p50_ms': percentile(latencies, 50), 'p95_ms': percentile(latencies, 95),
+                       'mean_ms': sum(latencies) / len(latencies)}
+    cur.close()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--before', required=True, metavar='SCHEMA', help='схема до V0011')
+    parser.add_argument('--after', required=True, metavar='SCHEMA', help='схема с секциями')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--save', help='сохранить результат в JSON')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    import psycopg2
+    conn = psycopg2.connect(args.dsn)
+    try:
+        results = {
+            'before': run_layout(conn, 'before', args.before, args.iterations, args.random_seed),
+            'after': run_layout(conn, 'after', args.after, args.iterations, args.random_seed),
+        }
+    finally:
+        conn.close()
+
+    print(f'{"operation":<18} {"before p50":>11} {"p95":>8} {"after p50":>11} {"p95":>8} {"p50 change":>11}')
+    for op, before in results['before'].items():
+        after = results['after'][op]
+        change = 100 * (after['p50_ms'] - before['p50_ms']) / before['p50_ms'] if before['p50_ms'] else 0.0
+        print(f'{op:<18} {before["p50_ms"]:>11.3f} {before["p95_ms"]:>8.3f} '
+              f'{after["p50_ms"]:>11.3f} {after["p95_ms"]:>8.3f} {change:>+10.1f}%')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'revision': git_revision(), 'iterations': args.iterations, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
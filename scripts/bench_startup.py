@@ -0,0 +1,104 @@
+'''Замер холодного старта функций backend/: время импорта index.py и прирост RSS.
+
+Каждый замер запускается в отдельном процессе интерпретатора, чтобы модули
+не оставались в кэше импорта между прогонами.
+
+    python scripts/bench_startup.py --runs 7
+    python scripts/bench_startup.py --save startup.json
+    python scripts/bench_startup.py --baseline startup.json --tolerance 20
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTIONS = ['auth', 'channels', 'posts', 'shop', 'stories']
+HEAVY_MODULES = ['boto3', 'botocore']
+
+PROBE = r'''
+import json, os, sys, time
+
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+function_dir = sys.argv[1]
+sys.path.insert(0, function_dir)
+os.chdir(function_dir)
+modules_before = len(sys.modules)
+rss_before = rss_kb()
+start = time.perf_counter()
+import index
+import_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({
+    'import_ms': import_ms,
+    'rss_kb': rss_kb() - rss_before,
+    'modules': len(sys.modules) - modules_before,
+    'heavy': sorted(name for name in HEAVY_MODULES if name in sys.modules)
+}))
+'''
+
+
+def measure(function: str, runs: int) -> dict:
+    env = dict(os.environ)
+    env.setdefault('MAIN_DB_SCHEMA', 'public')
+    samples = []
+    for _ in range(runs):
+        probe = f'HEAVY_MODULES = {HEAVY_MODULES!r}\n' + PROBE
+        output = subprocess.run(
+            [sys.executable, '-c', probe, str(BACKEND / function)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'import_ms': statistics.median(s['import_ms'] for s in samples),
+        'import_ms_max': max(s['import_ms'] for s in samples),
+        'rss_mb': statistics.median(s['rss_kb'] for s in samples) / 1024,
+        'modules': samples[-1]['modules'],
+        'heavy': samples[-1]['heavy']
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('functions', nargs='*', default=FUNCTIONS)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--save', help='сохранить результаты в JSON как базовую линию')
+    parser.add_argument('--baseline', help='сравнить с ранее сохранённой базовой линией')
+    parser.add_argument('--tolerance', type=float, default=20.0, help='допустимый рост, %%')
+    args = parser.parse_args()
+
+    results = {}
+    print(f'{"function":<10} {"import ms":>10} {"max ms":>8} {"rss MB":>8} {"modules":>8}  heavy')
+    for function in args.functions:
+        r = results[function] = measure(function, args.runs)
+        print(f'{function:<10} {r["import_ms"]:>10.1f} {r["import_ms_max"]:>8.1f} {r["rss_mb"]:>8.1f} '
+              f'{r["modules"]:>8}  {",".join(r["heavy"]) or "-"}')
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+
+    if not args.baseline:
+        return 0
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    regressions = []
+    for function, r in results.items():
+        base = baseline.get(function)
+        if not base:
+            continue
+        for metric in ('import_ms', 'rss_mb'):
+            limit = base[metric] * (1 + args.tolerance / 100)
+            if r[metric] > limit:
+                regressions.append(f'{function}.{metric}: {base[metric]:.1f} -> {r[metric]:.1f}')
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+'''Проверяет, что общие модули, скопированные в каждую функцию backend/, идентичны.
+
+Функции деплоятся по отдельности и не могут импортировать код соседей,
+поэтому общие модули лежат копиями в каждой папке функции.
+'''
+import hashlib
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+SHARED_MODULES = ['instrument.py', 'storage.py', 'mediatype.py', 'jobs.py', 'ratelimit.py', 'db.py', 'cache.py', 'request.py', 'metrics.py']
+
+
+def main() -> int:
+    failed = False
+    for name in SHARED_MODULES:
+        digests = {}
+        for path in sorted(BACKEND.glob(f'*/{name}')):
+            digests.setdefault(hashlib.sha256(path.read_bytes()).hexdigest(), []).append(path.parent.name)
+        if len(digests) > 1:
+            failed = True
+            print(f'{name} differs between functions:')
+            for digest, functions in digests.items():
+                print(f'  {digest[:12]}: {", ".join(functions)}')
+    if not failed:
+        print('shared modules are in sync')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,353 @@
+'''Генератор синтетических данных и развёртывание схемы для стендов производительности.
+
+bootstrap применяет db_migrations/ по порядку к выбранной схеме (имя схемы
+из миграций подменяется на --schema), generate заливает пользователей, каналы,
+посты, лайки, комментарии, истории, просмотры и подписки через COPY.
+Популярность авторов, постов, каналов и историй распределена по Ципфу:
+немного «звёзд» собирают большую часть лайков и подписок.
+
+    python scripts/datagen.py bootstrap --reset
+    python scripts/datagen.py generate --users 100000 --posts 2000000 --likes 10000000
+'''
+import argparse
+import bisect
+import hashlib
+import io
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+MIGRATIONS = Path(__file__).resolve().parent.parent / 'db_migrations'
+PRODUCTION_SCHEMA = 't_p61541260_yna_social_network_g'
+BENCH_PASSWORD = 'bench-password'
+COPY_CHUNK_ROWS = 200_000
+
+
+def migration_files() -> list:
+    return sorted(MIGRATIONS.glob('V*__*.sql'), key=migration_version)
+
+
+def migration_version(path: Path) -> int:
+    return int(re.match(r'V(\d+)__', path.name).group(1))
+
+
+def bootstrap(conn, schema: str, reset: bool, target: int = None) -> None:
+    '''Создаёт схему и применяет ещё не применённые миграции (до target включительно, если задан).'''
+    cur = conn.cursor()
+    if reset:
+        cur.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cur.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+    cur.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.bootstrap_migrations (
+            version VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute(f'SELECT version FROM {schema}.bootstrap_migrations')
+    applied = {row[0] for row in cur.fetchall()}
+    conn.commit()
+
+    for path in migration_files():
+        if path.name in applied or (target is not None and migration_version(path) > target):
+            continue
+        sql = path.read_text(encoding='utf-8').replace(PRODUCTION_SCHEMA, schema)
+        started = time.perf_counter()
+        cur.execute(f'SET search_path TO {schema}')
+        cur.execute(sql)
+        cur.execute(f'INSERT INTO {schema}.bootstrap_migrations (version) VALUES (%s)', (path.name,))
+        conn.commit()
+        print(f'  applied {path.name} ({time.perf_counter() - started:.2f}s)')
+    cur.execute('RESET search_path')
+    conn.commit()
+
+
+class Zipf:
+    '''Выбор индекса 0..n-1 с вероятностью ~ 1 / (rank ** s).
+
+    Ранги случайно перемешаны, чтобы популярные объекты не совпадали с
+    первыми id.
+    '''
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.n = n
+        weights = [1.0 / (rank ** s) for rank in range(1, n + 1)]
+        total = 0.0
+        self.cdf = []
+        for w in weights:
+            total += w
+            self.cdf.append(total)
+        self.total = total
+        self.order = list(range(n))
+        rng.shuffle(self.order)
+        self.rng = rng
+
+    def sample(self) -> int:
+        return self.order[bisect.bisect_left(self.cdf, self.rng.random() * self.total)]
+
+    def shares(self, total: int, cap: int) -> list:
+        '''Делит total между объектами пропорционально популярности, не более cap на объект.'''
+        counts = [0] * self.n
+        previous = 0.0
+        for rank, cumulative in enumerate(self.cdf):
+            exact = total * (cumulative - previous) / self.total
+            previous = cumulative
+            count = int(exact) + (1 if self.rng.random() < exact - int(exact) else 0)
+            counts[self.order[rank]] = min(count, cap)
+        return counts
+
+
+def copy_rows(cur, table: str, columns: list, rows) -> int:
+    '''Заливает строки через COPY порциями, не держа весь объём в памяти.'''
+    statement = f'COPY {table} ({", ".join(columns)}) FROM STDIN'
+    written = 0
+    buffer = io.StringIO()
+    pending = 0
+    for row in rows:
+        buffer.write('\t'.join('\\N' if v is None else str(v) for v in row))
+        buffer.write('\n')
+        pending += 1
+        if pending >= COPY_CHUNK_ROWS:
+            buffer.seek(0)
+            cur.copy_expert(statement, buffer)
+            written += pending
+            buffer = io.StringIO()
+            pending = 0
+    if pending:
+        buffer.seek(0)
+        cur.copy_expert(statement, buffer)
+        written += pending
+    return written
+
+
+def next_id(cur, schema: str, table: str) -> int:
+    cur.execute(f'SELECT COALESCE(max(id), 0) + 1 FROM {schema}.{table}')
+    return cur.fetchone()[0]
+
+
+PARTITION_KEYS = {
+    'likes': 'post_created_at',
+    'comments': 'created_at',
+    'story_views': 'story_created_at',
+    'messages': 'created_at',
+}
+
+
+def is_partitioned(cur, schema: str) -> bool:
+    '''После V0011 likes секционированы и требуют post_created_at; до неё — обычная таблица.'''
+    cur.execute('''
+        SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_schema = %s AND table_name = 'likes' AND column_name = 'post_created_at')
+    ''', (schema,))
+    return cur.fetchone()[0]
+
+
+def generate(conn, schema: str, args) -> None:
+    import psycopg2
+    rng = random.Random(args.random_seed)
+    cur = conn.cursor()
+    cur.execute('SET synchronous_commit = off')
+    try:
+        # Без триггеров user_stats: счётчики пересчитываются разом в конце
+        cur.execute('SET session_replication_role = replica')
+    except psycopg2.Error as e:
+        conn.rollback()
+        cur.execute('SET synchronous_commit = off')
+        print(f'triggers stay enabled ({e.pgerror.strip() if e.pgerror else e}), loading will be slower')
+    now = datetime.now().replace(microsecond=0)
+    span = timedelta(days=args.days).total_seconds()
+    started = time.perf_counter()
+
+    def step(label, table, columns, rows):
+        t = time.perf_counter()
+        count = copy_rows(cur, f'{schema}.{table}', columns, rows)
+        conn.commit()
+        elapsed = time.perf_counter() - t
+        print(f'  {label:<16} {count:>11,} rows {elapsed:8.1f}s {count / max(elapsed, 1e-9):>12,.0f} rows/s')
+
+    user_base = next_id(cur, schema, 'users')
+    channel_base = next_id(cur, schema, 'channels')
+    post_base = next_id(cur, schema, 'posts')
+    story_base = next_id(cur, schema, 'stories')
+    comment_base = next_id(cur, schema, 'comments')
+
+    print('planning distributions...')
+    author_pop = Zipf(args.users, args.skew, rng)
+    channel_pop = Zipf(args.channels, args.skew, rng) if args.channels else None
+    post_pop = Zipf(args.posts, args.skew, rng)
+    story_pop = Zipf(args.stories, args.skew, rng) if args.stories else None
+
+    likes_per_post = post_pop.shares(args.likes, args.users)
+    comments_per_post = Counter(post_pop.sample() for _ in range(args.comments))
+    subscribers_per_channel = channel_pop.shares(args.subscriptions, args.users) if channel_pop else []
+    views_per_story = story_pop.shares(args.story_views, args.users) if story_pop else []
+    post_created = [now - timedelta(seconds=rng.random() * span) for _ in range(args.posts)]
+
+    password_hash = hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest()
+
+    partitioned = is_partitioned(cur, schema)
+    if partitioned:
+        # Секции под весь диапазон дат, иначе строки осядут в default
+        for table, key in PARTITION_KEYS.items():
+            cur.execute(f'SELECT {schema}.ensure_monthly_partitions(%s, %s, %s, %s, %s)',
+                        (schema, table, key, (now - timedelta(seconds=span)).date(), (now + timedelta(days=90)).date()))
+        conn.commit()
+
+    def users():
+        for i in range(args.users):
+            n = user_base + i
+            premium = rng.random() < 0.05
+            verified = premium or rng.random() < 0.03
+            boost = now + timedelta(hours=rng.random() * 24) if rng.random() < 0.01 else None
+            yield (n, f'bench{n}', f'bench{n}@bench.local', password_hash, f'Bench User {n}',
+                   rng.randint(0, 5000), premium, verified,
+                   'blue' if premium else 'red', boost,
+                   now - timedelta(seconds=span + rng.random() * span))
+
+    step('users', 'users',
+         ['id', 'username', 'email', 'password_hash', 'display_name', 'yn_balance', 'is_premium',
+          'is_verified', 'verification_color', 'boost_active_until', 'created_at'],
+         users())
+
+    def channels():
+        for i in range(args.channels):
+            subscribers = subscribers_per_channel[i]
+            yield (channel_base + i, f'bench channel {channel_base + i}', 'Канал для нагрузочного теста',
+                   user_base + author_pop.sample(), subscribers, subscribers, rng.random() < 0.05,
+                   now - timedelta(seconds=rng.random() * span))
+
+    step('channels', 'channels',
+         ['id', 'name', 'description', 'owner_id', 'members_count', 'subscribers_count', 'is_private', 'created_at'],
+         channels())
+
+    def posts():
+        for i in range(args.posts):
+            channel_id = channel_base + channel_pop.sample() if channel_pop and rng.random() < args.channel_share else None
+            has_media = rng.random() < 0.3
+            yield (post_base + i, user_base + author_pop.sample(), f'Пост номер {post_base + i}',
+                   f'https://cdn.bench.local/posts/{post_base + i}.jpg' if has_media else None,
+                   'image/jpeg' if has_media else None,
+                   channel_id, likes_per_post[i], comments_per_post.get(i, 0),
+                   rng.random() < 0.01, post_created[i])
+
+    step('posts', 'posts',
+         ['id', 'user_id', 'content', 'media_url', 'media_type', 'channel_id', 'likes_count',
+          'comments_count', 'is_boosted', 'created_at'],
+         posts())
+
+    def likes():
+        for i, count in enumerate(likes_per_post):
+            if not count:
+                continue
+            created = post_created[i]
+            for user in rng.sample(range(args.users), count):
+                row = (user_base + user, post_base + i, False,
+                       created + timedelta(seconds=rng.random() * (now - created).total_seconds()))
+                yield row + (created,) if partitioned else row
+
+    step('likes', 'likes', ['user_id', 'post_id', 'is_super_like', 'created_at'] + (['post_created_at'] if partitioned else []),
+         likes())
+
+    def comments():
+        comment_id = comment_base
+        for i, count in comments_per_post.items():
+            created = post_created[i]
+            for _ in range(count):
+                yield (comment_id, user_base + rng.randrange(args.users), post_base + i, 'Комментарий',
+                       created + timedelta(seconds=rng.random() * (now - created).total_seconds()))
+                comment_id += 1
+
+    step('comments', 'comments', ['id', 'user_id', 'post_id', 'content', 'created_at'], comments())
+
+    story_created = [now - timedelta(seconds=rng.random() * 86400) for _ in range(args.stories)]
+
+    def stories():
+        for i in range(args.stories):
+            created = story_created[i]
+            yield (story_base + i, user_base + author_pop.sample(),
+                   f'https://cdn.bench.local/stories/{story_base + i}.jpg', 'image/jpeg',
+                   views_per_story[i], created + timedelta(hours=24), created)
+
+    step('stories', 'stories',
+         ['id', 'user_id', 'media_url', 'media_type', 'views_count', 'expires_at', 'created_at'], stories())
+
+    def story_views():
+        for i, count in enumerate(views_per_story):
+            created = story_created[i]
+            for user in rng.sample(range(args.users), count):
+                row = (story_base + i, user_base + user,
+                       created + timedelta(seconds=rng.random() * (now - created).total_seconds()))
+                yield row + (created,) if partitioned else row
+
+    step('story_views', 'story_views',
+         ['story_id', 'user_id', 'viewed_at'] + (['story_created_at'] if partitioned else []), story_views())
+
+    def subscriptions():
+        for i, count in enumerate(subscribers_per_channel):
+            for user in rng.sample(range(args.users), count):
+                yield (user_base + user, channel_base + i, now - timedelta(seconds=rng.random() * span))
+
+    step('subscriptions', 'channel_subscriptions', ['user_id', 'channel_id', 'subscribed_at'], subscriptions())
+
+    for table in ('users', 'channels', 'posts', 'comments', 'stories'):
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{schema}.{table}', 'id'), "
+                    f"(SELECT COALESCE(max(id), 1) FROM {schema}.{table}))")
+    cur.execute("SELECT to_regprocedure(%s) IS NOT NULL", (f'{schema}.rebuild_user_stats()',))
+    if cur.fetchone()[0]:
+        t = time.perf_counter()
+        cur.execute(f'SELECT {schema}.rebuild_user_stats()')
+        conn.commit()
+        print(f'  {"user_stats":<16} {"rebuilt":>16} {time.perf_counter() - t:8.1f}s')
+    cur.execute('ANALYZE')
+    conn.commit()
+    print(f'  {"total":<16} {time.perf_counter() - started:>29.1f}s')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--schema', default=os.environ.get('MAIN_DB_SCHEMA', 'public'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    boot = commands.add_parser('bootstrap', help='создать схему и применить миграции')
+    boot.add_argument('--reset', action='store_true', help='удалить схему перед созданием')
+    boot.add_argument('--target', type=int, metavar='N', help='применить миграции только до VN включительно')
+
+    gen = commands.add_parser('generate', help='залить синтетические данные')
+    gen.add_argument('--users', type=int, default=20_000)
+    gen.add_argument('--channels', type=int, default=2_000)
+    gen.add_argument('--posts', type=int, default=1_000_000)
+    gen.add_argument('--likes', type=int, default=3_000_000)
+    gen.add_argument('--comments', type=int, default=500_000)
+    gen.add_argument('--stories', type=int, default=20_000)
+    gen.add_argument('--story-views', type=int, default=500_000)
+    gen.add_argument('--subscriptions', type=int, default=100_000)
+    gen.add_argument('--channel-share', type=float, default=0.3, help='доля постов в каналах')
+    gen.add_argument('--skew', type=float, default=1.1, help='показатель распределения Ципфа')
+    gen.add_argument('--days', type=int, default=30, help='за сколько дней размазать посты')
+    gen.add_argument('--random-seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    import psycopg2
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.command == 'bootstrap':
+            print(f'bootstrapping schema {args.schema}:')
+            bootstrap(conn, args.schema, args.reset, args.target)
+        else:
+            print(f'generating into {args.schema}:')
+            generate(conn, args.schema, args)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+'''Локальный сервер: все функции backend/ в одном процессе за одним портом.
+
+Путь /<функция>[/...] вызывает handler(event, context) этой функции; запрос
+переводится в event того же вида, что приходит в облаке. Запросы
+обслуживает пул потоков, соединения с Postgres берутся из пула
+(DATABASE_POOL_SIZE на функцию), клиент S3 создаётся один раз на функцию.
+С --processes N несколько процессов слушают один порт (SO_REUSEPORT).
+GET /metrics отдаёт метрики всех функций процесса в формате Prometheus.
+
+    python scripts/devserver.py --port 8000 --workers 32 --local-s3 /tmp/yna-s3
+    VITE_API_BASE=http://localhost:8000 npm run dev
+'''
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlsplit
+
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class Router:
+    '''Сопоставляет первый сегмент пути с функцией и вызывает её handler.'''
+
+    def __init__(self, functions: dict):
+        self.functions = functions
+
+    def event(self, request, body: bytes) -> dict:
+        url = urlsplit(request.path)
+        try:
+            text, is_base64 = body.decode('utf-8'), False
+        except UnicodeDecodeError:
+            text, is_base64 = base64.b64encode(body).decode('ascii'), True
+        return {
+            'httpMethod': request.command,
+            'path': url.path,
+            'headers': dict(request.headers.items()),
+            'queryStringParameters': dict(parse_qsl(url.query)),
+            'body': text,
+            'isBase64Encoded': is_base64,
+            'requestContext': {
+                'requestId': uuid.uuid4().hex,
+                'identity': {'sourceIp': request.client_address[0]}
+            }
+        }
+
+    def metrics(self) -> dict:
+        '''Выгрузка для Prometheus: семейства всех функций, склеенные по имени.'''
+        sources = [modules['metrics'] for modules in self.functions.values()]
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+            'body': sources[0].render(sources)
+        }
+
+    def dispatch(self, request, body: bytes) -> dict:
+        name = urlsplit(request.path).path.strip('/').split('/', 1)[0]
+        if name == 'metrics' and request.command == 'GET':
+            return self.metrics()
+        if name not in self.functions:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': f'unknown function {name!r}', 'functions': sorted(self.functions)})
+            }
+        event = self.event(request, body)
+        context = SimpleNamespace(function_name=name, request_id=event['requestContext']['requestId'])
+        try:
+            return self.functions[name]['index'].handler(event, context)
+        except Exception as e:
+            # Как в облаке: необработанное исключение функции — 502
+            print(f'{name}: unhandled {e!r}', file=sys.stderr)
+            return {
+                'statusCode': 502,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': repr(e)})
+            }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    router = None
+
+    def handle_any(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self.send_error(413)
+            return
+        response = self.router.dispatch(self, self.rfile.read(length) if length else b'')
+        body = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            payload = base64.b64decode(body)
+        else:
+            payload = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(response.get('statusCode', 200))
+        for name, value in (response.get('headers') or {}).items():
+            self.send_header(name, str(value))
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_OPTIONS = do_HEAD = handle_any
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+    '''HTTP-сервер, отдающий соединения ограниченному пулу потоков.'''
+
+    daemon_threads = True
+
+    def __init__(self, address, handler_class, workers: int, reuse_port: bool, quiet: bool):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='devserver')
+        self.reuse_port = reuse_port
+        self.quiet = quiet
+        super().__init__(address, handler_class)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def serve(config: dict) -> None:
+    '''Один процесс сервера: загружает функции и обслуживает порт до Ctrl+C.'''
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from backend_loader import load_all
+    from local_s3 import LocalS3
+
+    functions = load_all(config['functions'])
+    s3 = LocalS3(config['local_s3'] or None) if config['local_s3'] is not None else None
+    for modules in functions.values():
+        if s3 is not None and 'storage' in modules:
+            modules['storage']._s3_client = s3
+        if config['quiet']:
+            modules['instrument'].emit = lambda record: None
+        # Метрики забирают через /metrics, запись выгрузки в лог не нужна
+        modules['metrics'].PUSH_SECONDS = 0
+
+    RequestHandler.router = Router(functions)
+    server = PooledHTTPServer((config['host'], config['port']), RequestHandler,
+                              config['workers'], config['processes'] > 1, config['quiet'])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--replica-dsn', default=os.environ.get('DATABASE_REPLICA_URL'))
+    parser.add_argument('--schema', default=os.environ.get('MAIN_DB_SCHEMA', 'public'))
+    parser.add_argument('--function', action='append', dest='functions', metavar='NAME',
+                        help='поднять только эти функции (по умолчанию все)')
+    parser.add_argument('--workers', type=int, default=16, help='потоков на процесс')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--pool-size', type=int, default=None,
+                        help='соединений с БД на функцию в процессе (по умолчанию --workers)')
+    parser.add_argument('--local-s3', nargs='?', const='', default=None, metavar='DIR',
+                        help='локальная замена S3: в папке DIR или в памяти без аргумента')
+    parser.add_argument('--rate-limit-store', choices=['off', 'memory', 'postgres'], default='memory')
+    parser.add_argument('--quiet', action='store_true', help='не печатать логи запросов')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+    if args.replica_dsn:
+        os.environ['DATABASE_REPLICA_URL'] = args.replica_dsn
+    os.environ['DATABASE_POOL_SIZE'] = str(args.pool_size if args.pool_size is not None else args.workers)
+    os.environ['RATE_LIMIT_STORE'] = args.rate_limit_store
+    if args.local_s3 is not None:
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+
+    config = {
+        'host': args.host,
+        'port': args.port,
+        'functions': args.functions,
+        'workers': args.workers,
+        'processes': args.processes,
+        'local_s3': args.local_s3,
+        'quiet': args.quiet
+    }
+    print(f'serving backend on http://{args.host}:{args.port}/<function> '
+          f'({args.processes} x {args.workers} workers)')
+
+    if args.processes == 1:
+        serve(config)
+        return 0
+    processes = [multiprocessing.Process(target=serve, args=(config,)) for _ in range(args.processes)]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
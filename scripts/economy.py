@@ -0,0 +1,73 @@
+'''Отчёт по экономике юнакоинов из сводок economy_hourly и economy_daily.
+
+    python scripts/economy.py --days 30
+    python scripts/economy.py --hours 48 --kind sale
+    python scripts/economy.py --days 7 --fold
+
+Отчёт не трогает purchases и таблицы активности: он читает только сводки,
+которые задача economy.fold (backend/worker/economy.py) пополняет раз в
+минуту. --fold сначала сворачивает накопившиеся события, чтобы отчёт
+включал последние минуты.
+'''
+import argparse
+import os
+import sys
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS.parent / 'backend' / 'worker'))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--schema', default=os.environ.get('MAIN_DB_SCHEMA', 'public'))
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument('--hours', type=int, help='почасовой отчёт за последние N часов')
+    window.add_argument('--days', type=int, help='посуточный отчёт за последние N дней (по умолчанию 30)')
+    parser.add_argument('--kind', choices=('issue', 'sale'), help='только начисления или только продажи')
+    parser.add_argument('--fold', action='store_true', help='сначала свернуть накопившиеся события')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+
+    import psycopg2
+    import economy
+
+    if args.hours:
+        table, bucket, since = 'economy_hourly', 'hour', f"NOW() - INTERVAL '{args.hours} hours'"
+    else:
+        table, bucket, since = 'economy_daily', 'day', f"CURRENT_DATE - {args.days or 30}"
+
+    conn = psycopg2.connect(args.dsn)
+    cur = conn.cursor()
+    try:
+        if args.fold:
+            economy.fold(conn, {})
+        cur.execute(
+            f'''
+            SELECT {bucket}, kind, item, events, coins FROM {args.schema}.{table}
+            WHERE {bucket} >= {since} AND (%s IS NULL OR kind = %s)
+            ORDER BY {bucket}, kind, item
+            ''',
+            (args.kind, args.kind),
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+    totals = {}
+    print(f'{bucket:<20} {"kind":<6} {"item":<20} {"events":>10} {"coins":>12}')
+    for when, kind, item, events, coins in rows:
+        print(f'{str(when):<20} {kind:<6} {item:<20} {events:>10,} {coins:>12,}')
+        totals[kind] = totals.get(kind, 0) + coins
+    issued, sold = totals.get('issue', 0), totals.get('sale', 0)
+    print(f'\nissued {issued:,}, spent {sold:,}, net {issued - sold:+,}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+'''Нагрузочный стенд: вызывает handler(event, context) функций backend/ в процессе.
+
+Работает против локального Postgres (DATABASE_URL) и локальной замены S3
+(scripts/local_s3.py); данные готовит scripts/datagen.py. Смешанная нагрузка
+чтения и записи гоняется в нескольких потоках и процессах; по каждому действию
+печатаются p50/p95/p99, пропускная способность и средние фазы из instrument.
+
+    python scripts/datagen.py bootstrap --reset
+    python scripts/datagen.py generate --users 20000 --posts 1000000 --likes 5000000
+    python scripts/loadtest.py --duration 60 --concurrency 32 --processes 4 --save run.json
+    python scripts/loadtest.py --duration 60 --compare run.json
+'''
+import argparse
+import base64
+import json
+import math
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from datagen import BENCH_PASSWORD
+
+DEFAULT_WEIGHTS = {
+    'feed': 30,
+    'get_comments': 10,
+    'stories': 10,
+    'channels': 5,
+    'channel_posts': 5,
+    'like': 15,
+    'story_view': 8,
+    'comment': 5,
+    'subscribe': 3,
+    'create_post': 3,
+    'create_story': 1,
+    'login': 3,
+    'purchase': 2
+}
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def load_id_ranges(conn, schema: str) -> dict:
+    cur = conn.cursor()
+    ranges = {}
+    for table in ('users', 'posts', 'channels', 'stories'):
+        cur.execute(f'SELECT min(id), max(id) FROM {schema}.{table}')
+        ranges[table] = cur.fetchone()
+    cur.execute(f"SELECT min(id), max(id) FROM {schema}.users WHERE username LIKE 'bench%'")
+    ranges['bench_users'] = cur.fetchone()
+    cur.close()
+    return ranges
+
+
+class Workload:
+    '''Строит случайные события для действий смешанной нагрузки.'''
+
+    def __init__(self, ranges: dict, media_bytes: int):
+        self.ranges = ranges
+        self.media_b64 = base64.b64encode(os.urandom(media_bytes)).decode()
+
+    def media(self) -> str:
+        '''Уникальный JPEG в base64: сигнатура проходит проверку формата, а случайная
+        голова длиной кратной 3 байтам меняет хэш, и загрузка не пропускается как повтор.'''
+        return base64.b64encode(b'\xff\xd8\xff' + os.urandom(15)).decode() + self.media_b64
+
+    def _id(self, table: str) -> int:
+        low, high = self.ranges[table]
+        if low is None:
+            return 1
+        return random.randint(low, high)
+
+    @staticmethod
+    def _post(body: dict) -> dict:
+        return {'httpMethod': 'POST', 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body)}
+
+    def build(self, action: str):
+        if action == 'feed':
+            return 'posts', {'httpMethod': 'GET', 'queryStringParameters': {}}
+        if action == 'get_comments':
+            return 'posts', self._post({'action': 'get_comments', 'post_id': self._id('posts')})
+        if action == 'like':
+            return 'posts', self._post({'action': 'like', 'user_id': self._id('users'), 'post_id': self._id('posts')})
+        if action == 'comment':
+            return 'posts', self._post({'action': 'comment', 'user_id': self._id('users'),
+                                        'post_id': self._id('posts'), 'content': 'Нагрузочный комментарий'})
+        if action == 'create_post':
+            body = {'action': 'create', 'user_id': self._id('users'), 'content': 'Нагрузочный пост'}
+            if random.random() < 0.2:
+                body.update(media_data=self.media(), media_type='image/jpeg')
+            return 'posts', self._post(body)
+        if action == 'stories':
+            return 'stories', {'httpMethod': 'GET', 'queryStringParameters': {}}
+        if action == 'story_view':
+            return 'stories', self._post({'action': 'view', 'user_id': self._id('users'), 'story_id': self._id('stories')})
+        if action == 'create_story':
+            return 'stories', self._post({'action': 'create', 'user_id': self._id('users'),
+                                          'media_data': self.media(), 'media_type': 'image/jpeg'})
+        if action == 'channels':
+            return 'channels', {'httpMethod': 'GET', 'queryStringParameters': {}}
+        if action == 'channel_posts':
+            return 'channels', self._post({'action': 'get_posts', 'channel_id': self._id('channels')})
+        if action == 'subscribe':
+            return 'channels', self._post({'action': 'subscribe', 'user_id': self._id('users'),
+                                           'channel_id': self._id('channels')})
+        if action == 'login':
+            low, high = self.ranges['bench_users']
+            n = random.randint(low, high) if low else 1
+            return 'auth', self._post({'action': 'login', 'username': f'bench{n}', 'password': BENCH_PASSWORD})
+        if action == 'purchase':
+            return 'shop', self._post({'user_id': self._id('users'), 'item_type': 'super_likes',
+                                       'item_name': 'Супер-лайки', 'price': 1})
+        raise ValueError(f'unknown action {action}')
+
+
+def run_process(config: dict) -> dict:
+    '''Один процесс стенда: загружает функции и гоняет нагрузку в потоках.'''
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from backend_loader import load_all
+    from local_s3 import LocalS3
+
+    functions = load_all()
+    s3 = LocalS3(latency_ms=config['s3_latency_ms'])
+    last_record = threading.local()
+    for modules in functions.values():
+        if 'storage' in modules:
+            modules['storage']._s3_client = s3
+        modules['instrument'].emit = lambda record: setattr(last_record, 'value', record)
+
+    workload = Workload(config['ranges'], config['media_bytes'])
+    actions = list(config['weights'])
+    weights = [config['weights'][a] for a in actions]
+    deadline = time.monotonic() + config['duration']
+    results = {}
+    results_lock = threading.Lock()
+
+    def worker(seed_value):
+        rng = random.Random(seed_value)
+        local = {}
+        while time.monotonic() < deadline:
+            action = rng.choices(actions, weights)[0]
+            function, event = workload.build(action)
+            handler = functions[function]['index'].handler
+            last_record.value = None
+            start = time.perf_counter()
+            response = handler(event, SimpleNamespace(function_name=function, request_id=None))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            stats = local.setdefault(action, {'latencies': [], 'errors': 0, 'phases': {}, 'round_trips': 0})
+            stats['latencies'].append(elapsed_ms)
+            if response.get('statusCode', 500) >= 500:
+                stats['errors'] += 1
+            record = last_record.value
+            if record:
+                stats['round_trips'] += record.get('round_trips', 0)
+                for name, ms in record.get('phases', {}).items():
+                    stats['phases'][name] = stats['phases'].get(name, 0.0) + ms
+        with results_lock:
+            for action, stats in local.items():
+                merged = results.setdefault(action, {'latencies': [], 'errors': 0, 'phases': {}, 'round_trips': 0})
+                merged['latencies'].extend(stats['latencies'])
+                merged['errors'] += stats['errors']
+                merged['round_trips'] += stats['round_trips']
+                for name, ms in stats['phases'].items():
+                    merged['phases'][name] = merged['phases'].get(name, 0.0) + ms
+
+    threads = [threading.Thread(target=worker, args=(config['seed'] * 1000 + i,)) for i in range(config['concurrency'])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def summarize(results: dict, duration: float) -> dict:
+    summary = {}
+    for action, stats in sorted(results.items()):
+        latencies = sorted(stats['latencies'])
+        count = len(latencies)
+        summary[action] = {
+            'count': count,
+            'errors': stats['errors'],
+            'rps': count / duration,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1] if latencies else 0.0,
+            'round_trips': stats['round_trips'] / count if count else 0.0,
+            'phases_ms': {name: ms / count for name, ms in sorted(stats['phases'].items())} if count else {}
+        }
+    all_latencies = sorted(x for stats in results.values() for x in stats['latencies'])
+    summary['TOTAL'] = {
+        'count': len(all_latencies),
+        'errors': sum(stats['errors'] for stats in results.values()),
+        'rps': len(all_latencies) / duration,
+        'p50_ms': percentile(all_latencies, 50),
+        'p95_ms': percentile(all_latencies, 95),
+        'p99_ms': percentile(all_latencies, 99),
+        'max_ms': all_latencies[-1] if all_latencies else 0.0,
+        'round_trips': sum(stats['round_trips'] for stats in results.values()) / max(len(all_latencies), 1),
+        'phases_ms': {}
+    }
+    return summary
+
+
+def print_summary(summary: dict, baseline: dict = None) -> None:
+    print(f'{"action":<14} {"count":>8} {"err":>5} {"rps":>9} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>9} {"rt":>5}  phases (avg ms)')
+    for action, s in summary.items():
+        line = (f'{action:<14} {s["count"]:>8} {s["errors"]:>5} {s["rps"]:>9.1f} {s["p50_ms"]:>8.2f} '
+                f'{s["p95_ms"]:>8.2f} {s["p99_ms"]:>8.2f} {s["max_ms"]:>9.2f} {s.get("round_trips", 0):>5.1f}  '
+                + ' '.join(f'{k}={v:.2f}' for k, v in s['phases_ms'].items()))
+        print(line)
+        base = (baseline or {}).get(action)
+        if base:
+            deltas = []
+            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if base[key]:
+                    deltas.append(f'{key} {100 * (s[key] - base[key]) / base[key]:+.1f}%')
+            print(f'{"":<14} vs baseline: ' + ', '.join(deltas))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--replica-dsn', default=os.environ.get('DATABASE_REPLICA_URL'),
+                        help='реплика для чтений; по умолчанию всё идёт в --dsn')
+    parser.add_argument('--schema', default=os.environ.get('MAIN_DB_SCHEMA', 'public'))
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--concurrency', type=int, default=16, help='потоков на процесс')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--weight', action='append', default=[], metavar='ACTION=N',
+                        help='вес действия в смеси, 0 — исключить')
+    parser.add_argument('--only', action='append', default=[], metavar='ACTION',
+                        help='гонять только эти действия с их весами по умолчанию')
+    parser.add_argument('--media-bytes', type=int, default=200_000)
+    parser.add_argument('--s3-latency-ms', type=float, default=20.0)
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--rate-limit-store', choices=['off', 'memory', 'postgres'], default='off',
+                        help='хранилище лимитов частоты; off — нагрузка не упирается в лимиты')
+    parser.add_argument('--pool-size', type=int, default=0,
+                        help='пул соединений на функцию в процессе; 0 — соединение на вызов, как в облаке')
+    parser.add_argument('--sequential-uploads', action='store_true',
+                        help='грузить файл поста до запросов к БД (MEDIA_UPLOAD_OVERLAP=0)')
+    parser.add_argument('--save', help='сохранить сводку в JSON')
+    parser.add_argument('--compare', help='сравнить с сохранённой сводкой')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+    if args.replica_dsn:
+        os.environ['DATABASE_REPLICA_URL'] = args.replica_dsn
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+    os.environ['RATE_LIMIT_STORE'] = args.rate_limit_store
+    os.environ['DATABASE_POOL_SIZE'] = str(args.pool_size)
+    os.environ['MEDIA_UPLOAD_OVERLAP'] = '0' if args.sequential_uploads else '1'
+
+    import psycopg2
+    conn = psycopg2.connect(args.dsn)
+    ranges = load_id_ranges(conn, args.schema)
+    conn.close()
+
+    for action in args.only:
+        if action not in DEFAULT_WEIGHTS:
+            parser.error(f'неизвестное действие {action}')
+    weights = {a: w for a, w in DEFAULT_WEIGHTS.items() if not args.only or a in args.only}
+    for item in args.weight:
+        action, value = item.split('=')
+        if action not in DEFAULT_WEIGHTS:
+            parser.error(f'неизвестное действие {action}')
+        weights[action] = float(value)
+    weights = {a: w for a, w in weights.items() if w > 0}
+
+    configs = [{
+        'ranges': ranges,
+        'weights': weights,
+        'duration': args.duration,
+        'concurrency': args.concurrency,
+        'media_bytes': args.media_bytes,
+        's3_latency_ms': args.s3_latency_ms,
+        'seed': args.random_seed * 100 + i
+    } for i in range(args.processes)]
+
+    started = time.perf_counter()
+    if args.processes == 1:
+        parts = [run_process(configs[0])]
+    else:
+        with multiprocessing.Pool(args.processes) as pool:
+            parts = pool.map(run_process, configs)
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for part in parts:
+        for action, stats in part.items():
+            merged = results.setdefault(action, {'latencies': [], 'errors': 0, 'phases': {}, 'round_trips': 0})
+            merged['latencies'].extend(stats['latencies'])
+            merged['errors'] += stats['errors']
+            merged['round_trips'] += stats['round_trips']
+            for name, ms in stats['phases'].items():
+                merged['phases'][name] = merged['phases'].get(name, 0.0) + ms
+
+    summary = summarize(results, elapsed)
+    baseline = json.loads(Path(args.compare).read_text())['actions'] if args.compare else None
+    print_summary(summary, baseline)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({
+            'meta': {
+                'revision': git_revision(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'duration_s': elapsed,
+                'processes': args.processes,
+                'concurrency': args.concurrency,
+                'weights': weights
+            },
+            'actions': summary
+        }, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
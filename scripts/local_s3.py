@@ -0,0 +1,80 @@
+'''Локальная замена S3 для стендов: хранит объекты в памяти или в папке.
+
+Реализует только те вызовы boto3-клиента, которые использует backend.
+Подключается подменой клиента в модуле storage функции:
+
+    modules['storage']._s3_client = LocalS3()
+'''
+import threading
+import time
+from pathlib import Path
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class LocalS3:
+    def __init__(self, root: str = None, latency_ms: float = 0.0, bytes_per_ms: float = 0.0):
+        '''root — папка для объектов (по умолчанию память); latency_ms и
+        bytes_per_ms имитируют задержку и пропускную способность хранилища.'''
+        self.root = Path(root) if root else None
+        self.latency_ms = latency_ms
+        self.bytes_per_ms = bytes_per_ms
+        self.objects = {}
+        self.put_count = 0
+        self.put_bytes = 0
+        self._lock = threading.Lock()
+
+    def _delay(self, size: int) -> None:
+        delay_ms = self.latency_ms + (size / self.bytes_per_ms if self.bytes_per_ms else 0)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self.root / bucket / key
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, ContentType: str = None, **kwargs) -> dict:
+        data = Body if isinstance(Body, bytes) else Body.read()
+        self._delay(len(data))
+        with self._lock:
+            self.put_count += 1
+            self.put_bytes += len(data)
+            if self.root:
+                path = self._path(Bucket, Key)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(data)
+                self.objects[(Bucket, Key)] = {'size': len(data), 'content_type': ContentType}
+            else:
+                self.objects[(Bucket, Key)] = {'size': len(data), 'content_type': ContentType, 'body': data}
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        meta = self.objects.get((Bucket, Key))
+        if meta is None:
+            raise NoSuchKey(Key)
+        data = meta['body'] if 'body' in meta else self._path(Bucket, Key).read_bytes()
+        self._delay(len(data))
+        return {'Body': _Body(data), 'ContentLength': len(data), 'ContentType': meta['content_type']}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._delay(0)
+        meta = self.objects.get((Bucket, Key))
+        if meta is None:
+            raise NoSuchKey(Key)
+        return {'ContentLength': meta['size'], 'ContentType': meta['content_type']}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._delay(0)
+        with self._lock:
+            if self.objects.pop((Bucket, Key), None) is not None and self.root:
+                self._path(Bucket, Key).unlink(missing_ok=True)
+        return {}
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def read(self) -> bytes:
+        return self._data
@@ -0,0 +1,92 @@
+'''Обслуживание секционированных таблиц likes, comments, story_views и messages.
+
+    python scripts/partitions.py status
+    python scripts/partitions.py ensure --months-ahead 6
+    python scripts/partitions.py ensure --table likes --from 2024-01
+    python scripts/partitions.py retire --table story_views --retain-months 1
+    python scripts/partitions.py retire --table messages --retain-months 24 --detach-only
+
+Политики по умолчанию (ключ и срок хранения) лежат в backend/worker/partitions.py;
+в облаке то же обслуживание раз в сутки выполняет задача partitions.maintain.
+'''
+import argparse
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS.parent / 'backend' / 'worker'))
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f}{unit}'
+        size /= 1024
+    return f'{size:.1f}TB'
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--schema', default=os.environ.get('MAIN_DB_SCHEMA', 'public'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('status', help='секции, число строк (по статистике) и размер')
+
+    ensure = commands.add_parser('ensure', help='создать недостающие секции')
+    ensure.add_argument('--table', action='append', help='по умолчанию все таблицы')
+    ensure.add_argument('--months-ahead', type=int, default=3)
+    ensure.add_argument('--from', dest='start', metavar='YYYY-MM', help='создать и прошлые месяцы, начиная с этого')
+
+    retire = commands.add_parser('retire', help='отсоединить или удалить старые секции')
+    retire.add_argument('--table', action='append', help='по умолчанию все таблицы со сроком хранения')
+    retire.add_argument('--retain-months', type=int, help='вместо срока из политики')
+    retire.add_argument('--detach-only', action='store_true', help='отсоединить, но не удалять (для архива)')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+
+    import psycopg2
+    import partitions
+
+    tables = getattr(args, 'table', None) or list(partitions.POLICIES)
+    unknown = [t for t in tables if t not in partitions.POLICIES]
+    if unknown:
+        parser.error(f'неизвестные таблицы: {", ".join(unknown)}')
+
+    conn = psycopg2.connect(args.dsn)
+    cur = conn.cursor()
+    try:
+        if args.command == 'status':
+            for table in tables:
+                rows = partitions.list_partitions(cur, table)
+                print(f'{table} (by {partitions.POLICIES[table]["key"]}), {len(rows)} partitions:')
+                for name, tuples, size in rows:
+                    print(f'  {name:<28} {max(tuples, 0):>12,} rows {format_size(size):>8}')
+        elif args.command == 'ensure':
+            start = datetime.strptime(args.start, '%Y-%m').date() if args.start else None
+            for table in tables:
+                created = partitions.ensure(cur, table, args.months_ahead, start)
+                conn.commit()
+                print(f'{table}: created {created} partitions')
+        else:
+            for table in tables:
+                retain = args.retain_months or partitions.POLICIES[table]['retain_months']
+                if not retain:
+                    print(f'{table}: no retention policy, skipped')
+                    continue
+                retired = partitions.retire(cur, table, retain, drop=not args.detach_only)
+                conn.commit()
+                action = 'detached' if args.detach_only else 'dropped'
+                print(f'{table}: {action} {", ".join(retired) or "nothing"}')
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+'''Локальный запуск очереди задач из backend/worker.
+
+    python scripts/worker.py run --processes 4 --batch 20
+    python scripts/worker.py run --once --local-s3 /tmp/s3 --task media.process
+    python scripts/worker.py enqueue stories.expire
+    python scripts/worker.py stats
+    python scripts/worker.py retry-dead --task media.process
+
+Каждый процесс держит своё соединение и забирает задачи через
+FOR UPDATE SKIP LOCKED, поэтому процессы и облачный обработчик
+backend/worker/index.py можно запускать одновременно.
+'''
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from multiprocessing import Process
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS.parent / 'backend' / 'worker'))
+
+
+def connect():
+    import psycopg2
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+def work_loop(args) -> None:
+    import jobqueue
+    import storage
+    from tasks import HANDLERS, PERIODIC
+
+    if args.local_s3:
+        sys.path.insert(0, str(SCRIPTS))
+        from local_s3 import LocalS3
+        storage._s3_client = LocalS3(root=args.local_s3)
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+
+    conn = connect()
+    jobqueue.schedule_periodic(conn, PERIODIC)
+    idle_sleep = args.idle_sleep
+    while not stopping:
+        started = time.perf_counter()
+        stats = jobqueue.drain(conn, HANDLERS, PERIODIC, args.batch, args.time_budget,
+                               batch_size=args.batch, tasks=args.task)
+        handled = sum(stats.values())
+        if handled:
+            print(f'[{os.getpid()}] {stats} in {time.perf_counter() - started:.2f}s', flush=True)
+            idle_sleep = args.idle_sleep
+        if args.once:
+            break
+        if not handled:
+            # Пустая очередь: опрашиваем всё реже, но не реже раза в max_idle_sleep
+            time.sleep(idle_sleep)
+            idle_sleep = min(idle_sleep * 2, args.max_idle_sleep)
+    conn.close()
+
+
+def cmd_run(args) -> None:
+    if args.processes <= 1:
+        work_loop(args)
+        return
+    workers = [Process(target=work_loop, args=(args,)) for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def cmd_enqueue(args) -> None:
+    from jobs import enqueue
+
+    conn = connect()
+    cur = conn.cursor()
+    enqueue(cur, args.task_name, json.loads(args.payload), args.delay, args.dedupe_key)
+    conn.commit()
+    conn.close()
+
+
+def cmd_stats(args) -> None:
+    from jobqueue import SELECT_QUEUE_STATS
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(SELECT_QUEUE_STATS)
+    print(f'{"task":<20} {"status":<10} {"count":>8}  oldest run_at')
+    for task, status, count, oldest in cur.fetchall():
+        print(f'{task:<20} {status:<10} {count:>8}  {oldest:%Y-%m-%d %H:%M:%S}')
+    conn.close()
+
+
+def cmd_retry_dead(args) -> None:
+    from jobqueue import RESURRECT_DEAD_JOBS
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(RESURRECT_DEAD_JOBS, (args.task, args.task))
+    print(f'requeued {cur.rowcount} dead jobs')
+    conn.commit()
+    conn.close()
+
+
+def main() -> int:
+    from tasks import HANDLERS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='выполнять задачи в цикле')
+    run.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    run.add_argument('--batch', type=int, default=20)
+    run.add_argument('--time-budget', type=float, default=30.0, help='секунд на одну порцию')
+    run.add_argument('--task', action='append', choices=sorted(HANDLERS), help='только эти задачи')
+    run.add_argument('--idle-sleep', type=float, default=0.5)
+    run.add_argument('--max-idle-sleep', type=float, default=10.0)
+    run.add_argument('--once', action='store_true', help='обработать одну порцию и выйти')
+    run.add_argument('--local-s3', metavar='DIR', help='хранить файлы в папке вместо S3')
+    run.set_defaults(func=cmd_run)
+
+    enqueue = commands.add_parser('enqueue', help='поставить задачу вручную')
+    enqueue.add_argument('task_name', choices=sorted(HANDLERS))
+    enqueue.add_argument('--payload', default='{}', help='JSON')
+    enqueue.add_argument('--delay', type=float, default=0, help='через сколько секунд выполнить')
+    enqueue.add_argument('--dedupe-key')
+    enqueue.set_defaults(func=cmd_enqueue)
+
+    stats = commands.add_parser('stats', help='размер очереди по задачам и статусам')
+    stats.set_defaults(func=cmd_stats)
+
+    retry_dead = commands.add_parser('retry-dead', help='вернуть в очередь задачи, исчерпавшие попытки')
+    retry_dead.add_argument('--task', choices=sorted(HANDLERS))
+    retry_dead.set_defaults(func=cmd_retry_dead)
+
+    args = parser.parse_args()
+    if 'DATABASE_URL' not in os.environ:
+        parser.error('нужен DATABASE_URL')
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,7 +12,16 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from
 import Icon from '@/components/ui/icon';
 import { toast } from 'sonner';
 
-const API = {
+// VITE_API_BASE=http://localhost:8000 направляет запросы на scripts/devserver.py
+const API_BASE = import.meta.env.VITE_API_BASE;
+
+const API = API_BASE ? {
+  auth: `${API_BASE}/auth`,
+  shop: `${API_BASE}/shop`,
+  posts: `${API_BASE}/posts`,
+  stories: `${API_BASE}/stories`,
+  channels: `${API_BASE}/channels`
+} : {
   auth: 'https://functions.poehali.dev/6639f3c0-0a9a-4c32-a527-114854560ab8',
   shop: 'https://functions.poehali.dev/235f1e44-6673-41f0-a4be-523585301f01',
   posts: 'https://functions.poehali.dev/e3a43d92-c791-49eb-bf4e-5c207a568956',
@@ -20,6 +29,21 @@ const API = {
   channels: 'https://functions.poehali.dev/49ac942f-6c38-4424-a77c-3c52af77c5a2'
 };
 
+// После записи бэкенд присылает X-Fresh-Until: пока он действует, чтения идут
+// на основную базу, и пользователь сразу видит свой пост, лайк или комментарий
+const FRESH_MARKER_TTL_MS = 10000;
+let freshMarker = { value: '', receivedAt: 0 };
+
+const apiFetch = async (url: string, init?: RequestInit) => {
+  const fresh = freshMarker.value && Date.now() - freshMarker.receivedAt < FRESH_MARKER_TTL_MS;
+  const response = await fetch(fresh ? `${url}?fresh_until=${freshMarker.value}` : url, init);
+  const marker = response.headers.get('X-Fresh-Until');
+  if (marker) {
+    freshMarker = { value: marker, receivedAt: Date.now() };
+  }
+  return response;
+};
+
 const PREMIUM_EMOJIS = ['🔥', '💎', '⭐', '✨', '🎉', '💫', '🌟', '👑', '🎯', '💯', '🚀', '🦄', '🌈', '💖', '🎨'];
 const RAINBOW_THEMES = ['red', 'orange', 'yellow', 'green', 'blue', 'indigo', 'violet'];
 
@@ -225,7 +249,7 @@ const Index = () => {
 
   const loadPosts = async () => {
     try {
-      const response = await fetch(API.posts);
+      const response = await apiFetch(API.posts);
       const data = await response.json();
       setPosts(data.posts || []);
     } catch (error) {
@@ -235,7 +259,7 @@ const Index = () => {
 
   const loadStories = async () => {
     try {
-      const response = await fetch(API.stories);
+      const response = await apiFetch(API.stories);
       const data = await response.json();
       setStories(data.stories || []);
     } catch (error) {
@@ -245,7 +269,7 @@ const Index = () => {
 
   const loadChannels = async () => {
     try {
-      const response = await fetch(API.channels);
+      const response = await apiFetch(API.channels);
       const data = await response.json();
       setChannels(data.channels || []);
     } catch (error) {
@@ -255,7 +279,7 @@ const Index = () => {
 
   const loadComments = async (postId: number) => {
     try {
-      const response = await fetch(API.posts, {
+      const response = await apiFetch(API.posts, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -280,7 +304,7 @@ const Index = () => {
     const display_name = authMode === 'register' ? (formData.get('display_name') as string) : '';
 
     try {
-      const response = await fetch(API.auth, {
+      const response = await apiFetch(API.auth, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -317,7 +341,7 @@ const Index = () => {
     if (!user || !newPostContent.trim()) return;
 
     try {
-      const response = await fetch(API.posts, {
+      const response = await apiFetch(API.posts, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -356,7 +380,7 @@ const Index = () => {
     }
 
     try {
-      const response = await fetch(API.posts, {
+      const response = await apiFetch(API.posts, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -395,7 +419,7 @@ const Index = () => {
     if (!user || !newComment[postId]?.trim()) return;
 
     try {
-      const response = await fetch(API.posts, {
+      const response = await apiFetch(API.posts, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -429,7 +453,7 @@ const Index = () => {
       const base64 = (reader.result as string).split(',')[1];
       
       try {
-        const response = await fetch(API.stories, {
+        const response = await apiFetch(API.stories, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -459,7 +483,7 @@ const Index = () => {
     if (!user || !newChannelName.trim()) return;
 
     try {
-      const response = await fetch(API.channels, {
+      const response = await apiFetch(API.channels, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -490,7 +514,7 @@ const Index = () => {
     if (!user) return;
 
     try {
-      const response = await fetch(API.shop, {
+      const response = await apiFetch(API.shop, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({